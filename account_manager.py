@@ -3,23 +3,26 @@ import uuid
 import datetime
 from typing import Dict, List, Optional
 from pyrogram import Client
+from pyrogram.errors import FloodWait
+from sqlalchemy import text
 from bot.db import SessionLocal, Account, AccountStatus, Channel, AccountChannel
 from config import PYROGRAM_API_ID, PYROGRAM_API_HASH
+from anti_spam_guide import anti_spam_guide
+from rate_limiter import rate_limiter
+from post_classifier import post_classifier, stored_post_text
+from feature_cache import feature_cache
 
 class AccountManager:
     def __init__(self):
         self.accounts: Dict[str, Client] = {}
-        self.account_limits = {
-            "max_channels_per_account": 50,
-            "max_requests_per_hour": 100,
-            "max_requests_per_day": 1000
-        }
+        self.account_limits = anti_spam_guide.account_limits
+        self.rate_limiter = rate_limiter
     
     async def initialize_accounts(self):
         """Инициализирует все аккаунты"""
         async with SessionLocal() as session:
             # Получаем все активные аккаунты из БД
-            accounts = await session.execute("SELECT * FROM accounts WHERE status = 'Active'")
+            accounts = await session.execute(text("SELECT * FROM accounts WHERE status = 'Active'"))
             
             for account_data in accounts:
                 account_id = account_data.account_id
@@ -48,7 +51,7 @@ class AccountManager:
         """Возвращает доступный аккаунт для работы"""
         async with SessionLocal() as session:
             # Ищем аккаунт с наименьшей нагрузкой
-            accounts = await session.execute("""
+            accounts = await session.execute(text("""
                 SELECT a.account_id, COUNT(ac.channel_id) as channel_count
                 FROM accounts a
                 LEFT JOIN account_channels ac ON a.account_id = ac.account_id
@@ -56,7 +59,7 @@ class AccountManager:
                 GROUP BY a.account_id
                 ORDER BY channel_count ASC
                 LIMIT 1
-            """)
+            """))
             
             for account in accounts:
                 account_id = account.account_id
@@ -68,6 +71,31 @@ class AccountManager:
         
         return None
     
+    def time_until_free(self, account_id: str, action: str = "get_chat_history") -> float:
+        """Сколько секунд аккаунту ждать до свободного бюджета под действие"""
+        return self.rate_limiter.time_until_free(account_id, action)
+    
+    async def get_chat(self, account_id: str, chat_id):
+        client = self.accounts[account_id]
+        return await self.rate_limiter.call(account_id, "get_chat", client.get_chat, chat_id)
+    
+    async def join_chat(self, account_id: str, chat_id):
+        client = self.accounts[account_id]
+        return await self.rate_limiter.call(account_id, "join_chat", client.join_chat, chat_id)
+    
+    async def get_me(self, account_id: str):
+        client = self.accounts[account_id]
+        return await self.rate_limiter.call(account_id, "get_me", client.get_me)
+    
+    async def get_messages(self, account_id: str, chat_id, message_ids):
+        client = self.accounts[account_id]
+        return await self.rate_limiter.call(account_id, "get_messages", client.get_messages, chat_id, message_ids)
+    
+    def get_chat_history(self, account_id: str, chat_id, limit: int = 0, offset_id: int = 0):
+        """История чата постранично, каждая страница проходит через лимитер"""
+        client = self.accounts[account_id]
+        return self.rate_limiter.iter_history(account_id, client, chat_id, limit=limit, offset_id=offset_id)
+    
     async def subscribe_to_channel(self, account_id: str, channel_username: str) -> bool:
         """Подписывает аккаунт на канал"""
         try:
@@ -76,8 +104,8 @@ class AccountManager:
                 return False
             
             # Подписываемся на канал
-            chat = await client.get_chat(channel_username)
-            await client.join_chat(chat.id)
+            chat = await self.get_chat(account_id, channel_username)
+            await self.join_chat(account_id, chat.id)
             
             # Сохраняем связь в БД
             async with SessionLocal() as session:
@@ -119,7 +147,7 @@ class AccountManager:
                 return []
             
             posts = []
-            async for message in client.get_chat_history(channel_username, limit=limit):
+            async for message in self.get_chat_history(account_id, channel_username, limit=limit):
                 if message.text or message.caption:
                     post_data = {
                         "id": message.id,
@@ -127,13 +155,19 @@ class AccountManager:
                         "date": message.date.isoformat(),
                         "views": getattr(message, 'views', 0),
                         "reactions": {r.emoji: r.count for r in message.reactions.reactions} if message.reactions else {},
-                        "forwards": getattr(message, 'forwards', 0),
-                        "is_ad": self.detect_ad_post(message.text or message.caption or ""),
-                        "format": self.detect_post_format(message.text or message.caption or ""),
-                        "cta": self.extract_cta(message.text or message.caption or "")
+                        "forwards": getattr(message, 'forwards', 0)
                     }
                     posts.append(post_data)
             
+            # Классифицируем всю пачку тем же классификатором, что и userbot_stats
+            features = await feature_cache.classify_many([stored_post_text(post["text"]) for post in posts])
+            for post, post_features in zip(posts, features):
+                post["is_ad"] = post_features["is_ad"]
+                post["format"] = post_features["format"]
+                post["cta"] = post_features["cta"]
+                post["topic"] = post_features["topic"]
+                post["tags"] = post_features["tags"]
+            
             return posts
             
         except Exception as e:
@@ -142,84 +176,15 @@ class AccountManager:
     
     def detect_ad_post(self, text: str) -> bool:
         """Определяет, является ли пост рекламным"""
-        if not text:
-            return False
-        
-        score = 0
-        text_lower = text.lower()
-        
-        # Проверяем внешние ссылки
-        if any(pattern in text for pattern in ['https://', 't.me/', '@', 'tg://']):
-            score += 2
-        
-        # Проверяем CTA фразы
-        cta_phrases = ['подпишись', 'читай', 'узнай', 'начни', 'перейди', 'жми', 'вступай']
-        if any(phrase in text_lower for phrase in cta_phrases):
-            score += 1
-        
-        # Проверяем количество эмодзи
-        emoji_count = len([c for c in text if c in '🔴🔵⚡❤️💙💚💛💜🖤🤍🤎'])
-        if emoji_count / len(text) > 0.1:  # 10% эмодзи
-            score += 1
-        
-        # Проверяем количество заглавных букв
-        caps_count = len([c for c in text if c.isupper()])
-        if caps_count / len(text) > 0.3:  # 30% заглавных
-            score += 1
-        
-        return score >= 3
+        return post_classifier.detect_ad_post(text)
     
     def detect_post_format(self, text: str) -> str:
         """Определяет формат поста"""
-        if not text:
-            return "other"
-        
-        text_lower = text.lower()
-        
-        # Проверяем форматы
-        if any(pattern in text_lower for pattern in ['1.', '2.', '3.', '-', '•']):
-            return "list"
-        elif any(pattern in text_lower for pattern in ['однажды', 'я помню', 'вчера', 'когда-то']):
-            return "story"
-        elif any(pattern in text_lower for pattern in ['по данным', 'рост', '%', 'исследование']):
-            return "analytics"
-        elif any(pattern in text_lower for pattern in ['мне кажется', 'по моему мнению', 'я думаю']):
-            return "opinion"
-        elif any(pattern in text_lower for pattern in ['сделай', 'настрой', 'скачай', 'шаг']):
-            return "howto"
-        elif any(pattern in text_lower for pattern in ['произошло', 'сегодня', 'по сообщениям']):
-            return "news"
-        elif any(pattern in text_lower for pattern in ['ты можешь', 'поверь в себя', 'не сдавайся']):
-            return "motivation"
-        elif any(pattern in text_lower for pattern in ['лол', 'ахаха', 'мем', 'прикол']):
-            return "fun"
-        elif any(pattern in text_lower for pattern in ['—', 'сказал', 'цитата']):
-            return "quote"
-        
-        return "other"
+        return post_classifier.detect_post_format(text)
     
     def extract_cta(self, text: str) -> Optional[str]:
         """Извлекает CTA из текста"""
-        if not text:
-            return None
-        
-        lines = text.split('\n')
-        cta_patterns = [
-            'подпишись', 'следи за', 'присоединяйся', 'жми подписаться',
-            'пиши в комменты', 'оцени', 'смотри дальше', 'сохрани',
-            'жми на ссылку', 'а ты как думаешь?', 'пиши + если полезно',
-            'что скажешь?', 'читай', 'узнай', 'начни', 'перейди',
-            'жми', 'вступай', 'переходи сюда', 'канал', 'бот'
-        ]
-        
-        # Проверяем последние 1-3 строки
-        for i in range(min(3, len(lines))):
-            line = lines[-(i+1)].strip()
-            for pattern in cta_patterns:
-                if pattern in line.lower():
-                    return line
-        
-        return None
+        return post_classifier.extract_cta(text)
     
     async def update_account_status(self, account_id: str, status: AccountStatus):
         """Обновляет статус аккаунта"""
@@ -235,7 +200,7 @@ class AccountManager:
         while True:
             try:
                 async with SessionLocal() as session:
-                    accounts = await session.execute("SELECT * FROM accounts")
+                    accounts = await session.execute(text("SELECT * FROM accounts"))
                     
                     for account_data in accounts:
                         account_id = account_data.account_id
@@ -244,8 +209,11 @@ class AccountManager:
                         if client:
                             try:
                                 # Проверяем, что аккаунт работает
-                                me = await client.get_me()
+                                me = await self.get_me(account_id)
                                 print(f"[monitor] Аккаунт {account_id} активен: {me.username}")
+                            except FloodWait as e:
+                                # Аккаунт жив, просто упирается в лимит — лимитер уже заблокировал его
+                                print(f"[monitor] Аккаунт {account_id} в FloodWait на {e.value} с")
                             except Exception as e:
                                 print(f"[monitor] Аккаунт {account_id} неактивен: {e}")
                                 await self.update_account_status(account_id, AccountStatus.Error)
@@ -265,14 +233,14 @@ class AccountManager:
         
         async with SessionLocal() as session:
             # Получаем активные аккаунты с количеством каналов
-            accounts = await session.execute("""
+            accounts = await session.execute(text("""
                 SELECT a.account_id, COUNT(ac.channel_id) as channel_count
                 FROM accounts a
                 LEFT JOIN account_channels ac ON a.account_id = ac.account_id
                 WHERE a.status = 'Active'
                 GROUP BY a.account_id
                 ORDER BY channel_count ASC
-            """)
+            """))
             
             account_list = [(acc.account_id, acc.channel_count or 0) for acc in accounts]
             
@@ -0,0 +1,420 @@
+"""
+Линейная модель рекламы: логистическая регрессия на хэшированных словах и
+структурных признаках поста
+
+Текстовые признаки — первые PREFIX_LENGTH букв каждого слова (грубая основа,
+сглаживает окончания), хэшированные в HASH_DIMENSIONS. Хэши считаются в NumPy
+по массиву кодов всей пачки, без цикла по словам.
+Структурные признаки (ссылки, упоминания, t.me, два абзаца, CTA, доли эмодзи
+и заглавных, длина, строки) берутся из text_stats и стандартизуются средним и
+разбросом обучающей выборки. Предсказание для пачки — np.bincount весов
+слов по номеру текста плюс произведение матрицы структурных признаков на веса.
+
+Веса лежат в одном .npz (AD_MODEL_PATH). Новая модель подключается заменой
+файла и перезапуском: отпечаток файла входит в версию классификатора, поэтому
+кэш признаков перестает отдавать старые метки, а reclassify.py пересчитает посты.
+
+Разметка posts.ad_label делается вручную через CSV: export выгружает случайные
+неразмеченные посты с пустой колонкой is_ad, ее заполняют 1/0 (да/нет), а label
+записывает заполненные строки в БД. Пустое значение оставляет пост неразмеченным.
+
+    python ad_model.py export to_label.csv [--limit 500]  # посты для разметки
+    python ad_model.py label to_label.csv               # записать разметку в posts.ad_label
+    python ad_model.py train [--out models/ad_model.npz]  # обучить по posts.ad_label
+    python ad_model.py evaluate                         # качество текущей модели на разметке
+"""
+
+import argparse
+import asyncio
+import csv
+import datetime
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+import text_stats
+from config import AD_MODEL_PATH
+
+HASH_BITS = 18
+HASH_DIMENSIONS = 1 << HASH_BITS  # Хэшированных признаков слов
+PREFIX_LENGTH = 5  # Символов начала слова, по которым считается признак
+PREFIX_MULTIPLIER = 1000003  # Множитель полиномиального хэша
+FIBONACCI_MULTIPLIER = 2654435761  # Перемешивание хэша перед взятием старших бит
+STRUCTURAL_FEATURES = (
+    "links", "mentions", "tme_links", "two_paragraphs", "has_cta",
+    "emoji_ratio", "caps_ratio", "log_length", "lines"
+)
+STATS_FIELDS = ("emoji", "caps", "lines", "links", "mentions")
+DEFAULT_THRESHOLD = 0.5
+
+TRAIN_EPOCHS = 300
+TRAIN_LEARNING_RATE = 0.5
+TRAIN_L2 = 1e-4
+VALIDATION_SHARE = 0.2  # Доля разметки для подбора порога и оценки
+MIN_LABELS = 200  # Меньше разметки — модель не обучаем
+EXPORT_LIMIT = 500  # Постов в одном файле для ручной разметки
+LABEL_BATCH_SIZE = 500  # post_id в одном UPDATE при записи разметки
+LABEL_VALUES = {"1": True, "true": True, "да": True, "yes": True,
+                "0": False, "false": False, "нет": False, "no": False}
+
+_lower_table: Optional[np.ndarray] = None
+
+def get_lower_table() -> np.ndarray:
+    """Код символа -> код в нижнем регистре ("ё" -> "е"), строится один раз
+
+    Регистр сводим только в BMP: для признаков этого достаточно, а таблица строится в разы быстрее.
+    """
+    global _lower_table
+    if _lower_table is None:
+        table = np.arange(text_stats.MAX_CODEPOINT, dtype=np.uint32)
+        for code in range(0x10000):
+            lowered = chr(code).lower()
+            if len(lowered) == 1 and lowered != chr(code):
+                table[code] = ord(lowered)
+        table[ord("ё")] = table[ord("Ё")] = ord("е")
+        _lower_table = table
+    return _lower_table
+
+def word_features(encoded, count: int) -> Dict[str, np.ndarray]:
+    """Признаки слов пачки: номер признака, номер текста и норма 1/sqrt(число слов текста)
+
+    Признак слова — хэш его первых PREFIX_LENGTH символов в нижнем регистре
+    (грубая основа). Считается по массиву кодов всей пачки, без цикла по словам.
+    """
+    codes, segments, _ = encoded
+    word = text_stats.get_table("word")[codes]
+    starts = word.copy()
+    starts[1:] &= ~word[:-1]
+    positions = np.flatnonzero(starts)
+
+    # Хвост из несловных символов: окно PREFIX_LENGTH не выходит за массив
+    word = np.concatenate([word, np.zeros(PREFIX_LENGTH, dtype=bool)])
+    padded = np.concatenate([codes, np.zeros(PREFIX_LENGTH, dtype=codes.dtype)])
+    lower = get_lower_table()
+    hashes = lower[codes[positions]]
+    alive = np.ones(len(positions), dtype=bool)
+    for offset in range(1, PREFIX_LENGTH):
+        shifted = positions + offset
+        alive &= word[shifted]
+        hashes *= np.uint32(PREFIX_MULTIPLIER)
+        hashes += lower[padded[shifted]] * alive
+    hashes *= np.uint32(FIBONACCI_MULTIPLIER)
+    hashes >>= np.uint32(32 - HASH_BITS)
+    ids = hashes.astype(np.int64)
+
+    word_segments = segments[positions].astype(np.int64)
+    totals = np.bincount(word_segments, minlength=count)[:count]
+    norms = np.zeros(count, dtype=np.float64)
+    np.divide(1.0, np.sqrt(totals), out=norms, where=totals > 0)
+    return {"ids": ids, "segments": word_segments, "norms": norms}
+
+def featurize(texts: Sequence[Optional[str]], ctas: Sequence[Optional[str]],
+              stats: Dict[str, np.ndarray] = None, encoded=None) -> Dict[str, np.ndarray]:
+    """Признаки пачки: слова и матрица структурных признаков
+
+    stats — готовый результат text_stats.text_arrays для этих текстов (с полями STATS_FIELDS),
+    encoded — готовый text_stats.encode(texts).
+    """
+    texts = [text or "" for text in texts]
+    if encoded is None:
+        encoded = text_stats.encode(texts)
+    features = word_features(encoded, len(texts))
+    if stats is None:
+        stats = text_stats.text_arrays(texts, fields=STATS_FIELDS, encoded=encoded)
+    ratios = text_stats.style_ratios(stats)
+    features["dense"] = np.column_stack([
+        np.log1p(stats["links"]),
+        np.log1p(stats["mentions"]),
+        np.log1p(np.fromiter((text.count("t.me/") for text in texts), dtype=np.float64, count=len(texts))),
+        np.fromiter((text.count("\n\n") == 1 for text in texts), dtype=np.float64, count=len(texts)),
+        np.fromiter((cta is not None for cta in ctas), dtype=np.float64, count=len(texts)),
+        ratios["emoji_ratio"],
+        ratios["caps_ratio"],
+        np.log1p(stats["length"]),
+        np.log1p(stats["lines"])
+    ]) if texts else np.zeros((0, len(STRUCTURAL_FEATURES)))
+    return features
+
+def _sigmoid(values: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-np.clip(values, -30, 30)))
+
+def _word_sums(weights: np.ndarray, features: Dict[str, np.ndarray]) -> np.ndarray:
+    """Нормированная сумма весов слов каждого текста"""
+    count = len(features["norms"])
+    sums = np.bincount(features["segments"], weights=weights[features["ids"]], minlength=count)[:count]
+    return sums * features["norms"]
+
+def file_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+class AdModel:
+    def __init__(self, hash_weights: np.ndarray, dense_weights: np.ndarray, bias: float,
+                 mean: np.ndarray, scale: np.ndarray, threshold: float = DEFAULT_THRESHOLD,
+                 meta: Dict = None, digest: str = None):
+        self.hash_weights = hash_weights
+        self.dense_weights = dense_weights
+        self.bias = bias
+        self.mean = mean
+        self.scale = scale
+        self.threshold = threshold
+        self.meta = meta or {}
+        self.digest = digest
+
+    @classmethod
+    def load(cls, path: str = AD_MODEL_PATH) -> "AdModel":
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("hash_dimensions") != HASH_DIMENSIONS or tuple(meta.get("structural_features", ())) != STRUCTURAL_FEATURES:
+                raise ValueError(f"Модель {path} обучена на других признаках")
+            return cls(
+                hash_weights=data["hash_weights"], dense_weights=data["dense_weights"],
+                bias=float(data["bias"]), mean=data["mean"], scale=data["scale"],
+                threshold=float(data["threshold"]), meta=meta, digest=file_digest(path)
+            )
+
+    @classmethod
+    def load_if_exists(cls, path: str = AD_MODEL_PATH) -> Optional["AdModel"]:
+        """Модель из файла или None (тогда работают правила post_classifier)"""
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            return cls.load(path)
+        except Exception as e:
+            print(f"[ad_model] Не удалось загрузить модель {path}: {e}")
+            return None
+
+    def save(self, path: str = AD_MODEL_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        meta = dict(self.meta, hash_dimensions=HASH_DIMENSIONS, structural_features=list(STRUCTURAL_FEATURES))
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path, hash_weights=self.hash_weights.astype(np.float32),
+            dense_weights=self.dense_weights.astype(np.float32), bias=np.float64(self.bias),
+            mean=self.mean, scale=self.scale, threshold=np.float64(self.threshold),
+            meta=np.array(json.dumps(meta, ensure_ascii=False))
+        )
+        os.replace(tmp_path, path)
+        self.digest = file_digest(path)
+
+    def predict_features(self, features: Dict[str, np.ndarray]) -> np.ndarray:
+        logits = _word_sums(self.hash_weights, features)
+        logits += ((features["dense"] - self.mean) / self.scale) @ self.dense_weights + self.bias
+        return _sigmoid(logits)
+
+    def predict_proba(self, texts: Sequence[Optional[str]], ctas: Sequence[Optional[str]],
+                      stats: Dict[str, np.ndarray] = None, encoded=None) -> np.ndarray:
+        """Вероятность рекламы для каждого текста пачки"""
+        return self.predict_features(featurize(texts, ctas, stats, encoded))
+
+    @classmethod
+    def train(cls, features: Dict[str, np.ndarray], labels: np.ndarray, epochs: int = TRAIN_EPOCHS,
+              learning_rate: float = TRAIN_LEARNING_RATE, l2: float = TRAIN_L2) -> "AdModel":
+        """Полнопакетный градиентный спуск; классы уравнены весами"""
+        labels = labels.astype(np.float64)
+        count = len(labels)
+        positives = labels.sum()
+        sample_weights = np.where(labels > 0, count / (2 * max(positives, 1)), count / (2 * max(count - positives, 1)))
+
+        mean = features["dense"].mean(axis=0)
+        scale = features["dense"].std(axis=0)
+        scale[scale == 0] = 1.0
+        dense = (features["dense"] - mean) / scale
+        word_norms = features["norms"][features["segments"]]
+
+        hash_weights = np.zeros(HASH_DIMENSIONS, dtype=np.float64)
+        dense_weights = np.zeros(dense.shape[1], dtype=np.float64)
+        bias = 0.0
+        for _ in range(epochs):
+            logits = _word_sums(hash_weights, features) + dense @ dense_weights + bias
+            residual = (_sigmoid(logits) - labels) * sample_weights / count
+            hash_gradient = np.bincount(
+                features["ids"], weights=residual[features["segments"]] * word_norms, minlength=HASH_DIMENSIONS
+            )
+            hash_weights -= learning_rate * (hash_gradient + l2 * hash_weights)
+            dense_weights -= learning_rate * (dense.T @ residual + l2 * dense_weights)
+            bias -= learning_rate * residual.sum()
+
+        return cls(hash_weights, dense_weights, bias, mean, scale)
+
+def _subset(features: Dict[str, np.ndarray], rows: np.ndarray) -> Dict[str, np.ndarray]:
+    """Признаки выбранных текстов с перенумерацией"""
+    position = np.full(len(features["norms"]), -1, dtype=np.int64)
+    position[rows] = np.arange(len(rows))
+    keep = position[features["segments"]] >= 0
+    return {
+        "ids": features["ids"][keep],
+        "segments": position[features["segments"][keep]],
+        "norms": features["norms"][rows],
+        "dense": features["dense"][rows]
+    }
+
+def evaluate(probabilities: np.ndarray, labels: np.ndarray, threshold: float) -> Dict:
+    predicted = probabilities >= threshold
+    labels = labels.astype(bool)
+    true_positive = int(np.count_nonzero(predicted & labels))
+    precision = true_positive / max(int(predicted.sum()), 1)
+    recall = true_positive / max(int(labels.sum()), 1)
+    return {
+        "accuracy": float(np.mean(predicted == labels)) if len(labels) else 0.0,
+        "precision": precision,
+        "recall": recall,
+        "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    }
+
+def best_threshold(probabilities: np.ndarray, labels: np.ndarray) -> float:
+    """Порог с наибольшим F1 на отложенной выборке"""
+    candidates = np.linspace(0.05, 0.95, 19)
+    return float(max(candidates, key=lambda threshold: evaluate(probabilities, labels, threshold)["f1"]))
+
+def fit(texts: List[str], ctas: List[Optional[str]], labels: Sequence[bool], seed: int = 0) -> Dict:
+    """Обучает модель, подбирает порог на отложенной части и дообучает на всей разметке"""
+    labels = np.asarray(labels, dtype=bool)
+    features = featurize(texts, ctas)
+    order = np.random.RandomState(seed).permutation(len(labels))
+    split = int(len(labels) * (1 - VALIDATION_SHARE))
+    train_rows, validation_rows = order[:split], order[split:]
+
+    model = AdModel.train(_subset(features, train_rows), labels[train_rows])
+    validation_probabilities = model.predict_features(_subset(features, validation_rows))
+    threshold = best_threshold(validation_probabilities, labels[validation_rows])
+    metrics = evaluate(validation_probabilities, labels[validation_rows], threshold)
+
+    model = AdModel.train(features, labels)
+    model.threshold = threshold
+    model.meta = {
+        "trained_at": datetime.datetime.utcnow().isoformat(),
+        "samples": int(len(labels)),
+        "positives": int(labels.sum()),
+        "validation": metrics
+    }
+    return {"model": model, "validation": metrics}
+
+async def load_labeled_posts() -> Dict[str, list]:
+    """Тексты и ручная разметка (posts.ad_label)"""
+    from sqlalchemy import select
+    from bot.db import SessionLocal, Post
+    from post_classifier import join_title_and_body
+
+    async with SessionLocal() as session:
+        result = await session.execute(
+            select(Post.title, Post.body, Post.ad_label).where(Post.ad_label.is_not(None))
+        )
+        rows = result.all()
+    return {
+        "texts": [join_title_and_body(row.title, row.body) for row in rows],
+        "labels": [bool(row.ad_label) for row in rows]
+    }
+
+async def export_unlabeled(path: str, limit: int = EXPORT_LIMIT) -> int:
+    """Пишет в CSV случайные неразмеченные посты с пустой колонкой is_ad"""
+    from sqlalchemy import func, select
+    from bot.db import SessionLocal, Post
+    from post_classifier import join_title_and_body
+
+    async with SessionLocal() as session:
+        result = await session.execute(
+            select(Post.post_id, Post.title, Post.body)
+            .where(Post.ad_label.is_(None))
+            .order_by(func.random())
+            .limit(limit)
+        )
+        rows = result.all()
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("post_id", "is_ad", "text"))
+        for row in rows:
+            writer.writerow((row.post_id, "", join_title_and_body(row.title, row.body)))
+    return len(rows)
+
+def parse_label(value: Optional[str]) -> Optional[bool]:
+    """Значение колонки is_ad: 1/0, true/false, да/нет; пустое — None"""
+    value = (value or "").strip().lower()
+    if not value:
+        return None
+    if value not in LABEL_VALUES:
+        raise ValueError(f"Непонятная метка рекламы: {value!r}")
+    return LABEL_VALUES[value]
+
+async def import_labels(path: str) -> Dict[str, int]:
+    """Записывает заполненные метки из CSV (post_id, is_ad) в posts.ad_label"""
+    from sqlalchemy import update
+    from bot.db import SessionLocal, Post
+
+    by_label = {True: [], False: []}
+    skipped = 0
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            try:
+                label = parse_label(row.get("is_ad"))
+            except ValueError as e:
+                raise ValueError(f"{path}:{line}: {e}") from None
+            if label is None or not row.get("post_id"):
+                skipped += 1
+                continue
+            by_label[label].append(row["post_id"])
+
+    labeled = 0
+    async with SessionLocal() as session:
+        for label, post_ids in by_label.items():
+            for i in range(0, len(post_ids), LABEL_BATCH_SIZE):
+                result = await session.execute(
+                    update(Post)
+                    .where(Post.post_id.in_(post_ids[i:i + LABEL_BATCH_SIZE]))
+                    .values(ad_label=label)
+                    .execution_options(synchronize_session=False)
+                )
+                labeled += result.rowcount
+        await session.commit()
+    rows = sum(len(post_ids) for post_ids in by_label.values())
+    return {"labeled": labeled, "missing": rows - labeled, "skipped": skipped}
+
+async def main():
+    parser = argparse.ArgumentParser(description="Модель рекламных постов")
+    parser.add_argument("command", choices=("export", "label", "train", "evaluate"))
+    parser.add_argument("path", nargs="?", help="CSV для export/label")
+    parser.add_argument("--out", default=AD_MODEL_PATH)
+    parser.add_argument("--min-labels", type=int, default=MIN_LABELS)
+    parser.add_argument("--limit", type=int, default=EXPORT_LIMIT, help="постов в export")
+    args = parser.parse_args()
+
+    if args.command in ("export", "label"):
+        if not args.path:
+            parser.error(f"{args.command}: укажите путь к CSV")
+        if args.command == "export":
+            count = await export_unlabeled(args.path, args.limit)
+            print(f"✅ {count} постов для разметки в {args.path}: заполните колонку is_ad (1/0)")
+        else:
+            result = await import_labels(args.path)
+            print(f"✅ Размечено постов: {result['labeled']}, не найдено в БД: {result['missing']}, "
+                  f"без метки: {result['skipped']}")
+        return
+
+    from post_classifier import AD_SCORE_THRESHOLD, post_classifier
+    data = await load_labeled_posts()
+    texts, labels = data["texts"], data["labels"]
+    ctas = [post_classifier.extract_cta(text) for text in texts]
+    print(f"[ad_model] Размеченных постов: {len(labels)}, рекламных: {sum(labels)}")
+
+    if args.command == "train":
+        if len(labels) < args.min_labels or len(set(labels)) < 2:
+            print(f"❌ Нужно хотя бы {args.min_labels} размеченных постов обоих классов")
+            return
+        result = fit(texts, ctas, labels)
+        result["model"].save(args.out)
+        print(f"✅ Модель сохранена в {args.out} (порог {result['model'].threshold:.2f}): {result['validation']}")
+    else:
+        model = AdModel.load(args.out)
+        probabilities = model.predict_proba(texts, ctas)
+        rules = np.array([
+            bool(text) and sum(post_classifier.ad_components(text)["components"].values()) >= AD_SCORE_THRESHOLD
+            for text in texts
+        ])
+        print(f"Модель: {evaluate(probabilities, np.array(labels), model.threshold)}")
+        print(f"Правила: {evaluate(rules.astype(float), np.array(labels), 0.5)}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,387 @@
+"""
+Замер трендовых запросов DataAnalyzer на синтетической БД
+
+В БД из DATABASE_URL создаются каналы bench_* и --posts постов с метриками, темами,
+форматами, CTA и группами дублей. Для get_trending_topics и
+get_best_posting_times сравниваются три способа:
+
+    stream       строки posts × post_latest_metrics, суммы в Python (как до post_daily_rollup)
+    rollup_rows  строки post_daily_rollup по (тема, формат) / (час, день), суммы в Python
+    sql          trending_topics_query / best_times_query: суммы и топ считает БД
+
+Для каждого считаются строки, пришедшие из БД, и задержка (медиана и минимум
+из --repeat запусков), а также совпадение топа со stream: порядок и доля общих
+элементов. В трендовых темах stream считает различные группы дублей, а
+агрегаты — первые посты групп, поэтому места близких тем могут меняться.
+Повторный запуск с тем же --posts использует уже созданные данные.
+
+Замер пересобирает post_daily_rollup целиком, поэтому запускается только на
+отдельной БД: если в posts есть посты не bench_*, скрипт ничего не пишет и
+завершается с кодом 1.
+
+    python analytics_benchmark.py --posts 1000000 --out analytics.json
+    python analytics_benchmark.py --drop   # удалить данные bench_*
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy import select, func, delete, insert
+
+from bot.db import engine, init_db, SessionLocal, Channel, Post, PostLatestMetrics, PostDailyRollup
+from daily_rollups import (
+    TREND_MIN_ER, TIMING_MIN_ER, TIMING_MIN_VIEWS, BEST_TIMES_LIMIT, TRENDING_TOPICS_LIMIT, DAY_NAMES,
+    rebuild_rollups, trending_topics_query, best_times_query
+)
+from post_classifier import POST_FORMATS
+
+BENCH_PREFIX = "bench_"
+POSTS = 1_000_000
+CHANNELS = 200
+CATEGORY_SHARE = 0.5  # Доля каналов в категории замера
+HISTORY_DAYS = 90
+TRENDING_DAYS = 30
+DUPLICATE_SHARE = 0.05  # Доля постов-копий более раннего поста той же темы
+INSERT_CHUNK_SIZE = 5000
+REPEAT = 5
+
+TOPICS = [f"Тема {i}" for i in range(40)] + [None]
+FORMATS = list(POST_FORMATS) + ["other"]
+CTAS = [None, None, None, "Подписывайтесь", "Ссылка в описании", "Пишите в комментарии", "Переходите по ссылке"]
+
+def synthetic_rows(posts: int, channels: int, days: int, seed: int = 0):
+    """Пары (строка posts, строка post_latest_metrics) с перекосом популярности тем и часов"""
+    rng = random.Random(seed)
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    topic_weights = [1 / (rank + 1) for rank in range(len(TOPICS))]
+    hour_er = [0.5 + rng.random() for _ in range(24)]  # у каждого часа свой средний ER
+    recent_by_topic = {}
+    for i in range(posts):
+        post_id = f"{BENCH_PREFIX}{i}"
+        topic = rng.choices(TOPICS, topic_weights)[0]
+        posted_at = now - datetime.timedelta(seconds=rng.randrange(days * 86400))
+        dup_cluster_id = None
+        recent = recent_by_topic.get(topic)
+        if recent and rng.random() < DUPLICATE_SHARE:
+            dup_cluster_id = rng.choice(recent)
+        else:
+            recent_by_topic.setdefault(topic, []).append(post_id)
+            del recent_by_topic[topic][:-100]
+
+        views = int(rng.lognormvariate(7, 1.2))
+        yield (
+            {
+                "post_id": post_id,
+                "channel_id": f"{BENCH_PREFIX}{rng.randrange(channels)}",
+                "posted_at": posted_at,
+                "is_ad": rng.random() < 0.2,
+                "format": rng.choice(FORMATS),
+                "cta": rng.choice(CTAS),
+                "topic": topic,
+                "dup_cluster_id": dup_cluster_id
+            },
+            {
+                "post_id": post_id,
+                "views_count": views,
+                "reactions_total": 0,
+                "forwards": 0,
+                "comments": 0,
+                "er": round(rng.expovariate(1 / hour_er[posted_at.hour]), 3),
+                "snapshot_date": now,
+                "is_final": True
+            }
+        )
+
+async def bench_posts_count() -> int:
+    async with SessionLocal() as session:
+        return await session.scalar(
+            select(func.count()).select_from(Post).where(Post.post_id.like(f"{BENCH_PREFIX}%"))
+        )
+
+async def foreign_posts_count() -> int:
+    """Сколько в БД постов не из синтетического набора"""
+    async with SessionLocal() as session:
+        return await session.scalar(
+            select(func.count()).select_from(Post).where(Post.post_id.not_like(f"{BENCH_PREFIX}%"))
+        )
+
+async def drop_dataset():
+    async with engine.begin() as conn:
+        await conn.execute(delete(PostLatestMetrics).where(PostLatestMetrics.post_id.like(f"{BENCH_PREFIX}%")))
+        await conn.execute(delete(PostDailyRollup).where(PostDailyRollup.channel_id.like(f"{BENCH_PREFIX}%")))
+        await conn.execute(delete(Post).where(Post.post_id.like(f"{BENCH_PREFIX}%")))
+        await conn.execute(delete(Channel).where(Channel.channel_id.like(f"{BENCH_PREFIX}%")))
+
+async def create_dataset(posts: int, channels: int, days: int, seed: int = 0):
+    await drop_dataset()
+    started = time.perf_counter()
+    async with engine.begin() as conn:
+        await conn.execute(insert(Channel), [
+            {"channel_id": f"{BENCH_PREFIX}{i}", "username": f"{BENCH_PREFIX}{i}", "title": f"Канал {i}"}
+            for i in range(channels)
+        ])
+        post_rows, metrics_rows = [], []
+        for post_row, metrics_row in synthetic_rows(posts, channels, days, seed):
+            post_rows.append(post_row)
+            metrics_rows.append(metrics_row)
+            if len(post_rows) >= INSERT_CHUNK_SIZE:
+                await conn.execute(insert(Post), post_rows)
+                await conn.execute(insert(PostLatestMetrics), metrics_rows)
+                post_rows, metrics_rows = [], []
+        if post_rows:
+            await conn.execute(insert(Post), post_rows)
+            await conn.execute(insert(PostLatestMetrics), metrics_rows)
+    print(f"[bench] {posts:,} постов записано за {time.perf_counter() - started:.0f} с", file=sys.stderr)
+
+    started = time.perf_counter()
+    rows = await rebuild_rollups()
+    print(f"[bench] post_daily_rollup: {rows:,} строк за {time.perf_counter() - started:.0f} с", file=sys.stderr)
+
+# --- Трендовые темы ---
+def _fold_topics(rows, clusters: Dict = None) -> List[Dict]:
+    """Суммы строк (тема, формат) -> топ тем в формате get_trending_topics
+
+    clusters — множества групп дублей по темам: с ними posts_count считается
+    по различным группам, а не по сумме строк.
+    """
+    topics = {}
+    for row in rows:
+        topic = topics.setdefault(row["topic"] or "Общие", {
+            "topic": row["topic"] or "Общие", "posts_count": 0, "total_views": 0,
+            "total_er": 0, "rows": 0, "ads": 0, "formats": {}
+        })
+        topic["posts_count"] += row["clusters"]
+        topic["total_views"] += row["views"] or 0
+        topic["total_er"] += row["er"] or 0
+        topic["rows"] += row["rows"]
+        topic["ads"] += row["ads"]
+        format_type = row["format"] or "other"
+        topic["formats"][format_type] = topic["formats"].get(format_type, 0) + row["rows"]
+
+    result = []
+    for topic in topics.values():
+        result.append({
+            "topic": topic["topic"],
+            "posts_count": len(clusters[topic["topic"]]) if clusters else topic["posts_count"],
+            "total_views": topic["total_views"],
+            "avg_er": topic["total_er"] / topic["rows"],
+            "formats": topic["formats"],
+            "ad_percentage": topic["ads"] / topic["rows"] * 100
+        })
+    result.sort(key=lambda x: (x["posts_count"], x["avg_er"]), reverse=True)
+    return result[:TRENDING_TOPICS_LIMIT]
+
+async def trending_stream(session, channel_ids: List[str], days: int) -> Tuple[List[Dict], int]:
+    start_date = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    result = await session.execute(
+        select(
+            Post.topic, Post.format, Post.is_ad, func.coalesce(Post.dup_cluster_id, Post.post_id).label("cluster_id"),
+            PostLatestMetrics.views_count, PostLatestMetrics.er
+        )
+        .join(PostLatestMetrics, Post.post_id == PostLatestMetrics.post_id)
+        .where(Post.channel_id.in_(channel_ids), Post.posted_at >= start_date, PostLatestMetrics.er > TREND_MIN_ER)
+    )
+    groups, clusters, transferred = {}, {}, 0
+    for row in result:
+        transferred += 1
+        group = groups.setdefault((row.topic, row.format), {
+            "topic": row.topic, "format": row.format, "rows": 0, "views": 0, "er": 0, "ads": 0, "clusters": 0
+        })
+        group["rows"] += 1
+        group["views"] += row.views_count or 0
+        group["er"] += row.er or 0
+        group["ads"] += 1 if row.is_ad else 0
+        clusters.setdefault(row.topic or "Общие", set()).add(row.cluster_id)
+
+    # Копии одного текста в теме считаются одним постом
+    return _fold_topics(groups.values(), clusters), transferred
+
+async def trending_rollup_rows(session, channel_ids: List[str], days: int) -> Tuple[List[Dict], int]:
+    start_day = (datetime.datetime.utcnow() - datetime.timedelta(days=days)).date()
+    rollup = PostDailyRollup
+    result = await session.execute(
+        select(
+            rollup.topic, rollup.format,
+            func.sum(rollup.trend_count).label("rows"),
+            func.sum(rollup.trend_originals_count).label("clusters"),
+            func.sum(rollup.trend_views_sum).label("views"),
+            func.sum(rollup.trend_er_sum).label("er"),
+            func.sum(rollup.trend_ad_count).label("ads")
+        )
+        .where(rollup.channel_id.in_(channel_ids), rollup.day >= start_day)
+        .group_by(rollup.topic, rollup.format)
+        .having(func.sum(rollup.trend_count) > 0)
+    )
+    rows = [dict(row._mapping) for row in result]
+    return _fold_topics(rows), len(rows)
+
+async def trending_sql(session, channel_ids: List[str], days: int) -> Tuple[List[Dict], int]:
+    start_day = (datetime.datetime.utcnow() - datetime.timedelta(days=days)).date()
+    topics, transferred = {}, 0
+    for row in await session.execute(trending_topics_query(channel_ids, start_day)):
+        transferred += 1
+        topic = topics.setdefault(row.topic, {
+            "topic": row.topic, "posts_count": row.posts_count, "total_views": row.total_views,
+            "avg_er": row.avg_er, "formats": {}, "ad_percentage": row.ad_percentage
+        })
+        topic["formats"][row.format] = row.format_count
+    return list(topics.values()), transferred
+
+# --- Лучшее время публикаций ---
+def _best(stats: Dict, names: Callable = lambda key: key) -> List[Dict]:
+    ranked = sorted(stats.items(), key=lambda x: (-x[1]["er"] / x[1]["count"], x[0]))[:BEST_TIMES_LIMIT]
+    return [
+        {"bucket": names(key), "avg_er": data["er"] / data["count"], "avg_views": data["views"] / data["count"]}
+        for key, data in ranked
+    ]
+
+def _add(stats: Dict, key, count: int, er: float, views: int):
+    bucket = stats.setdefault(key, {"count": 0, "er": 0, "views": 0})
+    bucket["count"] += count
+    bucket["er"] += er
+    bucket["views"] += views
+
+async def times_stream(session, channel_ids: List[str], days: int) -> Tuple[Dict, int]:
+    result = await session.execute(
+        select(Post.posted_at, PostLatestMetrics.er, PostLatestMetrics.views_count)
+        .join(PostLatestMetrics, Post.post_id == PostLatestMetrics.post_id)
+        .where(
+            Post.channel_id.in_(channel_ids),
+            PostLatestMetrics.er > TIMING_MIN_ER, PostLatestMetrics.views_count > TIMING_MIN_VIEWS
+        )
+    )
+    hours, dows, transferred = {}, {}, 0
+    for row in result:
+        transferred += 1
+        _add(hours, row.posted_at.hour, 1, row.er, row.views_count)
+        _add(dows, row.posted_at.weekday(), 1, row.er, row.views_count)
+    return {"best_hours": _best(hours), "best_days": _best(dows, DAY_NAMES.__getitem__)}, transferred
+
+async def times_rollup_rows(session, channel_ids: List[str], days: int) -> Tuple[Dict, int]:
+    rollup = PostDailyRollup
+    result = await session.execute(
+        select(
+            rollup.hour, rollup.dow, func.sum(rollup.timing_count).label("count"),
+            func.sum(rollup.timing_er_sum).label("er"), func.sum(rollup.timing_views_sum).label("views")
+        )
+        .where(rollup.channel_id.in_(channel_ids))
+        .group_by(rollup.hour, rollup.dow)
+        .having(func.sum(rollup.timing_count) > 0)
+    )
+    hours, dows, transferred = {}, {}, 0
+    for row in result:
+        transferred += 1
+        _add(hours, row.hour, row.count, row.er, row.views)
+        _add(dows, row.dow, row.count, row.er, row.views)
+    return {"best_hours": _best(hours), "best_days": _best(dows, DAY_NAMES.__getitem__)}, transferred
+
+async def times_sql(session, channel_ids: List[str], days: int) -> Tuple[Dict, int]:
+    rows = (await session.execute(best_times_query(channel_ids))).all()
+    return {
+        "best_hours": [
+            {"bucket": row.bucket, "avg_er": row.avg_er, "avg_views": row.avg_views}
+            for row in rows if row.kind == "hour"
+        ],
+        "best_days": [
+            {"bucket": DAY_NAMES[row.bucket], "avg_er": row.avg_er, "avg_views": row.avg_views}
+            for row in rows if row.kind == "dow"
+        ]
+    }, len(rows)
+
+QUERIES = {
+    "trending_topics": {"stream": trending_stream, "rollup_rows": trending_rollup_rows, "sql": trending_sql},
+    "best_posting_times": {"stream": times_stream, "rollup_rows": times_rollup_rows, "sql": times_sql},
+}
+
+def _top(name: str, result) -> List:
+    if name == "trending_topics":
+        return [topic["topic"] for topic in result]
+    return [bucket["bucket"] for bucket in result["best_hours"] + result["best_days"]]
+
+async def measure(function: Callable, channel_ids: List[str], days: int, repeat: int) -> Dict:
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        async with SessionLocal() as session:
+            result, transferred = await function(session, channel_ids, days)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return {
+        "rows_transferred": transferred,
+        "latency_ms": {"median": round(statistics.median(latencies), 2), "min": round(min(latencies), 2)},
+        "result": result
+    }
+
+async def run(posts: int, channels: int, category_share: float, days: int, repeat: int) -> Dict:
+    await init_db()
+    if await bench_posts_count() != posts:
+        await create_dataset(posts, channels, HISTORY_DAYS)
+    channel_ids = [f"{BENCH_PREFIX}{i}" for i in range(max(1, int(channels * category_share)))]
+
+    report = {
+        "date": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+        "dialect": engine.dialect.name,
+        "posts": posts,
+        "category_channels": len(channel_ids),
+        "trending_days": days,
+        "queries": {}
+    }
+    for name, strategies in QUERIES.items():
+        results = {}
+        for strategy, function in strategies.items():
+            results[strategy] = await measure(function, channel_ids, days, repeat)
+            print(f"[bench] {name}/{strategy}: {results[strategy]['rows_transferred']:,} строк, "
+                  f"{results[strategy]['latency_ms']['median']:.1f} мс", file=sys.stderr)
+
+        reference = _top(name, results["stream"]["result"])
+        for strategy, result in results.items():
+            top = _top(name, result.pop("result"))
+            result["same_top_as_stream"] = top == reference
+            result["top_overlap_with_stream"] = round(len(set(top) & set(reference)) / max(len(reference), 1), 2)
+            result["speedup_vs_stream"] = round(
+                results["stream"]["latency_ms"]["median"] / max(result["latency_ms"]["median"], 1e-3), 1
+            )
+        report["queries"][name] = results
+    return report
+
+async def main():
+    parser = argparse.ArgumentParser(description="Замер трендовых запросов DataAnalyzer на синтетической БД")
+    parser.add_argument("--posts", type=int, default=POSTS, help="постов в синтетической БД")
+    parser.add_argument("--channels", type=int, default=CHANNELS, help="каналов в синтетической БД")
+    parser.add_argument("--category-share", type=float, default=CATEGORY_SHARE, help="доля каналов в категории")
+    parser.add_argument("--days", type=int, default=TRENDING_DAYS, help="окно get_trending_topics, дней")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="запусков каждого запроса")
+    parser.add_argument("--out", help="куда записать JSON (по умолчанию stdout)")
+    parser.add_argument("--drop", action="store_true", help="удалить синтетические данные и выйти")
+    args = parser.parse_args()
+
+    if args.drop:
+        await init_db()
+        await drop_dataset()
+        print("✅ Данные bench_* удалены", file=sys.stderr)
+        return
+
+    await init_db()
+    foreign_posts = await foreign_posts_count()
+    if foreign_posts:
+        print(f"❌ В БД {foreign_posts:,} постов не bench_*: замер пересобрал бы post_daily_rollup. "
+              f"Укажите в DATABASE_URL отдельную БД", file=sys.stderr)
+        sys.exit(1)
+
+    report = await run(args.posts, args.channels, args.category_share, args.days, args.repeat)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"✅ Отчет сохранен в {args.out}", file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    asyncio.run(main())
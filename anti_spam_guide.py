@@ -2,6 +2,9 @@
 Рекомендации по управлению Telegram аккаунтами для предотвращения банов
 """
 
+import datetime
+from typing import Dict, List
+
 class AntiSpamGuide:
     def __init__(self):
         self.account_limits = {
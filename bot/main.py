@@ -1,6 +1,6 @@
 import asyncio
 import os
-from pyrogram import Client, filters
+from pyrogram import Client, filters, idle
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from dotenv import load_dotenv
 from bot.db import SessionLocal, init_db
@@ -22,6 +22,7 @@ from tg_bot_parser import (
 )
 from gpt_service import gpt_service
 from subscription_service import subscription_service
+from category_index import category_index
 
 load_dotenv()
 
@@ -356,5 +357,15 @@ async def handle_text_message(client: Client, message: Message):
     # Здесь можно добавить обработку текста постов для PRO функций
     # Например, анализ поста, улучшение и т.д.
 
+async def main():
+    # Индекс категорий строим до первых запросов, а не на первом из них.
+    # Если БД еще недоступна, бот все равно стартует: индекс загрузит первый запрос
+    try:
+        await category_index.refresh()
+    except Exception as e:
+        print(f"[bot] Не удалось прогреть индекс категорий: {e}")
+    async with app:
+        await idle()
+
 if __name__ == "__main__":
-    app.run() 
\ No newline at end of file
+    app.run(main()) 
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""
+Индекс категория -> каналы для DataAnalyzer
+
+Категория совпадает с темой, если название темы содержит ее без учета
+регистра (как прежнее topic_name ILIKE '%категория%'). Для каждой категории
+config.CATEGORIES хранится набор id каналов, у которых есть такая тема, поэтому
+запросы аналитики фильтруют по p.channel_id = ANY(:channel_ids) без соединения
+с channel_topic и topics.
+
+Индекс загружается при первом обращении и обновляется не чаще
+CATEGORY_INDEX_REFRESH_INTERVAL: из БД читаются только id строк channel_topic,
+а целиком — лишь новые строки; удаленные строки снимаются с наборов.
+Таблица topics маленькая и перечитывается целиком. После записи в
+channel_topic в этом же процессе достаточно вызвать invalidate().
+"""
+
+import asyncio
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from bot.db import SessionLocal, ChannelTopic, Topic
+from config import CATEGORIES
+
+CATEGORY_INDEX_REFRESH_INTERVAL = 300  # Секунд между проверками channel_topic
+LOOKUP_CHUNK_SIZE = 500  # id в одном SELECT ... IN
+
+def topic_matches(category: str, topic_name: Optional[str]) -> bool:
+    """То же, что topic_name ILIKE '%category%'"""
+    return category.lower() in (topic_name or "").lower()
+
+class CategoryIndex:
+    def __init__(self, categories: List[str] = CATEGORIES,
+                 refresh_interval: float = CATEGORY_INDEX_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.topics: Dict[str, str] = {}  # topic_id -> topic_name
+        self.links: Dict[str, Tuple[str, str]] = {}  # id строки channel_topic -> (channel_id, topic_id)
+        # Категория -> {channel_id: число связей канала с темами категории}
+        self.channels: Dict[str, Counter] = {category: Counter() for category in categories}
+        self.topic_categories: Dict[str, List[str]] = {}
+        self.refreshed_at: Optional[float] = None
+        self.stats = {"refreshes": 0, "added": 0, "removed": 0}
+        self._lock = asyncio.Lock()
+
+    def _categories_of(self, topic_id: str) -> List[str]:
+        if topic_id not in self.topic_categories:
+            name = self.topics.get(topic_id)
+            self.topic_categories[topic_id] = [
+                category for category in self.channels if topic_matches(category, name)
+            ]
+        return self.topic_categories[topic_id]
+
+    def _apply(self, channel_id: str, topic_id: str, delta: int):
+        for category in self._categories_of(topic_id):
+            counter = self.channels[category]
+            counter[channel_id] += delta
+            if counter[channel_id] <= 0:
+                del counter[channel_id]
+
+    def _rebuild(self):
+        """Пересчет наборов по связям в памяти (после изменения названий тем)"""
+        self.topic_categories = {}
+        for category in self.channels:
+            self.channels[category] = Counter()
+        for channel_id, topic_id in self.links.values():
+            self._apply(channel_id, topic_id, 1)
+
+    async def refresh(self):
+        """Догружает изменения channel_topic и topics"""
+        async with SessionLocal() as session:
+            topics = {row.topic_id: row.topic_name for row in await session.execute(
+                select(Topic.topic_id, Topic.topic_name)
+            )}
+            link_ids = set((await session.execute(select(ChannelTopic.id))).scalars())
+
+            added_ids = list(link_ids - self.links.keys())
+            added = {}
+            for i in range(0, len(added_ids), LOOKUP_CHUNK_SIZE):
+                result = await session.execute(
+                    select(ChannelTopic.id, ChannelTopic.channel_id, ChannelTopic.topic_id)
+                    .where(ChannelTopic.id.in_(added_ids[i:i + LOOKUP_CHUNK_SIZE]))
+                )
+                added.update((row.id, (row.channel_id, row.topic_id)) for row in result)
+
+        removed_ids = self.links.keys() - link_ids
+        if topics != self.topics:
+            self.topics = topics
+            for link_id in removed_ids:
+                del self.links[link_id]
+            self.links.update(added)
+            self._rebuild()
+        else:
+            for link_id in removed_ids:
+                self._apply(*self.links.pop(link_id), -1)
+            for link_id, (channel_id, topic_id) in added.items():
+                self.links[link_id] = (channel_id, topic_id)
+                self._apply(channel_id, topic_id, 1)
+
+        self.refreshed_at = time.monotonic()
+        self.stats["refreshes"] += 1
+        self.stats["added"] += len(added)
+        self.stats["removed"] += len(removed_ids)
+
+    async def ensure_fresh(self):
+        if self.refreshed_at is not None and time.monotonic() - self.refreshed_at < self.refresh_interval:
+            return
+        async with self._lock:
+            # Пока ждали блокировку, индекс мог обновить другой запрос
+            if self.refreshed_at is None or time.monotonic() - self.refreshed_at >= self.refresh_interval:
+                await self.refresh()
+
+    async def channel_ids(self, category: str) -> List[str]:
+        """id каналов категории
+
+        Категории не из config.CATEGORIES не кэшируются: их считаем по связям в памяти.
+        """
+        await self.ensure_fresh()
+        if category in self.channels:
+            return list(self.channels[category])
+        matched_topics = {topic_id for topic_id, name in self.topics.items() if topic_matches(category, name)}
+        return list({channel_id for channel_id, topic_id in self.links.values() if topic_id in matched_topics})
+
+    def invalidate(self):
+        """Следующий запрос сначала сверит индекс с БД (после записи в channel_topic)"""
+        self.refreshed_at = None
+
+# Глобальный индекс категорий
+category_index = CategoryIndex()
@@ -2,6 +2,7 @@ import asyncio
 from typing import Dict, List, Optional
 from datetime import datetime, timedelta
 from gpt_service import gpt_service
+import text_stats
 
 class ChannelAnalyzer:
     def __init__(self):
@@ -98,14 +99,16 @@ class ChannelAnalyzer:
             return "Нет данных для анализа качества контента."
         
         try:
-            # Анализируем посты
+            # Анализируем посты одной пачкой массивов
+            stats = text_stats.post_arrays(posts_data)
             total_posts = len(posts_data)
-            posts_with_images = len([p for p in posts_data if p.get('has_image')])
-            avg_views = sum(p.get('views', 0) for p in posts_data) / total_posts if total_posts > 0 else 0
-            avg_reactions = sum(p.get('reactions', 0) for p in posts_data) / total_posts if total_posts > 0 else 0
+            posts_with_images = int(stats["has_image"].sum())
+            means = text_stats.averages(stats, fields=("views", "reactions"))
+            avg_views = means["views"]
+            avg_reactions = means["reactions"]
             
             # Топ посты
-            top_posts = sorted(posts_data, key=lambda x: x.get('views', 0), reverse=True)[:5]
+            top_posts = [posts_data[i] for i in text_stats.top_indices(stats["views"], 5)]
             
             prompt = f"""Проанализируй качество контента канала:
 
@@ -198,7 +201,7 @@ class ChannelAnalyzer:
         """PRO: Генерирует советы по росту канала"""
         try:
             # Анализируем текущие показатели
-            avg_views = sum(p.get('views', 0) for p in posts_data) / len(posts_data) if posts_data else 0
+            avg_views = text_stats.averages(text_stats.post_arrays(posts_data), fields=("views",))["views"]
             engagement_rate = channel_data.get('engagement_rate', 0)
             subscribers = channel_data.get('subscribers', 0)
             
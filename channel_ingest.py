@@ -0,0 +1,398 @@
+"""
+Запись обойденных каналов и постов в БД
+
+Общая часть userbot_stats и crawl_coordinator: канал и его снапшот, пачки
+постов со снапшотами метрик, расписанием обновления, группами дублей и
+дневными агрегатами, отметки обхода истории. Импорт модуля не создает
+клиент Pyrogram и каталоги; сообщения приходят от вызывающего кода.
+"""
+
+import datetime
+import json
+import uuid
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, insert
+
+from bot.db import (
+    SessionLocal, Channel, Post, ChannelSnapshot, PostSnapshot, PostLatestMetrics, CrawlState, PostRefresh,
+    upsert_insert
+)
+from daily_rollups import rollup_states, update_rollups
+from feature_cache import feature_cache
+from media_pipeline import MediaPipeline
+from near_duplicates import duplicate_index
+from post_classifier import (
+    CLASSIFIER_VERSION, extract_title_and_body, extract_features, join_title_and_body, stored_post_text
+)
+from similarity_index import similarity_index
+from topic_tagger import tags_column
+
+HISTORY_PAGE_SIZE = 100  # Размер страницы get_chat_history для пакетной записи
+INITIAL_CRAWL_LIMIT = 100  # Сколько последних сообщений берем при первом обходе канала
+
+CHANNEL_SNAPSHOT_MIN_INTERVAL = datetime.timedelta(hours=24)  # Снапшот без изменений пишем не чаще
+
+# Через сколько после публикации перечитываем метрики поста; после последней ступени снапшот финальный
+REFRESH_SCHEDULE = [
+    datetime.timedelta(hours=1),
+    datetime.timedelta(hours=6),
+    datetime.timedelta(hours=24),
+    datetime.timedelta(hours=72),
+]
+
+async def save_channel_and_snapshot(chat):
+    """Сохраняет канал и снапшот его метрик
+    
+    Снапшот пишется, только если изменилось число подписчиков или с прошлого
+    снапшота прошло CHANNEL_SNAPSHOT_MIN_INTERVAL. Прирост и отток считаются
+    относительно последнего снапшота в channel_snapshots (по индексу
+    ix_channel_snapshots_channel_date), кто бы из парсеров его ни записал.
+    """
+    channel_id = str(chat.id)
+    now = datetime.datetime.utcnow()
+    subscribers = getattr(chat, 'members_count', None)
+    
+    async with SessionLocal() as session:
+        # Создаем канал, если его еще нет
+        await session.execute(
+            upsert_insert(Channel).values(
+                channel_id=channel_id,
+                username=chat.username or f"{chat.id}",
+                title=chat.title or chat.first_name or chat.username or str(chat.id),
+                description=getattr(chat, 'description', None),
+                created_at=now,
+                is_bot_admin=False
+            ).on_conflict_do_nothing(index_elements=[Channel.channel_id])
+        )
+        
+        try:
+            last_snapshot = await session.execute(
+                select(ChannelSnapshot.subscribers_count, ChannelSnapshot.snapshot_date)
+                .where(ChannelSnapshot.channel_id == channel_id)
+                .order_by(ChannelSnapshot.snapshot_date.desc())
+                .limit(1)
+            )
+            row = last_snapshot.first()
+            previous = {"subscribers_count": row.subscribers_count, "snapshot_date": row.snapshot_date} if row else None
+            
+            if (previous and subscribers == previous["subscribers_count"]
+                    and now - previous["snapshot_date"] < CHANNEL_SNAPSHOT_MIN_INTERVAL):
+                await session.commit()
+                return
+            
+            new_followers = lost_followers = None
+            if previous and previous["subscribers_count"] is not None and subscribers is not None:
+                delta = subscribers - previous["subscribers_count"]
+                new_followers = max(delta, 0)
+                lost_followers = max(-delta, 0)
+            
+            snapshot = ChannelSnapshot(
+                channel_snapshot_id=str(uuid.uuid4()),
+                channel_id=channel_id,
+                snapshot_date=now,
+                subscribers_count=subscribers,
+                reach_rate=None, avg_reactions=None, avg_reposts=None, avg_post_comments=None,
+                new_followers=new_followers, lost_followers=lost_followers,
+                silent_users_percent=None, active_users_percent=None,
+                posts_count=None, total_views=None, engagement_rate=None, source_info=None,
+                notification_percent=None, avg_positive_reactions=None, avg_negative_reactions=None
+            )
+            session.add(snapshot)
+            await session.commit()
+        except Exception as e:
+            print(f"[userbot] Не удалось сохранить snapshot канала: {e}")
+
+def message_date_utc(msg) -> datetime.datetime:
+    """Дата сообщения в UTC без tzinfo, как и остальные даты в БД
+    
+    Pyrogram отдает наивное локальное время сервера; astimezone считает его локальным.
+    """
+    return msg.date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+def get_media_type(msg) -> Optional[str]:
+    """Определяет тип медиа сообщения"""
+    return 'photo' if msg.photo else 'video' if msg.video else 'document' if msg.document else None
+
+def build_post_row(chat_id, msg, features: Dict = None) -> Dict:
+    """Собирает строку таблицы posts из сообщения с классификацией текста
+    
+    features — готовая запись classify_many для этого сообщения, иначе считается здесь.
+    """
+    post_text = msg.text or msg.caption or ""
+    
+    # Разделяем на заголовок и основной текст
+    title, body = extract_title_and_body(post_text)
+    if features is None:
+        features = extract_features(join_title_and_body(title, body))
+    
+    return {
+        "post_id": f"{chat_id}_{msg.id}",
+        "channel_id": str(chat_id),
+        "posted_at": message_date_utc(msg),
+        "title": title,
+        "body": body,
+        "is_ad": features["is_ad"],
+        "media_type": get_media_type(msg),
+        "has_poll": bool(getattr(msg, 'poll', None)),
+        "format": features["format"],
+        "cta": features["cta"],
+        "classifier_version": CLASSIFIER_VERSION,
+        "topic": features.get("topic"),
+        "tags": tags_column(features.get("tags")),
+        "created_at": datetime.datetime.utcnow()
+    }
+
+def get_next_refresh(posted_at: datetime.datetime, now: datetime.datetime) -> tuple:
+    """Возвращает (ступень, время следующего обновления) по REFRESH_SCHEDULE
+    
+    Для поста старше последней ступени время равно None — его метрики финальные.
+    """
+    age = now - posted_at
+    for stage, step in enumerate(REFRESH_SCHEDULE):
+        if age < step:
+            return stage, posted_at + step
+    return len(REFRESH_SCHEDULE), None
+
+def build_post_snapshot_row(post_id: str, msg, snapshot_date: datetime.datetime = None,
+                            is_final: bool = False) -> Dict:
+    """Собирает строку таблицы posts_snapshot с метриками сообщения"""
+    # Вычисляем ER (engagement rate)
+    views = getattr(msg, 'views', 0)
+    reactions = msg.reactions.reactions if msg.reactions else []
+    total_reactions = sum(r.count for r in reactions)
+    er = (total_reactions / views * 100) if views else 0
+    
+    return {
+        "id": str(uuid.uuid4()),
+        "post_id": post_id,
+        "views_count": views,
+        "views_info": None,
+        "reactions": json.dumps({r.emoji: r.count for r in reactions}),
+        "comments": None,
+        "forwards": getattr(msg, 'forwards', None),
+        "forwards_private": None,
+        "er": er,
+        "snapshot_date": snapshot_date or datetime.datetime.utcnow(),
+        "is_final": is_final
+    }
+
+def build_latest_metrics_rows(snapshot_rows: List[Dict]) -> List[Dict]:
+    """Строки post_latest_metrics: самый свежий снапшот каждого поста пачки"""
+    latest = {}
+    for row in snapshot_rows:
+        current = latest.get(row["post_id"])
+        if current is None or row["snapshot_date"] >= current["snapshot_date"]:
+            latest[row["post_id"]] = row
+    
+    return [
+        {
+            "post_id": row["post_id"],
+            "views_count": row["views_count"],
+            "reactions": row["reactions"],
+            "reactions_total": sum(json.loads(row["reactions"]).values()) if row["reactions"] else 0,
+            "forwards": row["forwards"],
+            "comments": row["comments"],
+            "er": row["er"],
+            "snapshot_date": row["snapshot_date"],
+            "is_final": row["is_final"]
+        }
+        for row in latest.values()
+    ]
+
+async def save_latest_metrics(session, snapshot_rows: List[Dict]):
+    """Обновляет post_latest_metrics в той же транзакции, что и снапшоты
+    
+    Строку заменяет только снапшот не старше уже записанного, поэтому
+    запоздавшая запись не откатывает метрики назад.
+    """
+    rows = build_latest_metrics_rows(snapshot_rows)
+    if not rows:
+        return
+    stmt = upsert_insert(PostLatestMetrics).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[PostLatestMetrics.post_id],
+        set_={field: stmt.excluded[field] for field in rows[0] if field != "post_id"},
+        where=PostLatestMetrics.snapshot_date <= stmt.excluded.snapshot_date
+    )
+    await session.execute(stmt)
+
+async def save_posts_batch(chat_id, messages) -> Dict[str, int]:
+    """Сохраняет пачку сообщений (страницу get_chat_history) одной транзакцией
+    
+    Посты пишутся через INSERT ... ON CONFLICT DO UPDATE, снапшоты — одним
+    многострочным INSERT. Возвращает количество вставленных и обновленных постов
+    и записанных снапшотов. Ошибка записи пробрасывается вызывающему: пачка
+    целиком не сохранена.
+    """
+    result = {"inserted": 0, "updated": 0, "snapshots": 0}
+    
+    # Одно и то же сообщение не должно попасть в INSERT дважды
+    post_rows = {}
+    snapshot_rows = []
+    refresh_rows = []
+    snapshot_date = datetime.datetime.utcnow()
+    # Признаки берем из кэша по хэшу текста, считаем только новые тексты.
+    # Классифицируем текст в сохраняемом виде (title + body), как и reclassify
+    texts = [msg.text or msg.caption for msg in messages]
+    features = await feature_cache.classify_many([stored_post_text(text) for text in texts])
+    post_texts = {}
+    for msg, text, msg_features in zip(messages, texts, features):
+        row = build_post_row(chat_id, msg, msg_features)
+        post_rows[row["post_id"]] = row
+        post_texts[row["post_id"]] = text
+        
+        # Свежие посты ставим в расписание обновления метрик, у старых снапшот сразу финальный
+        stage, next_refresh_at = get_next_refresh(row["posted_at"], snapshot_date)
+        snapshot_rows.append(build_post_snapshot_row(
+            row["post_id"], msg, snapshot_date, is_final=next_refresh_at is None
+        ))
+        if next_refresh_at is not None:
+            refresh_rows.append({
+                "post_id": row["post_id"],
+                "channel_id": row["channel_id"],
+                "message_id": msg.id,
+                "posted_at": row["posted_at"],
+                "stage": stage,
+                "next_refresh_at": next_refresh_at
+            })
+    
+    if not post_rows:
+        return result
+    
+    async with SessionLocal() as session:
+        # Прежние метки и метрики постов (посты блокируются до коммита):
+        # дневные агрегаты обновляются на разницу
+        rollups_before = await rollup_states(session, list(post_rows))
+        existing = await session.execute(
+            select(Post.post_id).where(Post.post_id.in_(list(post_rows)))
+        )
+        existing_ids = set(existing.scalars())
+        
+        # Подписи MinHash и группы дублей (по корзинам LSH, без перебора таблицы)
+        duplicates = await duplicate_index.assign(session, list(post_rows.values()), list(post_texts.values()))
+        
+        stmt = upsert_insert(Post).values(list(post_rows.values()))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Post.post_id],
+            set_={
+                field: stmt.excluded[field]
+                for field in ("title", "body", "is_ad", "media_type", "has_poll", "format", "cta",
+                              "topic", "tags", "classifier_version", "minhash", "dup_cluster_id")
+            }
+        )
+        await session.execute(stmt)
+        await duplicate_index.save(session, duplicates)
+        await session.execute(insert(PostSnapshot).values(snapshot_rows))
+        await save_latest_metrics(session, snapshot_rows)
+        await update_rollups(session, rollups_before, list(post_rows))
+        if refresh_rows:
+            await session.execute(
+                upsert_insert(PostRefresh).values(refresh_rows).on_conflict_do_nothing(
+                    index_elements=[PostRefresh.post_id]
+                )
+            )
+        await session.commit()
+    
+    # Новые посты — в индекс похожих; копии из групп дублей не добавляем
+    similarity_index.add_many(
+        (post_id, post_texts[post_id]) for post_id, row in post_rows.items()
+        if post_id not in existing_ids and row["dup_cluster_id"] in (None, post_id)
+    )
+    await similarity_index.maybe_save()
+    
+    result["updated"] = len(existing_ids)
+    result["inserted"] = len(post_rows) - len(existing_ids)
+    result["snapshots"] = len(snapshot_rows)
+    return result
+
+async def save_post_and_snapshot(chat_id, msg):
+    """Сохраняет один пост со снапшотом (обертка над save_posts_batch)"""
+    return await save_posts_batch(chat_id, [msg])
+
+# --- Инкрементальный обход истории ---
+async def load_crawl_state(channel_id: str) -> Optional[CrawlState]:
+    """Возвращает отметки обхода канала"""
+    async with SessionLocal() as session:
+        return await session.get(CrawlState, channel_id)
+
+async def update_crawl_state(channel_id: str, newest_id: int = None, oldest_id: int = None,
+                             backfill_done: bool = None):
+    """Сдвигает отметки обхода канала (диапазон обойденных сообщений только расширяется)"""
+    async with SessionLocal() as session:
+        state = await session.get(CrawlState, channel_id)
+        if not state:
+            state = CrawlState(channel_id=channel_id, backfill_done=False)
+            session.add(state)
+        
+        if newest_id is not None and (state.last_message_id is None or newest_id > state.last_message_id):
+            state.last_message_id = newest_id
+        if oldest_id is not None and (state.oldest_message_id is None or oldest_id < state.oldest_message_id):
+            state.oldest_message_id = oldest_id
+        if backfill_done is not None:
+            state.backfill_done = backfill_done
+        state.updated_at = datetime.datetime.utcnow()
+        await session.commit()
+
+async def save_page(chat_id, page, media: Optional[MediaPipeline] = None) -> Dict[str, int]:
+    """Сохраняет страницу постов и ставит их фото в загрузку (строки media ссылаются на посты)"""
+    result = await save_posts_batch(chat_id, page)
+    if media is not None and result["inserted"] + result["updated"]:
+        for message in page:
+            media.submit(message, post_id=f"{chat_id}_{message.id}")
+    return result
+
+async def ingest_history(chat, history, media: Optional[MediaPipeline] = None) -> Dict:
+    """Сохраняет сообщения из итератора истории постранично и собирает данные для статистики
+    
+    Если страница не записалась, обход останавливается и в "error" возвращается
+    ошибка. Отметки тогда покрывают только записанные страницы: история идет от
+    новых к старым, поэтому newest_id не возвращается (иначе следующий
+    инкрементальный обход пропустил бы незаписанные посты), а oldest_id — самое
+    старое сообщение последней записанной страницы.
+    """
+    posts = []
+    page = []
+    newest_id = None
+    oldest_id = None
+    committed_oldest_id = None
+    fetched = 0
+    
+    async def flush() -> bool:
+        nonlocal committed_oldest_id
+        try:
+            await save_page(chat.id, page, media)
+        except Exception as e:
+            print(f"[ingest] Не удалось сохранить страницу постов канала {chat.id}: {e}")
+            return False
+        committed_oldest_id = oldest_id
+        return True
+    
+    async for message in history:
+        fetched += 1
+        newest_id = message.id if newest_id is None else max(newest_id, message.id)
+        oldest_id = message.id if oldest_id is None else min(oldest_id, message.id)
+        
+        if message.text or message.caption:
+            page.append(message)
+            if len(page) >= HISTORY_PAGE_SIZE:
+                if not await flush():
+                    return {"posts": posts, "newest_id": None, "oldest_id": committed_oldest_id,
+                            "fetched": fetched, "error": f"страница постов канала {chat.id} не сохранена"}
+                page = []
+            
+            post_data = {
+                "id": message.id,
+                "text": message.text or message.caption or "",
+                "date": message.date.isoformat(),
+                "views": getattr(message, 'views', 0),
+                "reactions": {r.emoji: r.count for r in message.reactions.reactions} if message.reactions else {},
+                "forwards": getattr(message, 'forwards', 0)
+            }
+            posts.append(post_data)
+    
+    if page and not await flush():
+        return {"posts": posts, "newest_id": None, "oldest_id": committed_oldest_id,
+                "fetched": fetched, "error": f"страница постов канала {chat.id} не сохранена"}
+    
+    return {"posts": posts, "newest_id": newest_id, "oldest_id": oldest_id, "fetched": fetched, "error": None}
@@ -1,99 +1,210 @@
+import asyncio
+import heapq
 import json
 import os
 from pyrogram import Client
 from tqdm import tqdm
+from media_pipeline import MediaPipeline
 
 # Вставь свои значения ниже
 api_id = 26333656  # твой API ID
 api_hash = "2c550faf732f3920b062006d9b7dfd55"  # твой API HASH
 
-# Имя сессии (файл user_session.session появится в папке после первого запуска)
-app = Client("user_session", api_id=api_id, api_hash=api_hash)
-
-channel_username = input("Введи username канала (без @): ")
-limit_input = input("Сколько сообщений парсить? (Enter — все): ").strip()
-limit = int(limit_input) if limit_input else None
-
-# Создаём папку для изображений, если её нет
-os.makedirs("images", exist_ok=True)
-
-all_posts = []
-print("Парсинг всех постов... Это может занять время!")
-
-with app:
-    # Получаем количество сообщений для прогресс-бара
-    total_msgs = app.get_chat(channel_username).messages_count if not limit else limit
-    messages = app.get_chat_history(channel_username, limit=limit) if limit else app.get_chat_history(channel_username)
-    for message in tqdm(messages, total=total_msgs, desc="Посты обработано"):
-        text = message.text or message.caption or "[без текста]"
-        # Сбор реакций
-        reactions = {}
-        if message.reactions:
-            for reaction in message.reactions.reactions:
-                reactions[reaction.emoji] = reaction.count
-        # Сбор темы (topic)
-        topic_id = getattr(message, 'topic_id', None)
-        topic_name = getattr(message, 'topic_name', None)
-        # Ссылка на изображение (если есть)
-        image_url = None
-        if message.photo:
-            try:
-                image_url = app.download_media(message, file_name=f"images/{channel_username}_{message.id}.jpg")
-            except Exception as e:
-                print(f"Ошибка при скачивании изображения для поста {message.id}: {e}")
-                image_url = None
-        all_posts.append({
-            "id": message.id,
-            "views": message.views,
-            "text": text,
-            "reactions": reactions,
-            "topic_id": topic_id,
-            "topic_name": topic_name,
-            "image_path": image_url
-        })
-
-print(f"Всего постов собрано: {len(all_posts)}")
-
-# Сохраняем в файл
-with open(f"{channel_username}_posts.json", "w", encoding="utf-8") as f:
-    json.dump(all_posts, f, ensure_ascii=False, indent=2)
-print(f"Данные сохранены в {channel_username}_posts.json")
-
-# --- Интерактивная статистика ---
-while True:
-    print("\nЧто вывести?\n1. Топ-10 по просмотрам\n2. Топ-10 по реакциям\n3. Статистика по темам\n4. Выйти")
-    choice = input("Выбери (1/2/3/4): ").strip()
-    if choice == "1":
-        top = sorted([p for p in all_posts if p["views"]], key=lambda x: x["views"], reverse=True)[:10]
-        for post in top:
-            print(f"ID: {post['id']}, Views: {post['views']}, Text: {post['text'][:50]}")
-            if post["reactions"]:
-                reactions_str = ", ".join(f"{emoji} {count}" for emoji, count in post["reactions"].items())
-                print(f"Реакции: {reactions_str}")
-            else:
-                print("Реакции: нет")
-            if post["image_path"]:
-                print(f"Изображение: {post['image_path']}")
-    elif choice == "2":
-        reaction_stats = {}
-        for post in all_posts:
-            for emoji, count in post["reactions"].items():
-                reaction_stats[emoji] = reaction_stats.get(emoji, 0) + count
-        if reaction_stats:
-            for emoji, count in sorted(reaction_stats.items(), key=lambda x: x[1], reverse=True):
-                print(f"{emoji}: {count}")
+FLUSH_EVERY = 50  # Как часто сбрасывать NDJSON на диск (в постах)
+
+def last_saved_id(path):
+    """Возвращает id последнего записанного поста в NDJSON-файле
+
+    Недописанную при падении последнюю строку обрезает, чтобы дозапись
+    продолжилась с целой строки.
+    """
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        block = 4096
+        tail = b""
+        pos = size
+        # Читаем хвост файла, пока в нем не окажется хотя бы одна целая строка
+        while pos > 0 and tail.count(b"\n") < 2:
+            step = min(block, pos)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+
+        if not tail.endswith(b"\n"):
+            cut = tail.rfind(b"\n")
+            f.truncate(pos + cut + 1 if cut >= 0 else 0)
+            tail = tail[:cut + 1] if cut >= 0 else b""
+
+        lines = tail.splitlines()
+        if not lines:
+            return None
+        return json.loads(lines[-1].decode("utf-8"))["id"]
+
+def iter_ndjson(path):
+    """Лениво читает посты из NDJSON-файла"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def build_post(message, media):
+    """Собирает пост; возвращает (пост, задача загрузки изображения или None)"""
+    text = message.text or message.caption or "[без текста]"
+    # Сбор реакций
+    reactions = {}
+    if message.reactions:
+        for reaction in message.reactions.reactions:
+            reactions[reaction.emoji] = reaction.count
+    # Сбор темы (topic)
+    topic_id = getattr(message, 'topic_id', None)
+    topic_name = getattr(message, 'topic_name', None)
+    # Изображение качается в фоне; image_path заполняет resolve_images после загрузки
+    image_task = media.submit(message) if message.photo else None
+    return {
+        "id": message.id,
+        "views": message.views,
+        "text": text,
+        "reactions": reactions,
+        "topic_id": topic_id,
+        "topic_name": topic_name,
+        "image_path": None
+    }, image_task
+
+async def resolve_images(batch):
+    """Дожидается загрузок пачки и проставляет image_path только успешно скачанным"""
+    for post, image_task in batch:
+        if image_task is not None:
+            post["image_path"] = await image_task
+    return [post for post, _ in batch]
+
+async def collect(app, channel_username, limit, streaming, ndjson_path):
+    """Парсит канал; в обычном режиме возвращает список постов"""
+    all_posts = []
+    # Скрипт работает без БД: повторы отсекаются по файлам на диске
+    media = MediaPipeline(app, media_dir="images", record_to_db=False)
+    try:
+        # Получаем количество сообщений для прогресс-бара
+        total_msgs = (await app.get_chat(channel_username)).messages_count if not limit else limit
+
+        if streaming:
+            # История идет от новых к старым: продолжаем с последнего записанного id
+            resume_id = last_saved_id(ndjson_path)
+            if resume_id:
+                print(f"Продолжаю с поста {resume_id}")
+            history_kwargs = {"offset_id": resume_id} if resume_id else {}
+            if limit:
+                history_kwargs["limit"] = limit
+
+            saved = 0
+            batch = []
+
+            async def write_batch():
+                # Пишем пачку после загрузки ее картинок: в файл попадают только реальные пути
+                for post in await resolve_images(batch):
+                    f.write(json.dumps(post, ensure_ascii=False, separators=(",", ":")) + "\n")
+                f.flush()
+                batch.clear()
+
+            with open(ndjson_path, "a", encoding="utf-8") as f, \
+                    tqdm(total=total_msgs, desc="Посты обработано") as progress:
+                async for message in app.get_chat_history(channel_username, **history_kwargs):
+                    batch.append(build_post(message, media))
+                    saved += 1
+                    progress.update(1)
+                    if len(batch) >= FLUSH_EVERY:
+                        await write_batch()
+                await write_batch()
+            print(f"Всего постов записано: {saved}")
         else:
-            print("Нет реакций в постах.")
-    elif choice == "3":
-        topics = {}
-        for post in all_posts:
-            topic = post["topic_name"] or str(post["topic_id"]) or "Без темы"
-            topics.setdefault(topic, []).append(post)
-        for topic, posts in topics.items():
-            print(f"\nТема: {topic} — {len(posts)} постов")
-            total_views = sum(p["views"] or 0 for p in posts)
-            print(f"  Всего просмотров: {total_views}")
-    elif choice == "4":
-        break
+            history_kwargs = {"limit": limit} if limit else {}
+            batch = []
+            with tqdm(total=total_msgs, desc="Посты обработано") as progress:
+                async for message in app.get_chat_history(channel_username, **history_kwargs):
+                    batch.append(build_post(message, media))
+                    progress.update(1)
+            all_posts = await resolve_images(batch)
+            print(f"Всего постов собрано: {len(all_posts)}")
+
+        print("Дожидаюсь загрузки изображений...")
+        await media.drain()
+        print(f"Изображений скачано: {media.stats['downloaded']}, повторов пропущено: {media.stats['deduplicated']}")
+    finally:
+        media.close()
+    return all_posts
+
+def main():
+    # Имя сессии (файл user_session.session появится в папке после первого запуска)
+    app = Client("user_session", api_id=api_id, api_hash=api_hash)
+
+    channel_username = input("Введи username канала (без @): ")
+    limit_input = input("Сколько сообщений парсить? (Enter — все): ").strip()
+    limit = int(limit_input) if limit_input else None
+    streaming = input("Сохранять потоково в NDJSON с дозаписью? (y/N): ").strip().lower() in ("y", "д", "yes", "да")
+
+    ndjson_path = f"{channel_username}_posts.ndjson"
+    print("Парсинг всех постов... Это может занять время!")
+
+    async def run():
+        async with app:
+            return await collect(app, channel_username, limit, streaming, ndjson_path)
+
+    all_posts = asyncio.run(run())
+
+    if streaming:
+        print(f"Данные сохранены в {ndjson_path}")
     else:
-        print("Некорректный выбор. Попробуй снова.") 
\ No newline at end of file
+        # Сохраняем в файл
+        with open(f"{channel_username}_posts.json", "w", encoding="utf-8") as f:
+            json.dump(all_posts, f, ensure_ascii=False, indent=2)
+        print(f"Данные сохранены в {channel_username}_posts.json")
+
+    def iter_posts():
+        """Посты для статистики: в потоковом режиме читаются с диска, а не из памяти"""
+        return iter_ndjson(ndjson_path) if streaming else iter(all_posts)
+
+    # --- Интерактивная статистика ---
+    while True:
+        print("\nЧто вывести?\n1. Топ-10 по просмотрам\n2. Топ-10 по реакциям\n3. Статистика по темам\n4. Выйти")
+        choice = input("Выбери (1/2/3/4): ").strip()
+        if choice == "1":
+            top = heapq.nlargest(10, (p for p in iter_posts() if p["views"]), key=lambda x: x["views"])
+            for post in top:
+                print(f"ID: {post['id']}, Views: {post['views']}, Text: {post['text'][:50]}")
+                if post["reactions"]:
+                    reactions_str = ", ".join(f"{emoji} {count}" for emoji, count in post["reactions"].items())
+                    print(f"Реакции: {reactions_str}")
+                else:
+                    print("Реакции: нет")
+                if post["image_path"]:
+                    print(f"Изображение: {post['image_path']}")
+        elif choice == "2":
+            reaction_stats = {}
+            for post in iter_posts():
+                for emoji, count in post["reactions"].items():
+                    reaction_stats[emoji] = reaction_stats.get(emoji, 0) + count
+            if reaction_stats:
+                for emoji, count in sorted(reaction_stats.items(), key=lambda x: x[1], reverse=True):
+                    print(f"{emoji}: {count}")
+            else:
+                print("Нет реакций в постах.")
+        elif choice == "3":
+            topics = {}
+            for post in iter_posts():
+                topic = post["topic_name"] or str(post["topic_id"]) or "Без темы"
+                stats = topics.setdefault(topic, {"posts": 0, "views": 0})
+                stats["posts"] += 1
+                stats["views"] += post["views"] or 0
+            for topic, stats in topics.items():
+                print(f"\nТема: {topic} — {stats['posts']} постов")
+                print(f"  Всего просмотров: {stats['views']}")
+        elif choice == "4":
+            break
+        else:
+            print("Некорректный выбор. Попробуй снова.")
+
+if __name__ == "__main__":
+    main()
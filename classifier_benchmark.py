@@ -0,0 +1,358 @@
+"""
+Замер скорости и качества классификаторов постов
+
+Корпус: посты из russiaarts_posts.json и results/*_posts.json плюс
+синтетические тексты с известными метками (формат, CTA, заголовок).
+Для каждой реализации считаются посты/сек, задержка одного поста (p50/p99)
+и пик памяти по tracemalloc. Проверяются функции post_classifier (их
+импортирует userbot_stats), копии методов AccountManager, правила рекламы
+отдельно от модели и пакетная classify_many. На синтетике с метками
+считается точность, а между правилами и моделью рекламы — доля совпавших ответов.
+
+Рекламные строки синтетики собраны из тех же шаблонов, что и правила, поэтому
+точность рекламы по ним не считается. Ее меряем только на ручной разметке
+posts.ad_label (--ad-labels, нужна БД); без нее в отчете так и сказано.
+Модель обучается на той же разметке, поэтому честная оценка модели — на
+постах, размеченных после обучения.
+
+Результат — JSON, его удобно сохранять между релизами и сравнивать:
+
+    python classifier_benchmark.py --out bench.json
+    python classifier_benchmark.py --compare bench.json  # код выхода 1 при регрессии
+    python classifier_benchmark.py --ad-labels  # + точность рекламы по posts.ad_label
+"""
+
+import argparse
+import asyncio
+import datetime
+import glob
+import json
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from ad_model import evaluate, load_labeled_posts
+from post_classifier import CLASSIFIER_VERSION, PostClassifier, classify_many, post_classifier
+
+CORPUS_FILES = ["russiaarts_posts.json"] + sorted(glob.glob("results/*_posts.json"))
+SYNTHETIC_POSTS = 2000
+MIN_POSTS = 20000  # Корпус повторяется, пока в замере не наберется столько постов
+MEMORY_SAMPLE = 2000  # Постов в проходе под tracemalloc (он замедляет код в разы)
+REGRESSION_TOLERANCE = 0.1  # Падение скорости больше 10% считается регрессией
+ACCURACY_TOLERANCE = 0.01
+TASK_LABELS = {"format": "format", "cta": "has_cta", "ad": "is_ad", "title": "has_title"}
+
+# --- Синтетические посты ---
+FILLER_WORDS = (
+    "проект идея команда город выставка художник книга история результат неделя "
+    "работа время деньги рынок клиент продукт сервис вопрос ответ опыт путь задача"
+).split()
+
+FORMAT_TEMPLATES = {
+    "list": [
+        "Три правила, которые работают:\n1. {a}\n2. {b}\n3. {c}",
+        "Во-первых, {a}. Далее {b}.\n- {c}\n- {a}",
+    ],
+    "story": [
+        "Однажды {a}, и я помню, как {b}.",
+        "Вчера {a}. Когда-то {b}, а теперь {c}.",
+    ],
+    "analytics": [
+        "По данным исследования, рост составил 15%: {a}.",
+        "Исследование показало рост на 40% за год. {a}, {b}.",
+    ],
+    "opinion": [
+        "Мне кажется, {a}. Я думаю, {b}.",
+        "По моему мнению, {a}, но {b}.",
+    ],
+    "howto": [
+        "Шаг 1: скачай {a}.\nШаг 2: настрой {b}.\nШаг 3: {c}.",
+        "Сделай так: {a}, потом настрой {b}.",
+    ],
+    "news": [
+        "Сегодня произошло важное: {a}.",
+        "По сообщениям источников, в 2024 году {a}.",
+    ],
+    "motivation": [
+        "Ты можешь больше, чем кажется. Не сдавайся: {a}.",
+        "Поверь в себя. {a}, {b}.",
+    ],
+    "fun": [
+        "Ахаха, это лучший мем недели: {a}",
+        "Лол, вот это прикол: {a}",
+    ],
+    "quote": [
+        "«{a}» — сказал когда-то {b}.",
+        "Цитата дня: «{a}».",
+    ],
+    "other": [
+        "{a}. {b}.",
+        "{a}, {b}, {c}.",
+    ],
+}
+
+CTA_LINES = ["Сохрани, чтобы не потерять", "Пиши в комменты, что думаешь", "А ты как думаешь?"]
+AD_LINES = [
+    "Подпишись на канал @{brand} — там еще больше: https://t.me/{brand}",
+    "Переходи сюда 👉 t.me/{brand} и забирай скидку",
+    "Жми на ссылку: https://bit.ly/{brand}",
+]
+TITLES = ["🔴 Главное за неделю", "⚡ Коротко о важном", "Новый выпуск!"]
+
+def _phrase(rng: random.Random) -> str:
+    return " ".join(rng.choice(FILLER_WORDS) for _ in range(rng.randint(4, 10)))
+
+def synthetic_posts(count: int = SYNTHETIC_POSTS, seed: int = 0) -> List[Dict]:
+    """Тексты с метками: format, has_cta, has_title
+
+    Рекламные строки добавляются для нагрузки, но без метки is_ad: они из тех же
+    шаблонов, что и правила detect_ad_post.
+    """
+    rng = random.Random(seed)
+    posts = []
+    for _ in range(count):
+        post_format = rng.choice(list(FORMAT_TEMPLATES))
+        text = rng.choice(FORMAT_TEMPLATES[post_format]).format(a=_phrase(rng), b=_phrase(rng), c=_phrase(rng))
+        kind = rng.random()
+        is_ad = kind < 0.3
+        has_cta = is_ad or kind < 0.5
+        if is_ad:
+            text += "\n\n" + rng.choice(AD_LINES).format(brand=f"brand{rng.randint(1, 50)}")
+        elif has_cta:
+            text += "\n" + rng.choice(CTA_LINES)
+        has_title = rng.random() < 0.4
+        if has_title:
+            text = rng.choice(TITLES) + "\n" + text
+        posts.append({
+            "text": text,
+            "labels": {"format": post_format, "has_cta": has_cta, "has_title": has_title}
+        })
+    return posts
+
+def load_ad_labels() -> List[Dict]:
+    """Посты с ручной разметкой рекламы из posts.ad_label"""
+    from bot.db import engine
+    engine.echo = False  # Лог SQL испортил бы JSON-отчет в stdout
+
+    async def load():
+        try:
+            return await load_labeled_posts()
+        finally:
+            await engine.dispose()
+    data = asyncio.run(load())
+    return [{"text": text, "labels": {"is_ad": label}} for text, label in zip(data["texts"], data["labels"])]
+
+def load_corpus(paths: List[str] = CORPUS_FILES, synthetic: int = SYNTHETIC_POSTS,
+                ad_labels: bool = False) -> List[Dict]:
+    """Настоящие посты без меток, синтетические с метками и, по запросу, разметка рекламы"""
+    posts = []
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                posts.extend({"text": post.get("text") or "", "labels": None} for post in json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"[benchmark] Пропускаю {path}: {e}", file=sys.stderr)
+    if ad_labels:
+        try:
+            posts.extend(load_ad_labels())
+        except Exception as e:
+            print(f"[benchmark] Разметка рекламы недоступна: {e}", file=sys.stderr)
+    return posts + synthetic_posts(synthetic)
+
+# --- Замеры ---
+def measure(function: Callable, texts: List[str], min_posts: int = MIN_POSTS) -> Dict:
+    """Скорость, задержки и память одной функции (текст -> результат)"""
+    rounds = max(1, -(-min_posts // max(len(texts), 1)))
+    latencies = np.empty(len(texts) * rounds, dtype=np.int64)
+    clock = time.perf_counter_ns
+    position = 0
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for text in texts:
+            before = clock()
+            function(text)
+            latencies[position] = clock() - before
+            position += 1
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    for text in texts[:MEMORY_SAMPLE]:
+        function(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "posts": position,
+        "posts_per_sec": round(position / elapsed, 1),
+        "latency_us": {
+            "p50": round(float(np.percentile(latencies, 50)) / 1000, 2),
+            "p99": round(float(np.percentile(latencies, 99)) / 1000, 2),
+            "max": round(float(latencies.max()) / 1000, 2)
+        },
+        "peak_memory_kb": round(peak / 1024, 1)
+    }
+
+def measure_batch(texts: List[str], min_posts: int = MIN_POSTS) -> Dict:
+    """classify_many одной пачкой в текущем процессе; задержка — на пачку"""
+    batch = texts * max(1, -(-min_posts // max(len(texts), 1)))
+    classify_many(texts[:100], min_batch=101)  # Таблицы text_stats строятся при первом вызове
+    started = time.perf_counter()
+    classify_many(batch, min_batch=len(batch) + 1)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    classify_many(texts[:MEMORY_SAMPLE], min_batch=MEMORY_SAMPLE + 1)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "posts": len(batch),
+        "posts_per_sec": round(len(batch) / elapsed, 1),
+        "batch_seconds": round(elapsed, 3),
+        "peak_memory_kb": round(peak / 1024, 1)
+    }
+
+def _binary(values: List[bool], labels: List[bool]) -> Dict:
+    metrics = evaluate(np.asarray(values, dtype=np.float64), np.asarray(labels, dtype=bool), 0.5)
+    return {key: round(value, 4) for key, value in metrics.items()}
+
+def accuracy(task: str, outputs: List, labels: List[Dict]) -> Optional[Dict]:
+    """Качество ответов на постах, где есть метка для задачи"""
+    key = TASK_LABELS.get(task)
+    pairs = [(output, label) for output, label in zip(outputs, labels) if label is not None and key in label]
+    if not pairs:
+        return None
+    if task == "format":
+        correct = sum(output == label["format"] for output, label in pairs)
+        return {"accuracy": round(correct / len(pairs), 4), "labeled": len(pairs)}
+    if task == "cta":
+        return dict(_binary([output is not None for output, _ in pairs], [label["has_cta"] for _, label in pairs]),
+                    labeled=len(pairs))
+    if task == "ad":
+        return dict(_binary([bool(output) for output, _ in pairs], [label["is_ad"] for _, label in pairs]),
+                    labeled=len(pairs))
+    if task == "title":
+        return dict(_binary([output[0] is not None for output, _ in pairs], [label["has_title"] for _, label in pairs]),
+                    labeled=len(pairs))
+    return None
+
+def agreement(first: List, second: List) -> float:
+    return round(sum(a == b for a, b in zip(first, second)) / max(len(first), 1), 4)
+
+def implementations() -> Dict[str, Dict]:
+    """Что замеряем: имя -> функция, задача для меток и эталон для совпадения"""
+    rules = PostClassifier(model=None)
+    targets = {
+        "post_classifier.detect_post_format": {"function": post_classifier.detect_post_format, "task": "format"},
+        "post_classifier.extract_cta": {"function": post_classifier.extract_cta, "task": "cta"},
+        "post_classifier.detect_ad_post": {"function": post_classifier.detect_ad_post, "task": "ad"},
+        "post_classifier.extract_title_and_body": {"function": post_classifier.extract_title_and_body, "task": "title"},
+    }
+    if post_classifier.model is not None:
+        # С моделью detect_ad_post идет через нее; правила замеряем отдельно и сравниваем
+        targets["rules.detect_ad_post"] = {
+            "function": rules.detect_ad_post, "task": "ad", "reference": "post_classifier.detect_ad_post"
+        }
+
+    try:
+        from account_manager import AccountManager
+    except Exception as e:
+        print(f"[benchmark] AccountManager недоступен: {e}", file=sys.stderr)
+        return targets
+    manager = AccountManager.__new__(AccountManager)  # Без __init__: клиенты и лимитер не нужны
+    # Методы AccountManager вызывают post_classifier, совпадение с ним всегда 1.0 —
+    # меряем только накладные расходы обертки
+    for method, task in (("detect_post_format", "format"), ("extract_cta", "cta"), ("detect_ad_post", "ad")):
+        targets[f"AccountManager.{method}"] = {"function": getattr(manager, method), "task": task}
+    return targets
+
+def run(corpus: List[Dict], min_posts: int = MIN_POSTS) -> Dict:
+    texts = [post["text"] for post in corpus]
+    labels = [post["labels"] for post in corpus]
+    ad_labeled = sum(label is not None and "is_ad" in label for label in labels)
+    report = {
+        "generated_at": datetime.datetime.utcnow().isoformat(),
+        "classifier_version": CLASSIFIER_VERSION,
+        "ad_model": post_classifier.model.digest if post_classifier.model is not None else None,
+        "python": sys.version.split()[0],
+        "corpus": {
+            "posts": len(texts),
+            "labeled": sum(label is not None for label in labels),
+            "ad_labeled": ad_labeled,
+            "files": CORPUS_FILES
+        },
+        "notes": [],
+        "results": {}
+    }
+    if not ad_labeled:
+        report["notes"].append("Точность detect_ad_post не измерена: нет ручной разметки posts.ad_label (--ad-labels)")
+    elif post_classifier.model is not None:
+        report["notes"].append("Модель рекламы обучена на posts.ad_label: ее точность здесь завышена")
+
+    outputs = {}
+    for name, target in implementations().items():
+        print(f"[benchmark] {name}", file=sys.stderr)
+        function = target["function"]
+        outputs[name] = [function(text) for text in texts]
+        result = measure(function, texts, min_posts)
+        result["accuracy"] = accuracy(target["task"], outputs[name], labels)
+        if target.get("reference") in outputs:
+            result["agreement"] = {target["reference"]: agreement(outputs[name], outputs[target["reference"]])}
+        report["results"][name] = result
+
+    print("[benchmark] classify_many", file=sys.stderr)
+    report["results"]["post_classifier.classify_many"] = measure_batch(texts, min_posts)
+    report["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return report
+
+def compare(report: Dict, baseline: Dict) -> List[str]:
+    """Регрессии относительно прошлого отчета: скорость и точность"""
+    problems = []
+    for name, result in report["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        if result["posts_per_sec"] < previous["posts_per_sec"] * (1 - REGRESSION_TOLERANCE):
+            problems.append(f"{name}: {previous['posts_per_sec']:,.0f} -> {result['posts_per_sec']:,.0f} постов/сек")
+        for metric in ("accuracy", "f1"):
+            now = (result.get("accuracy") or {}).get(metric)
+            before = (previous.get("accuracy") or {}).get(metric)
+            if now is not None and before is not None and now < before - ACCURACY_TOLERANCE:
+                problems.append(f"{name}: {metric} {before:.3f} -> {now:.3f}")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер скорости и качества классификаторов постов")
+    parser.add_argument("--out", help="куда записать JSON (по умолчанию stdout)")
+    parser.add_argument("--compare", help="прошлый JSON-отчет для поиска регрессий")
+    parser.add_argument("--synthetic", type=int, default=SYNTHETIC_POSTS, help="синтетических постов в корпусе")
+    parser.add_argument("--min-posts", type=int, default=MIN_POSTS, help="постов в замере каждой функции")
+    parser.add_argument("--ad-labels", action="store_true", help="мерить точность рекламы по posts.ad_label (нужна БД)")
+    args = parser.parse_args()
+
+    report = run(load_corpus(synthetic=args.synthetic, ad_labels=args.ad_labels), args.min_posts)
+    problems = []
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            problems = compare(report, json.load(f))
+        report["regressions"] = problems
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"✅ Отчет сохранен в {args.out}", file=sys.stderr)
+    else:
+        print(output)
+
+    for problem in problems:
+        print(f"❌ Регрессия: {problem}", file=sys.stderr)
+    if problems:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
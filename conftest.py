@@ -0,0 +1,31 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+# Тесты с БД работают на временной SQLite, а не на DATABASE_URL окружения
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+
+import bot.db as db
+
+db.engine.echo = False
+
+def run_async(coro):
+    """Выполняет корутину и закрывает соединения в том же event loop"""
+    async def main():
+        try:
+            return await coro
+        finally:
+            await db.engine.dispose()
+    return asyncio.run(main())
+
+@pytest.fixture
+def run():
+    """Пустая схема БД; возвращает функцию запуска корутины"""
+    async def reset():
+        async with db.engine.begin() as conn:
+            await conn.run_sync(db.Base.metadata.drop_all)
+            await conn.run_sync(db.Base.metadata.create_all)
+    run_async(reset())
+    return run_async
@@ -0,0 +1,228 @@
+"""
+Параллельный парсинг каналов всеми аккаунтами AccountManager
+
+Каналы раскладываются по аккаунтам через distribute_channels, каждый живой
+аккаунт разбирает свою долю. Освободившийся аккаунт забирает каналы с хвоста
+самой длинной чужой очереди. При долгом FloodWait или бане доля аккаунта
+раздается остальным.
+"""
+
+import asyncio
+import re
+import sys
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from pyrogram.errors import (
+    FloodWait, UserDeactivated, UserDeactivatedBan, AuthKeyUnregistered,
+    AuthKeyDuplicated, SessionRevoked, SessionExpired
+)
+
+from account_manager import account_manager
+from bot.db import AccountStatus, init_db
+from channel_ingest import (
+    save_channel_and_snapshot, ingest_history, load_crawl_state, update_crawl_state,
+    INITIAL_CRAWL_LIMIT
+)
+from similarity_index import similarity_index
+
+BAN_ERRORS = (UserDeactivated, UserDeactivatedBan, AuthKeyUnregistered, AuthKeyDuplicated,
+              SessionRevoked, SessionExpired)
+MAX_CHANNEL_ATTEMPTS = 3  # Сколько раз пробуем канал (FloodWait попыткой не считается)
+IDLE_POLL_INTERVAL = 1  # Пауза (сек) свободного воркера, пока другие еще работают
+REASSIGN_WAIT = 30  # Если аккаунт освободится позже (сек), его очередь отдаем другим
+
+async def crawl_channel(manager, account_id: str, channel: str) -> Dict:
+    """Забирает новые сообщения канала через указанный аккаунт"""
+    chat = await manager.get_chat(account_id, channel)
+    await save_channel_and_snapshot(chat)
+
+    channel_id = str(chat.id)
+    state = await load_crawl_state(channel_id)
+    if state is None or state.last_message_id is None:
+        history = manager.get_chat_history(account_id, chat.id, limit=INITIAL_CRAWL_LIMIT)
+    else:
+        history = new_messages(manager.get_chat_history(account_id, chat.id), state.last_message_id)
+
+    batch = await ingest_history(chat, history)
+    await update_crawl_state(channel_id, newest_id=batch["newest_id"], oldest_id=batch["oldest_id"])
+    if batch["error"]:
+        # Отметки сдвинуты только по записанным страницам; канал уйдет на повтор
+        raise RuntimeError(batch["error"])
+    return {"channel": channel, "posts": len(batch["posts"]), "fetched": batch["fetched"]}
+
+async def new_messages(history, last_message_id: int):
+    """Обрывает историю на уже обойденном сообщении"""
+    async for message in history:
+        if message.id <= last_message_id:
+            break
+        yield message
+
+class CrawlCoordinator:
+    def __init__(self, manager=account_manager,
+                 handler: Callable[[Any, str, str], Awaitable[Any]] = crawl_channel):
+        self.manager = manager
+        self.handler = handler
+        self.shards: Dict[str, Deque[str]] = {}
+        self.attempts: Dict[str, int] = {}
+        self.in_flight = 0
+        self.results: List[Any] = []
+        self.failed: Dict[str, str] = {}
+        self.banned = set()
+        self.account_stats: Dict[str, Dict] = {}
+        self.started_at = None
+
+    def live_accounts(self) -> List[str]:
+        return [account_id for account_id in self.manager.accounts if account_id not in self.banned]
+
+    async def plan(self, channels: List[str]) -> Dict[str, Deque[str]]:
+        """Раскладывает каналы по живым аккаунтам"""
+        live = self.live_accounts()
+        self.shards = {account_id: deque() for account_id in live}
+        if not live:
+            return self.shards
+
+        distribution = await self.manager.distribute_channels(channels)
+        orphans = []
+        for account_id, shard in distribution.items():
+            if account_id in self.shards:
+                self.shards[account_id].extend(shard)
+            else:
+                # Аккаунт активен в БД, но клиент не поднят
+                orphans.extend(shard)
+
+        assigned = {channel for shard in distribution.values() for channel in shard}
+        orphans.extend(channel for channel in channels if channel not in assigned)
+        self.spread(orphans)
+        return self.shards
+
+    def spread(self, channels, exclude: Optional[str] = None):
+        """Раздает каналы по самым коротким очередям (кроме exclude)"""
+        targets = [account_id for account_id in self.shards if account_id != exclude] or list(self.shards)
+        for channel in channels:
+            target = min(targets, key=lambda account_id: len(self.shards[account_id]))
+            self.shards[target].append(channel)
+
+    def next_channel(self, account_id: str) -> Optional[str]:
+        """Свой канал из головы очереди или чужой с хвоста самой длинной"""
+        own = self.shards.get(account_id)
+        if own:
+            return own.popleft()
+
+        victim = max(self.shards, key=lambda other: len(self.shards[other]), default=None)
+        if victim is None or not self.shards[victim]:
+            return None
+        self.account_stats[account_id]["stolen"] += 1
+        return self.shards[victim].pop()
+
+    def reassign(self, account_id: str, channel: Optional[str] = None):
+        """Отдает канал и всю оставшуюся долю аккаунта другим"""
+        channels = list(self.shards.get(account_id, ()))
+        if account_id in self.shards:
+            self.shards[account_id].clear()
+        if channel is not None:
+            channels.insert(0, channel)
+        if channels:
+            self.spread(channels, exclude=account_id)
+            print(f"[coordinator] Каналы аккаунта {account_id} переданы другим: {len(channels)}")
+
+    async def worker(self, account_id: str):
+        stats = self.account_stats[account_id]
+        while account_id not in self.banned:
+            # Пока аккаунт в FloodWait или выбрал бюджет, его работу заберут другие
+            wait = self.manager.time_until_free(account_id)
+            if wait > REASSIGN_WAIT and len(self.shards) > 1:
+                self.reassign(account_id)
+                if not any(self.shards.values()) and self.in_flight == 0:
+                    return
+                await asyncio.sleep(IDLE_POLL_INTERVAL)
+                continue
+
+            channel = self.next_channel(account_id)
+            if channel is None:
+                if self.in_flight == 0:
+                    return
+                # Кто-то еще работает и может вернуть каналы после FloodWait
+                await asyncio.sleep(IDLE_POLL_INTERVAL)
+                continue
+
+            self.in_flight += 1
+            try:
+                result = await self.handler(self.manager, account_id, channel)
+                self.results.append(result)
+                stats["channels"] += 1
+            except FloodWait as e:
+                print(f"[coordinator] FloodWait {e.value} с на аккаунте {account_id}, канал {channel}")
+                self.reassign(account_id, channel)
+            except BAN_ERRORS as e:
+                print(f"[coordinator] Аккаунт {account_id} заблокирован: {e}")
+                self.banned.add(account_id)
+                orphans = [channel, *self.shards.pop(account_id, ())]
+                if self.shards:
+                    self.spread(orphans)
+                else:
+                    for orphan in orphans:
+                        self.failed[orphan] = str(e)
+                await self.manager.update_account_status(account_id, AccountStatus.Banned)
+            except Exception as e:
+                self.attempts[channel] = self.attempts.get(channel, 0) + 1
+                stats["errors"] += 1
+                print(f"[coordinator] Ошибка парсинга {channel} через {account_id}: {e}")
+                if self.attempts[channel] < MAX_CHANNEL_ATTEMPTS and self.shards:
+                    self.spread([channel], exclude=account_id)
+                else:
+                    self.failed[channel] = str(e)
+            finally:
+                self.in_flight -= 1
+
+    async def run(self, channels: List[str]) -> Dict:
+        """Парсит каналы всеми живыми аккаунтами и возвращает сводку"""
+        self.started_at = time.monotonic()
+        await self.plan(channels)
+        if not self.shards:
+            print("[coordinator] Нет инициализированных аккаунтов")
+            return self.get_stats()
+
+        for account_id in self.shards:
+            self.account_stats[account_id] = {"channels": 0, "stolen": 0, "errors": 0}
+        print(f"[coordinator] Каналов: {len(channels)}, аккаунтов: {len(self.shards)}")
+
+        await asyncio.gather(*(self.worker(account_id) for account_id in list(self.shards)))
+        return self.get_stats()
+
+    def get_stats(self) -> Dict:
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0
+        done = len(self.results)
+        return {
+            "done": done,
+            "failed": len(self.failed),
+            "banned": sorted(self.banned),
+            "elapsed": elapsed,
+            "channels_per_minute": done / elapsed * 60 if elapsed else 0.0,
+            "accounts": self.account_stats
+        }
+
+def load_channels(path: str) -> List[str]:
+    """Usernames каналов из файла со ссылками t.me (формат channels.txt)"""
+    url_pattern = re.compile(r"https://t\.me/([a-zA-Z0-9_]+)")
+    with open(path, "r", encoding="utf-8") as f:
+        return list(dict.fromkeys(match.group(1) for match in url_pattern.finditer(f.read())))
+
+async def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else "channels.txt"
+    await init_db()
+    await account_manager.initialize_accounts()
+    try:
+        stats = await CrawlCoordinator().run(load_channels(path))
+        print(f"[coordinator] Готово: {stats['done']}, ошибок: {stats['failed']}, "
+              f"{stats['channels_per_minute']:.1f} каналов/мин")
+        for account_id, account_stats in stats["accounts"].items():
+            print(f"  {account_id}: {account_stats}")
+    finally:
+        await account_manager.close_all_accounts()
+        # Несохраненный хвост индекса похожих постов
+        similarity_index.save()
+
+if __name__ == "__main__":
+    asyncio.run(main())
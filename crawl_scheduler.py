@@ -0,0 +1,129 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from config import CRAWL_WORKERS, CRAWL_ACCOUNT_CONCURRENCY
+
+
+class CrawlScheduler:
+    """Асинхронный планировщик задач парсинга с пулом воркеров
+    
+    Воркеры разбирают общую очередь, число одновременных задач на один аккаунт
+    ограничено семафором. Воркеров не больше, чем accounts * per_account_limit,
+    чтобы лишние не простаивали на семафоре. Задачи с одинаковым ключом
+    не ставятся в очередь, пока предыдущая не завершилась.
+    """
+    
+    def __init__(self,
+                 handler: Callable[[Dict], Awaitable[Any]],
+                 workers: int = CRAWL_WORKERS,
+                 per_account_limit: int = CRAWL_ACCOUNT_CONCURRENCY,
+                 accounts: int = 1,
+                 account_key: Callable[[Dict], str] = None,
+                 task_key: Callable[[Dict], Optional[str]] = None,
+                 max_queue_size: int = 0):
+        self.handler = handler
+        self.per_account_limit = max(1, per_account_limit)
+        self.workers_count = max(1, min(workers, self.per_account_limit * max(1, accounts)))
+        self.account_key = account_key or (lambda task: task.get("account", "default"))
+        self.task_key = task_key or (lambda task: task.get("channel"))
+        
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.account_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.pending_keys = set()
+        self.active = 0  # Принятые задачи, которые еще не завершились (в очереди и в работе)
+        self.workers = []
+        self.accepting = False
+        self.started_at = None
+        self.worker_stats: Dict[int, Dict] = {}
+    
+    async def start(self):
+        """Запускает воркеры"""
+        self.accepting = True
+        self.started_at = time.monotonic()
+        for worker_id in range(self.workers_count):
+            self.worker_stats[worker_id] = {"processed": 0, "failed": 0, "busy_seconds": 0.0, "current": None}
+            self.workers.append(asyncio.create_task(self._worker(worker_id)))
+        print(f"[scheduler] Запущено воркеров: {self.workers_count}")
+    
+    async def submit(self, task: Dict) -> bool:
+        """Ставит задачу в очередь. Возвращает False, если задача отклонена"""
+        if not self.accepting:
+            return False
+        
+        key = self.task_key(task)
+        if key is not None:
+            if key in self.pending_keys:
+                return False
+            self.pending_keys.add(key)
+        
+        self.active += 1
+        await self.queue.put(task)
+        return True
+    
+    def free_slots(self) -> int:
+        """Сколько задач можно взять, чтобы каждая сразу попала к свободному воркеру
+        
+        Задачи не копятся в локальной очереди: аренда в БД продлевается только
+        во время выполнения, и ожидающая задача успела бы ее потерять.
+        """
+        return max(0, self.workers_count - self.active)
+    
+    async def stop(self, drain: bool = True):
+        """Останавливает планировщик. При drain=True дожидается выполнения очереди"""
+        self.accepting = False
+        if drain:
+            await self.queue.join()
+        
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers.clear()
+        print("[scheduler] Планировщик остановлен")
+    
+    def get_stats(self) -> Dict:
+        """Возвращает глубину очереди и счетчики по воркерам"""
+        uptime = time.monotonic() - self.started_at if self.started_at else 0
+        workers = {}
+        for worker_id, stats in self.worker_stats.items():
+            workers[worker_id] = {
+                **stats,
+                "tasks_per_minute": stats["processed"] / uptime * 60 if uptime > 0 else 0
+            }
+        
+        return {
+            "queue_depth": self.queue.qsize(),
+            "in_flight": sum(1 for stats in self.worker_stats.values() if stats["current"] is not None),
+            "processed": sum(stats["processed"] for stats in self.worker_stats.values()),
+            "failed": sum(stats["failed"] for stats in self.worker_stats.values()),
+            "uptime_seconds": uptime,
+            "workers": workers
+        }
+    
+    async def _worker(self, worker_id: int):
+        stats = self.worker_stats[worker_id]
+        while True:
+            task = await self.queue.get()
+            account = self.account_key(task)
+            semaphore = self.account_semaphores.setdefault(account, asyncio.Semaphore(self.per_account_limit))
+            started = time.monotonic()
+            try:
+                async with semaphore:
+                    stats["current"] = task
+                    result = await self.handler(task)
+                
+                if isinstance(result, dict) and result.get("success") is False:
+                    stats["failed"] += 1
+                else:
+                    stats["processed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"[scheduler] Воркер {worker_id}: ошибка задачи {task}: {e}")
+            finally:
+                stats["current"] = None
+                stats["busy_seconds"] += time.monotonic() - started
+                self.pending_keys.discard(self.task_key(task))
+                self.active -= 1
+                self.queue.task_done()
@@ -0,0 +1,317 @@
+"""
+Дневные агрегаты постов для трендовой аналитики DataAnalyzer
+
+Таблица post_daily_rollup хранит суммы по постам с метриками с ключом
+(канал, день, тема, формат, CTA, час, день недели публикации). Трендовые
+методы DataAnalyzer суммируют ее строки за нужные каналы и дни, поэтому время
+их работы зависит от числа каналов и дней, а не от размера posts.
+
+Агрегаты обновляются приращениями в той же транзакции, что и посты с
+метриками: перед записью посты блокируются и читается их прежнее состояние
+(rollup_states), после записи — новое, и в таблицу добавляется разница
+(update_rollups). Блокировка нужна, чтобы параллельные писатели одного поста
+(сборщики, обновление метрик, переклассификация) не посчитали разницу от одного
+и того же прежнего состояния дважды. Так учитываются и новые посты, и новые метрики, и смена
+меток после переклассификации. Пересобрать таблицу целиком можно через
+python db_migrations.py rollups.
+
+trending_topics_query и best_times_query строят запросы DataAnalyzer, в
+которых и суммы, и ранжирование считает БД: наружу уходят только строки топа.
+"""
+
+import datetime
+from typing import Dict, List
+
+from sqlalchemy import select, func, text, cast, literal_column, union_all, Float
+
+from bot.db import engine, Post, PostLatestMetrics, PostDailyRollup, upsert_insert
+
+TREND_MIN_ER = 1.0  # Посты с ER выше порога считаются в get_trending_topics
+TIMING_MIN_ER = 0  # Пороги постов для get_best_posting_times
+TIMING_MIN_VIEWS = 100
+LOOKUP_CHUNK_SIZE = 500  # id в одном SELECT ... IN
+UPSERT_CHUNK_SIZE = 500  # строк агрегатов в одном INSERT
+TRENDING_TOPICS_LIMIT = 10
+BEST_TIMES_LIMIT = 3
+DAY_NAMES = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]  # по dow
+
+ROLLUP_KEY = ("channel_id", "day", "topic", "format", "cta", "hour", "dow")
+ROLLUP_VALUES = (
+    "posts_count", "originals_count", "ad_count", "views_sum", "er_sum",
+    "trend_count", "trend_originals_count", "trend_ad_count", "trend_views_sum", "trend_er_sum",
+    "timing_count", "timing_views_sum", "timing_er_sum"
+)
+
+def rollup_key(state) -> tuple:
+    """Ключ строки агрегатов для поста; NULL в метках заменяется пустой строкой"""
+    posted_at = state.posted_at
+    return (
+        state.channel_id, posted_at.date(), state.topic or "", state.format or "", state.cta or "",
+        posted_at.hour, posted_at.weekday()
+    )
+
+def contribution(state) -> Dict[str, float]:
+    """Вклад одного поста в колонки ROLLUP_VALUES"""
+    er = state.er or 0
+    views = state.views_count or 0
+    original = 1 if state.dup_cluster_id in (None, state.post_id) else 0
+    ad = 1 if state.is_ad else 0
+    trend = 1 if er > TREND_MIN_ER else 0
+    timing = 1 if er > TIMING_MIN_ER and views > TIMING_MIN_VIEWS else 0
+    return {
+        "posts_count": 1,
+        "originals_count": original,
+        "ad_count": ad,
+        "views_sum": views,
+        "er_sum": er,
+        "trend_count": trend,
+        "trend_originals_count": trend * original,
+        "trend_ad_count": trend * ad,
+        "trend_views_sum": trend * views,
+        "trend_er_sum": trend * er,
+        "timing_count": timing,
+        "timing_views_sum": timing * views,
+        "timing_er_sum": timing * er
+    }
+
+async def lock_posts(session, post_ids: List[str]):
+    """Блокирует посты от других писателей агрегатов до конца транзакции
+
+    На PostgreSQL берутся транзакционные advisory-блокировки по хэшу post_id в
+    порядке возрастания (без взаимных блокировок): так сериализуются и еще не
+    вставленные посты, которые SELECT ... FOR UPDATE заблокировать не может.
+    На SQLite запись и так идет по одной транзакции на БД.
+    """
+    if session.bind.dialect.name != "postgresql" or not post_ids:
+        return
+    await session.execute(
+        text("""
+            SELECT pg_advisory_xact_lock(lock_key)
+            FROM (SELECT DISTINCT hashtextextended(post_id, 0) AS lock_key
+                  FROM unnest(CAST(:post_ids AS text[])) AS post_id
+                  ORDER BY lock_key) AS keys
+        """),
+        {"post_ids": list(post_ids)}
+    )
+
+async def rollup_states(session, post_ids: List[str], lock: bool = True) -> Dict:
+    """post_id -> поля поста и последние метрики (посты без метрик в агрегаты не входят)
+
+    С lock=True посты сначала блокируются (lock_posts): прочитанное состояние не
+    изменится другим писателем до конца транзакции, поэтому разница, которую
+    посчитает update_rollups, точная. Вызывать до записи постов и метрик.
+    """
+    states = {}
+    post_ids = list(post_ids)
+    if lock:
+        await lock_posts(session, post_ids)
+    for i in range(0, len(post_ids), LOOKUP_CHUNK_SIZE):
+        result = await session.execute(
+            select(
+                Post.post_id, Post.channel_id, Post.posted_at, Post.topic, Post.format, Post.cta,
+                Post.is_ad, Post.dup_cluster_id, PostLatestMetrics.views_count, PostLatestMetrics.er
+            )
+            .join(PostLatestMetrics, Post.post_id == PostLatestMetrics.post_id)
+            .where(Post.post_id.in_(post_ids[i:i + LOOKUP_CHUNK_SIZE]))
+        )
+        states.update((row.post_id, row) for row in result)
+    return states
+
+def rollup_deltas(before: Dict, after: Dict) -> List[Dict]:
+    """Строки приращений агрегатов: вклад новых состояний минус вклад прежних"""
+    deltas = {}
+    for states, sign in ((before, -1), (after, 1)):
+        for state in states.values():
+            delta = deltas.setdefault(rollup_key(state), dict.fromkeys(ROLLUP_VALUES, 0))
+            for field, value in contribution(state).items():
+                delta[field] += sign * value
+
+    # Сортировка по ключу: параллельные транзакции блокируют строки в одном порядке
+    return [
+        {**dict(zip(ROLLUP_KEY, key)), **delta}
+        for key, delta in sorted(deltas.items())
+        if any(delta.values())
+    ]
+
+async def update_rollups(session, before: Dict, post_ids: List[str]) -> int:
+    """Добавляет в post_daily_rollup разницу между before и текущим состоянием постов
+
+    Вызывается в транзакции записи после обновления posts и post_latest_metrics;
+    before — результат rollup_states для тех же постов до записи. Возвращает
+    число затронутых строк агрегатов.
+    """
+    rows = rollup_deltas(before, await rollup_states(session, post_ids, lock=False))
+    for i in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        stmt = upsert_insert(PostDailyRollup).values(rows[i:i + UPSERT_CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[getattr(PostDailyRollup, field) for field in ROLLUP_KEY],
+            set_={field: getattr(PostDailyRollup, field) + stmt.excluded[field] for field in ROLLUP_VALUES}
+        )
+        await session.execute(stmt)
+    return len(rows)
+
+def trending_topics_query(channel_ids: List[str], start_day: datetime.date, limit: int = TRENDING_TOPICS_LIMIT):
+    """Первые limit тем по постам с ER выше порога трендов, по строке на пару (тема, формат)
+
+    Суммирование и ранжирование (по числу постов без копий, затем по среднему
+    ER) выполняет БД; наружу уходят только строки тем из топа.
+    """
+    rollup = PostDailyRollup
+    # Большой проход группирует сырые колонки; пустые метки заменяются уже на его итогах
+    cells = (
+        select(
+            rollup.topic, rollup.format,
+            func.sum(rollup.trend_count).label("posts"),
+            func.sum(rollup.trend_originals_count).label("originals"),
+            func.sum(rollup.trend_views_sum).label("views"),
+            func.sum(rollup.trend_er_sum).label("total_er"),
+            func.sum(rollup.trend_ad_count).label("ads")
+        )
+        .where(rollup.channel_id.in_(channel_ids), rollup.day >= start_day)
+        .group_by(rollup.topic, rollup.format)
+        .having(func.sum(rollup.trend_count) > 0)
+        .cte("cells")
+    )
+
+    # Константы без параметров: выражения в SELECT и GROUP BY должны совпадать дословно
+    empty = literal_column("''")
+    topic = func.coalesce(func.nullif(cells.c.topic, empty), literal_column("'Общие'"))
+    format_type = func.coalesce(func.nullif(cells.c.format, empty), literal_column("'other'"))
+    topic_formats = (
+        select(
+            topic.label("topic"), format_type.label("format"),
+            *[func.sum(cells.c[field]).label(field) for field in ("posts", "originals", "views", "total_er", "ads")]
+        )
+        .group_by(topic, format_type)
+        .cte("topic_formats")
+    )
+
+    formats = topic_formats.c
+    posts_count = func.sum(formats.originals)
+    avg_er = cast(func.sum(formats.total_er), Float) / func.sum(formats.posts)
+    top_topics = (
+        select(
+            formats.topic, posts_count.label("posts_count"), func.sum(formats.views).label("total_views"),
+            avg_er.label("avg_er"),
+            (cast(func.sum(formats.ads), Float) * 100 / func.sum(formats.posts)).label("ad_percentage")
+        )
+        .group_by(formats.topic)
+        .order_by(posts_count.desc(), avg_er.desc(), formats.topic)
+        .limit(limit)
+        .cte("top_topics")
+    )
+
+    top = top_topics.c
+    return (
+        select(
+            top.topic, top.posts_count, top.total_views, top.avg_er, top.ad_percentage,
+            formats.format, formats.posts.label("format_count")
+        )
+        .join_from(top_topics, topic_formats, top.topic == formats.topic)
+        .order_by(top.posts_count.desc(), top.avg_er.desc(), top.topic, formats.posts.desc(), formats.format)
+    )
+
+def best_times_query(channel_ids: List[str], limit: int = BEST_TIMES_LIMIT):
+    """Первые limit часов и дней недели по среднему ER одним запросом
+
+    Строка результата: kind ("hour" или "dow"), bucket, avg_er, avg_views.
+    Строки каналов суммируются один раз по ячейкам (час, день недели), оба
+    топа считаются по этим ячейкам.
+    """
+    rollup = PostDailyRollup
+    cells = (
+        select(
+            rollup.hour, rollup.dow,
+            func.sum(rollup.timing_count).label("posts"),
+            func.sum(rollup.timing_er_sum).label("total_er"),
+            func.sum(rollup.timing_views_sum).label("views")
+        )
+        .where(rollup.channel_id.in_(channel_ids))
+        .group_by(rollup.hour, rollup.dow)
+        .having(func.sum(rollup.timing_count) > 0)
+        .cte("cells")
+    )
+
+    def top(kind: str):
+        column = cells.c[kind]
+        avg_er = cast(func.sum(cells.c.total_er), Float) / func.sum(cells.c.posts)
+        return (
+            select(
+                literal_column(f"'{kind}'").label("kind"), column.label("bucket"), avg_er.label("avg_er"),
+                (cast(func.sum(cells.c.views), Float) / func.sum(cells.c.posts)).label("avg_views")
+            )
+            .group_by(column)
+            .order_by(avg_er.desc(), column)
+            .limit(limit)
+            .subquery(f"top_{kind}")
+        )
+
+    hours, days = top("hour"), top("dow")
+    return union_all(select(hours), select(days))
+
+# Части ключа из posted_at: выражения зависят от диалекта, значения совпадают с rollup_key
+DAY_SQL = {
+    "postgresql": "CAST(p.posted_at AS DATE)",
+    "sqlite": "date(p.posted_at)",
+}
+HOUR_SQL = {
+    "postgresql": "CAST(EXTRACT(HOUR FROM p.posted_at) AS INTEGER)",
+    "sqlite": "CAST(strftime('%H', p.posted_at) AS INTEGER)",
+}
+DOW_SQL = {
+    "postgresql": "CAST(EXTRACT(ISODOW FROM p.posted_at) AS INTEGER) - 1",
+    "sqlite": "(CAST(strftime('%w', p.posted_at) AS INTEGER) + 6) % 7",
+}
+
+def _rebuild_sql(dialect_name: str) -> str:
+    er = "COALESCE(m.er, 0)"
+    views = "COALESCE(m.views_count, 0)"
+    original = "CASE WHEN p.dup_cluster_id IS NULL OR p.dup_cluster_id = p.post_id THEN 1 ELSE 0 END"
+    ad = "CASE WHEN p.is_ad THEN 1 ELSE 0 END"
+    trend = f"CASE WHEN {er} > {TREND_MIN_ER} THEN 1 ELSE 0 END"
+    timing = f"CASE WHEN {er} > {TIMING_MIN_ER} AND {views} > {TIMING_MIN_VIEWS} THEN 1 ELSE 0 END"
+    values = {
+        "posts_count": "COUNT(*)",
+        "originals_count": f"SUM({original})",
+        "ad_count": f"SUM({ad})",
+        "views_sum": f"SUM({views})",
+        "er_sum": f"SUM({er})",
+        "trend_count": f"SUM({trend})",
+        "trend_originals_count": f"SUM({trend} * {original})",
+        "trend_ad_count": f"SUM({trend} * {ad})",
+        "trend_views_sum": f"SUM({trend} * {views})",
+        "trend_er_sum": f"SUM({trend} * {er})",
+        "timing_count": f"SUM({timing})",
+        "timing_views_sum": f"SUM({timing} * {views})",
+        "timing_er_sum": f"SUM({timing} * {er})",
+    }
+    keys = {
+        "channel_id": "p.channel_id",
+        "day": DAY_SQL[dialect_name],
+        "topic": "COALESCE(p.topic, '')",
+        "format": "COALESCE(p.format, '')",
+        "cta": "COALESCE(p.cta, '')",
+        "hour": HOUR_SQL[dialect_name],
+        "dow": DOW_SQL[dialect_name],
+    }
+    return f"""
+        INSERT INTO post_daily_rollup ({', '.join(ROLLUP_KEY + ROLLUP_VALUES)})
+        SELECT {', '.join([keys[field] for field in ROLLUP_KEY] + [values[field] for field in ROLLUP_VALUES])}
+        FROM posts p
+        JOIN post_latest_metrics m ON m.post_id = p.post_id
+        GROUP BY {', '.join(keys[field] for field in ROLLUP_KEY)}
+    """
+
+async def rebuild_rollups() -> int:
+    """Пересчитывает post_daily_rollup целиком по posts и post_latest_metrics
+
+    Нужна один раз для уже накопленных постов и после ручных правок posts.
+    На PostgreSQL таблица на время пересборки блокируется от записи: сборщик
+    дождется окончания и добавит свои приращения к пересчитанным строкам.
+    """
+    async with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            await conn.execute(text("LOCK TABLE post_daily_rollup IN EXCLUSIVE MODE"))
+        await conn.execute(text("DELETE FROM post_daily_rollup"))
+        result = await conn.execute(text(_rebuild_sql(conn.dialect.name)))
+        return result.rowcount
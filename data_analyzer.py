@@ -2,9 +2,15 @@ import asyncio
 import json
 import datetime
 from typing import Dict, List, Optional, Tuple
-from sqlalchemy import select, func, desc, and_
-from bot.db import SessionLocal, Post, PostSnapshot, Channel, ChannelSnapshot, Topic, ChannelTopic
+from sqlalchemy import select, func, desc, and_, text, DateTime
+from bot.db import SessionLocal, Post, PostLatestMetrics, Channel, ChannelSnapshot, Topic, ChannelTopic
+from category_index import category_index
+from daily_rollups import DAY_NAMES, trending_topics_query, best_times_query
 from gpt_service import gpt_service
+from post_classifier import join_title_and_body
+from similarity_index import similarity_index
+
+SIMILAR_CANDIDATES_FACTOR = 10  # Кандидатов из индекса на один возвращаемый пост (часть отсеется по ER)
 
 class DataAnalyzer:
     def __init__(self):
@@ -13,35 +19,25 @@ class DataAnalyzer:
     
     async def get_popular_posts_by_category(self, category: str, limit: int = 10) -> List[Dict]:
         """Получает популярные посты по категории"""
+        channel_ids = await category_index.channel_ids(category)
+        if not channel_ids:
+            return []
+        
         async with SessionLocal() as session:
-            # Получаем каналы по категории
-            channels_query = await session.execute("""
-                SELECT c.channel_id, c.title, c.username
-                FROM channels c
-                JOIN channel_topic ct ON c.channel_id = ct.channel_id
-                JOIN topics t ON ct.topic_id = t.topic_id
-                WHERE t.topic_name ILIKE :category
-            """, {"category": f"%{category}%"})
-            
-            channel_ids = [row.channel_id for row in channels_query]
-            
-            if not channel_ids:
-                return []
-            
             # Получаем посты с высоким ER
-            posts_query = await session.execute("""
+            posts_query = await session.execute(text("""
                 SELECT p.post_id, p.title, p.body, p.format, p.cta, p.is_ad,
                        ps.views_count, ps.er, ps.reactions,
                        c.title as channel_title, c.username as channel_username
                 FROM posts p
-                JOIN posts_snapshot ps ON p.post_id = ps.post_id
+                JOIN post_latest_metrics ps ON p.post_id = ps.post_id
                 JOIN channels c ON p.channel_id = c.channel_id
                 WHERE p.channel_id = ANY(:channel_ids)
                 AND ps.er > 2.0  -- Минимальный ER
                 AND ps.views_count > 1000  -- Минимальные просмотры
                 ORDER BY ps.er DESC, ps.views_count DESC
                 LIMIT :limit
-            """, {"channel_ids": channel_ids, "limit": limit})
+            """), {"channel_ids": channel_ids, "limit": limit})
             
             posts = []
             for row in posts_query:
@@ -49,6 +45,7 @@ class DataAnalyzer:
                     "post_id": row.post_id,
                     "title": row.title,
                     "body": row.body,
+                    "text": join_title_and_body(row.title, row.body),
                     "format": row.format,
                     "cta": row.cta,
                     "is_ad": row.is_ad,
@@ -62,93 +59,104 @@ class DataAnalyzer:
             
             return posts
     
+    async def get_similar_successful_posts(self, text: str, category: str = "", limit: int = 3,
+                                           min_er: float = 2.0) -> List[Dict]:
+        """Посты, похожие на text, с ER выше min_er (по индексу похожих постов)
+        
+        Посты темы category идут первыми. Если индекс пуст или ничего не нашлось,
+        возвращаются популярные посты категории.
+        """
+        matches = similarity_index.search(text, k=limit * SIMILAR_CANDIDATES_FACTOR)
+        if not matches:
+            return await self.get_popular_posts_by_category(category, limit=limit) if category else []
+        
+        scores = dict(matches)
+        async with SessionLocal() as session:
+            result = await session.execute(
+                select(
+                    Post.post_id, Post.title, Post.body, Post.topic, Post.format,
+                    PostLatestMetrics.er, PostLatestMetrics.views_count.label("views")
+                )
+                .join(PostLatestMetrics, PostLatestMetrics.post_id == Post.post_id)
+                .where(Post.post_id.in_(list(scores)))
+            )
+            rows = [row for row in result if (row.er or 0) > min_er]
+        
+        rows.sort(key=lambda row: (row.topic != category if category else False, -scores[row.post_id]))
+        posts = [
+            {
+                "post_id": row.post_id,
+                "text": join_title_and_body(row.title, row.body),
+                "topic": row.topic,
+                "format": row.format,
+                "er": row.er,
+                "views": row.views,
+                "similarity": scores[row.post_id]
+            }
+            for row in rows[:limit]
+        ]
+        if not posts and category:
+            return await self.get_popular_posts_by_category(category, limit=limit)
+        return posts
+    
     async def get_trending_topics(self, category: str, days: int = 7) -> List[Dict]:
-        """Получает трендовые темы за последние дни"""
+        """Получает трендовые темы за последние дни (топ считает БД по post_daily_rollup)"""
+        channel_ids = await category_index.channel_ids(category)
+        if not channel_ids:
+            return []
+        
+        start_day = (datetime.datetime.utcnow() - datetime.timedelta(days=days)).date()
         async with SessionLocal() as session:
-            # Получаем посты за последние дни
-            start_date = datetime.datetime.utcnow() - datetime.timedelta(days=days)
-            
-            posts_query = await session.execute("""
-                SELECT p.topic, p.format, p.is_ad,
-                       ps.views_count, ps.er, ps.reactions,
-                       COUNT(*) OVER (PARTITION BY p.topic) as topic_count
-                FROM posts p
-                JOIN posts_snapshot ps ON p.post_id = ps.post_id
-                JOIN channels c ON p.channel_id = c.channel_id
-                JOIN channel_topic ct ON c.channel_id = ct.channel_id
-                JOIN topics t ON ct.topic_id = t.topic_id
-                WHERE t.topic_name ILIKE :category
-                AND p.posted_at >= :start_date
-                AND ps.er > 1.0
-            """, {"category": f"%{category}%", "start_date": start_date})
+            result = await session.execute(trending_topics_query(channel_ids, start_day))
             
-            # Группируем по темам
+            # Строки уже отсортированы по месту темы; собираем форматы каждой темы.
+            # posts_count — посты без копий из групп дублей
             topics = {}
-            for row in posts_query:
-                topic = row.topic or "Общие"
-                if topic not in topics:
-                    topics[topic] = {
-                        "topic": topic,
-                        "posts_count": 0,
-                        "total_views": 0,
-                        "avg_er": 0,
+            for row in result:
+                if row.topic not in topics:
+                    topics[row.topic] = {
+                        "topic": row.topic,
+                        "posts_count": row.posts_count,
+                        "total_views": row.total_views,
+                        "avg_er": row.avg_er,
                         "formats": {},
-                        "ad_percentage": 0
+                        "ad_percentage": row.ad_percentage
                     }
-                
-                topics[topic]["posts_count"] += 1
-                topics[topic]["total_views"] += row.views_count or 0
-                topics[topic]["avg_er"] += row.er or 0
-                
-                # Считаем форматы
-                format_type = row.format or "other"
-                if format_type not in topics[topic]["formats"]:
-                    topics[topic]["formats"][format_type] = 0
-                topics[topic]["formats"][format_type] += 1
-                
-                # Считаем рекламные посты
-                if row.is_ad:
-                    topics[topic]["ad_percentage"] += 1
-            
-            # Вычисляем средние значения
-            for topic_data in topics.values():
-                if topic_data["posts_count"] > 0:
-                    topic_data["avg_er"] /= topic_data["posts_count"]
-                    topic_data["ad_percentage"] = (topic_data["ad_percentage"] / topic_data["posts_count"]) * 100
-            
-            # Сортируем по количеству постов и ER
-            trending_topics = sorted(
-                topics.values(),
-                key=lambda x: (x["posts_count"], x["avg_er"]),
-                reverse=True
-            )
+                topics[row.topic]["formats"][row.format] = row.format_count
             
-            return trending_topics[:10]
+            return list(topics.values())
     
     async def get_trending_channels(self, category: str, days: int = 3) -> List[Dict]:
         """Получает трендовые каналы за последние дни"""
+        channel_ids = await category_index.channel_ids(category)
+        if not channel_ids:
+            return []
+        
         async with SessionLocal() as session:
             start_date = datetime.datetime.utcnow() - datetime.timedelta(days=days)
             
-            channels_query = await session.execute("""
+            channels_query = await session.execute(text("""
                 SELECT c.channel_id, c.title, c.username, c.description,
                        cs.subscribers_count, cs.engagement_rate,
                        COUNT(p.post_id) as posts_count,
                        AVG(ps.er) as avg_er,
                        SUM(ps.views_count) as total_views
                 FROM channels c
-                JOIN channel_topic ct ON c.channel_id = ct.channel_id
-                JOIN topics t ON ct.topic_id = t.topic_id
+                -- Последний снапшот канала
+                LEFT JOIN channel_snapshots cs ON cs.channel_id = c.channel_id
+                    AND cs.snapshot_date = (
+                        SELECT MAX(s.snapshot_date) FROM channel_snapshots s WHERE s.channel_id = c.channel_id
+                    )
                 LEFT JOIN posts p ON c.channel_id = p.channel_id
-                LEFT JOIN posts_snapshot ps ON p.post_id = ps.post_id
-                WHERE t.topic_name ILIKE :category
+                LEFT JOIN post_latest_metrics ps ON p.post_id = ps.post_id
+                WHERE c.channel_id = ANY(:channel_ids)
                 AND p.posted_at >= :start_date
                 GROUP BY c.channel_id, c.title, c.username, c.description,
                          cs.subscribers_count, cs.engagement_rate
                 HAVING COUNT(p.post_id) > 0
                 ORDER BY cs.engagement_rate DESC, total_views DESC
                 LIMIT 10
-            """, {"category": f"%{category}%", "start_date": start_date})
+            """), {"channel_ids": channel_ids, "start_date": start_date})
             
             channels = []
             for row in channels_query:
@@ -168,88 +176,42 @@ class DataAnalyzer:
             return channels
     
     async def get_best_posting_times(self, category: str) -> Dict:
-        """Анализирует лучшее время для публикаций"""
+        """Анализирует лучшее время для публикаций (топ считает БД по post_daily_rollup)"""
+        channel_ids = await category_index.channel_ids(category)
+        if not channel_ids:
+            return {"best_hours": [], "best_days": []}
+        
         async with SessionLocal() as session:
-            # Получаем посты с данными о времени
-            posts_query = await session.execute("""
-                SELECT 
-                    EXTRACT(HOUR FROM p.posted_at) as hour,
-                    EXTRACT(DOW FROM p.posted_at) as day_of_week,
-                    ps.er, ps.views_count
-                FROM posts p
-                JOIN posts_snapshot ps ON p.post_id = ps.post_id
-                JOIN channels c ON p.channel_id = c.channel_id
-                JOIN channel_topic ct ON c.channel_id = ct.channel_id
-                JOIN topics t ON ct.topic_id = t.topic_id
-                WHERE t.topic_name ILIKE :category
-                AND ps.er > 0
-                AND ps.views_count > 100
-            """, {"category": f"%{category}%"})
+            result = await session.execute(best_times_query(channel_ids))
             
-            # Анализируем время
-            hour_stats = {}
-            day_stats = {}
-            
-            for row in posts_query:
-                hour = int(row.hour)
-                day = int(row.day_of_week)
-                er = row.er or 0
-                views = row.views_count or 0
-                
-                # Статистика по часам
-                if hour not in hour_stats:
-                    hour_stats[hour] = {"total_er": 0, "total_views": 0, "count": 0}
-                hour_stats[hour]["total_er"] += er
-                hour_stats[hour]["total_views"] += views
-                hour_stats[hour]["count"] += 1
-                
-                # Статистика по дням
-                if day not in day_stats:
-                    day_stats[day] = {"total_er": 0, "total_views": 0, "count": 0}
-                day_stats[day]["total_er"] += er
-                day_stats[day]["total_views"] += views
-                day_stats[day]["count"] += 1
-            
-            # Вычисляем средние значения
-            for hour in hour_stats:
-                if hour_stats[hour]["count"] > 0:
-                    hour_stats[hour]["avg_er"] = hour_stats[hour]["total_er"] / hour_stats[hour]["count"]
-                    hour_stats[hour]["avg_views"] = hour_stats[hour]["total_views"] / hour_stats[hour]["count"]
-            
-            for day in day_stats:
-                if day_stats[day]["count"] > 0:
-                    day_stats[day]["avg_er"] = day_stats[day]["total_er"] / day_stats[day]["count"]
-                    day_stats[day]["avg_views"] = day_stats[day]["total_views"] / day_stats[day]["count"]
-            
-            # Находим лучшие часы и дни
-            best_hours = sorted(hour_stats.items(), key=lambda x: x[1]["avg_er"], reverse=True)[:3]
-            best_days = sorted(day_stats.items(), key=lambda x: x[1]["avg_er"], reverse=True)[:3]
-            
-            day_names = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
+            best = {"hour": [], "dow": []}
+            for row in result:
+                best[row.kind].append(row)
             
             return {
-                "best_hours": [{"hour": hour, "avg_er": data["avg_er"], "avg_views": data["avg_views"]} 
-                              for hour, data in best_hours],
-                "best_days": [{"day": day_names[day], "avg_er": data["avg_er"], "avg_views": data["avg_views"]} 
-                             for day, data in best_days]
+                "best_hours": [{"hour": row.bucket, "avg_er": row.avg_er, "avg_views": row.avg_views}
+                              for row in best["hour"]],
+                "best_days": [{"day": DAY_NAMES[row.bucket], "avg_er": row.avg_er, "avg_views": row.avg_views}
+                             for row in best["dow"]]
             }
     
     async def analyze_content_trends(self, category: str) -> Dict:
-        """Анализирует тренды контента"""
+        """Анализирует тренды контента (по дневным агрегатам post_daily_rollup)"""
+        channel_ids = await category_index.channel_ids(category)
+        if not channel_ids:
+            return {"formats": [], "cta_trends": []}
+        
         async with SessionLocal() as session:
             # Получаем статистику по форматам
-            formats_query = await session.execute("""
-                SELECT p.format, COUNT(*) as count, AVG(ps.er) as avg_er
-                FROM posts p
-                JOIN posts_snapshot ps ON p.post_id = ps.post_id
-                JOIN channels c ON p.channel_id = c.channel_id
-                JOIN channel_topic ct ON c.channel_id = ct.channel_id
-                JOIN topics t ON ct.topic_id = t.topic_id
-                WHERE t.topic_name ILIKE :category
-                AND p.format IS NOT NULL
-                GROUP BY p.format
+            formats_query = await session.execute(text("""
+                SELECT r.format, SUM(r.posts_count) as count, SUM(r.er_sum) / SUM(r.posts_count) as avg_er
+                FROM post_daily_rollup r
+                WHERE r.channel_id = ANY(:channel_ids)
+                AND r.format <> ''
+                GROUP BY r.format
+                HAVING SUM(r.posts_count) > 0
                 ORDER BY count DESC
-            """, {"category": f"%{category}%"})
+            """), {"channel_ids": channel_ids})
             
             formats = []
             for row in formats_query:
@@ -261,19 +223,16 @@ class DataAnalyzer:
                 formats.append(format_data)
             
             # Анализируем тренды CTA
-            cta_query = await session.execute("""
-                SELECT p.cta, COUNT(*) as count, AVG(ps.er) as avg_er
-                FROM posts p
-                JOIN posts_snapshot ps ON p.post_id = ps.post_id
-                JOIN channels c ON p.channel_id = c.channel_id
-                JOIN channel_topic ct ON c.channel_id = ct.channel_id
-                JOIN topics t ON ct.topic_id = t.topic_id
-                WHERE t.topic_name ILIKE :category
-                AND p.cta IS NOT NULL
-                GROUP BY p.cta
+            cta_query = await session.execute(text("""
+                SELECT r.cta, SUM(r.posts_count) as count, SUM(r.er_sum) / SUM(r.posts_count) as avg_er
+                FROM post_daily_rollup r
+                WHERE r.channel_id = ANY(:channel_ids)
+                AND r.cta <> ''
+                GROUP BY r.cta
+                HAVING SUM(r.posts_count) > 0
                 ORDER BY count DESC
                 LIMIT 10
-            """, {"category": f"%{category}%"})
+            """), {"channel_ids": channel_ids})
             
             cta_trends = []
             for row in cta_query:
@@ -290,37 +249,37 @@ class DataAnalyzer:
             }
     
     async def get_falling_trends(self, category: str) -> List[Dict]:
-        """Определяет падающие тренды"""
+        """Определяет падающие тренды (по дневным агрегатам post_daily_rollup)"""
+        channel_ids = await category_index.channel_ids(category)
+        if not channel_ids:
+            return []
+        
         async with SessionLocal() as session:
             # Сравниваем статистику за последние 7 и 30 дней
-            week_ago = datetime.datetime.utcnow() - datetime.timedelta(days=7)
-            month_ago = datetime.datetime.utcnow() - datetime.timedelta(days=30)
+            week_ago = (datetime.datetime.utcnow() - datetime.timedelta(days=7)).date()
+            month_ago = (datetime.datetime.utcnow() - datetime.timedelta(days=30)).date()
             
             # Статистика за неделю
-            week_stats = await session.execute("""
-                SELECT p.format, p.cta, COUNT(*) as count, AVG(ps.er) as avg_er
-                FROM posts p
-                JOIN posts_snapshot ps ON p.post_id = ps.post_id
-                JOIN channels c ON p.channel_id = c.channel_id
-                JOIN channel_topic ct ON c.channel_id = ct.channel_id
-                JOIN topics t ON ct.topic_id = t.topic_id
-                WHERE t.topic_name ILIKE :category
-                AND p.posted_at >= :week_ago
-                GROUP BY p.format, p.cta
-            """, {"category": f"%{category}%", "week_ago": week_ago})
+            week_stats = await session.execute(text("""
+                SELECT NULLIF(r.format, '') as format, NULLIF(r.cta, '') as cta,
+                       SUM(r.posts_count) as count, SUM(r.er_sum) / SUM(r.posts_count) as avg_er
+                FROM post_daily_rollup r
+                WHERE r.channel_id = ANY(:channel_ids)
+                AND r.day >= :week_ago
+                GROUP BY r.format, r.cta
+                HAVING SUM(r.posts_count) > 0
+            """), {"channel_ids": channel_ids, "week_ago": week_ago})
             
             # Статистика за месяц
-            month_stats = await session.execute("""
-                SELECT p.format, p.cta, COUNT(*) as count, AVG(ps.er) as avg_er
-                FROM posts p
-                JOIN posts_snapshot ps ON p.post_id = ps.post_id
-                JOIN channels c ON p.channel_id = c.channel_id
-                JOIN channel_topic ct ON c.channel_id = ct.channel_id
-                JOIN topics t ON ct.topic_id = t.topic_id
-                WHERE t.topic_name ILIKE :category
-                AND p.posted_at >= :month_ago
-                GROUP BY p.format, p.cta
-            """, {"category": f"%{category}%", "month_ago": month_ago})
+            month_stats = await session.execute(text("""
+                SELECT NULLIF(r.format, '') as format, NULLIF(r.cta, '') as cta,
+                       SUM(r.posts_count) as count, SUM(r.er_sum) / SUM(r.posts_count) as avg_er
+                FROM post_daily_rollup r
+                WHERE r.channel_id = ANY(:channel_ids)
+                AND r.day >= :month_ago
+                GROUP BY r.format, r.cta
+                HAVING SUM(r.posts_count) > 0
+            """), {"channel_ids": channel_ids, "month_ago": month_ago})
             
             # Создаем словари для сравнения
             week_data = {}
@@ -362,19 +321,24 @@ class DataAnalyzer:
         """Полный анализ канала"""
         async with SessionLocal() as session:
             # Основная статистика канала
-            channel_query = await session.execute("""
+            # Метрики берем из последнего снапшота, иначе каждый снапшот дает свою строку
+            channel_query = await session.execute(text("""
                 SELECT c.title, c.username, c.description,
                        cs.subscribers_count, cs.engagement_rate,
                        cs.avg_reactions, cs.avg_reposts,
                        COUNT(p.post_id) as total_posts
                 FROM channels c
-                LEFT JOIN channel_snapshots cs ON c.channel_id = cs.channel_id
+                LEFT JOIN channel_snapshots cs ON cs.channel_id = c.channel_id
+                     AND cs.snapshot_date = (
+                         SELECT MAX(snapshot_date) FROM channel_snapshots
+                         WHERE channel_id = c.channel_id
+                     )
                 LEFT JOIN posts p ON c.channel_id = p.channel_id
                 WHERE c.channel_id = :channel_id
                 GROUP BY c.title, c.username, c.description,
                          cs.subscribers_count, cs.engagement_rate,
                          cs.avg_reactions, cs.avg_reposts
-            """, {"channel_id": channel_id})
+            """), {"channel_id": channel_id})
             
             channel_data = None
             for row in channel_query:
@@ -394,15 +358,15 @@ class DataAnalyzer:
                 return {}
             
             # Статистика по форматам
-            formats_query = await session.execute("""
+            formats_query = await session.execute(text("""
                 SELECT p.format, COUNT(*) as count, AVG(ps.er) as avg_er
                 FROM posts p
-                JOIN posts_snapshot ps ON p.post_id = ps.post_id
+                JOIN post_latest_metrics ps ON p.post_id = ps.post_id
                 WHERE p.channel_id = :channel_id
                 AND p.format IS NOT NULL
                 GROUP BY p.format
                 ORDER BY count DESC
-            """, {"channel_id": channel_id})
+            """), {"channel_id": channel_id})
             
             formats = []
             for row in formats_query:
@@ -413,15 +377,15 @@ class DataAnalyzer:
                 })
             
             # Лучшие посты
-            top_posts_query = await session.execute("""
+            top_posts_query = await session.execute(text("""
                 SELECT p.title, p.body, p.format, p.cta,
                        ps.views_count, ps.er, ps.reactions
                 FROM posts p
-                JOIN posts_snapshot ps ON p.post_id = ps.post_id
+                JOIN post_latest_metrics ps ON p.post_id = ps.post_id
                 WHERE p.channel_id = :channel_id
                 ORDER BY ps.er DESC, ps.views_count DESC
                 LIMIT 5
-            """, {"channel_id": channel_id})
+            """), {"channel_id": channel_id})
             
             top_posts = []
             for row in top_posts_query:
@@ -445,14 +409,14 @@ class DataAnalyzer:
         """Анализ аудитории канала"""
         async with SessionLocal() as session:
             # Получаем снапшоты канала
-            snapshots_query = await session.execute("""
+            snapshots_query = await session.execute(text("""
                 SELECT snapshot_date, subscribers_count, new_followers, lost_followers,
                        active_users_percent, silent_users_percent, engagement_rate
                 FROM channel_snapshots
                 WHERE channel_id = :channel_id
                 ORDER BY snapshot_date DESC
                 LIMIT 30
-            """, {"channel_id": channel_id})
+            """).columns(snapshot_date=DateTime), {"channel_id": channel_id})
             
             snapshots = []
             for row in snapshots_query:
@@ -488,23 +452,13 @@ class DataAnalyzer:
     
     async def get_successful_creatives_by_category(self, category: str, limit: int = 10) -> List[Dict]:
         """Получает успешные рекламные креативы по категории"""
+        channel_ids = await category_index.channel_ids(category)
+        if not channel_ids:
+            return []
+        
         async with SessionLocal() as session:
-            # Получаем каналы по категории
-            channels_query = await session.execute("""
-                SELECT c.channel_id, c.title, c.username
-                FROM channels c
-                JOIN channel_topic ct ON c.channel_id = ct.channel_id
-                JOIN topics t ON ct.topic_id = t.topic_id
-                WHERE t.topic_name ILIKE :category
-            """, {"category": f"%{category}%"})
-            
-            channel_ids = [row.channel_id for row in channels_query]
-            
-            if not channel_ids:
-                return []
-            
             # Получаем рекламные креативы с высоким ER
-            creatives_query = await session.execute("""
+            creatives_query = await session.execute(text("""
                 SELECT cr.creative_id, cr.ad_title, cr.ad_text, cr.cta, cr.ad_topic,
                        cr.channel_topic, cr.tags, cr.created_at
                 FROM creatives cr
@@ -512,7 +466,7 @@ class DataAnalyzer:
                 WHERE cr.channel_id = ANY(:channel_ids)
                 ORDER BY cr.created_at DESC
                 LIMIT :limit
-            """, {"channel_ids": channel_ids, "limit": limit})
+            """), {"channel_ids": channel_ids, "limit": limit})
             
             creatives = []
             for row in creatives_query:
@@ -532,41 +486,31 @@ class DataAnalyzer:
     
     async def get_engagement_analysis(self, category: str) -> Dict:
         """Получает анализ вовлеченности по категории"""
+        channel_ids = await category_index.channel_ids(category)
+        if not channel_ids:
+            return {
+                "avg_er": 0,
+                "best_formats": [],
+                "engagement_trends": [],
+                "recommendations": []
+            }
+        
         async with SessionLocal() as session:
-            # Получаем каналы по категории
-            channels_query = await session.execute("""
-                SELECT c.channel_id, c.title, c.username
-                FROM channels c
-                JOIN channel_topic ct ON c.channel_id = ct.channel_id
-                JOIN topics t ON ct.topic_id = t.topic_id
-                WHERE t.topic_name ILIKE :category
-            """, {"category": f"%{category}%"})
-            
-            channel_ids = [row.channel_id for row in channels_query]
-            
-            if not channel_ids:
-                return {
-                    "avg_er": 0,
-                    "best_formats": [],
-                    "engagement_trends": [],
-                    "recommendations": []
-                }
-            
             # Получаем статистику вовлеченности
-            engagement_query = await session.execute("""
+            engagement_query = await session.execute(text("""
                 SELECT 
                     AVG(ps.er) as avg_er,
                     p.format,
                     COUNT(*) as posts_count,
                     AVG(ps.views_count) as avg_views
                 FROM posts p
-                JOIN posts_snapshot ps ON p.post_id = ps.post_id
+                JOIN post_latest_metrics ps ON p.post_id = ps.post_id
                 WHERE p.channel_id = ANY(:channel_ids)
                 AND ps.er > 0
                 GROUP BY p.format
                 ORDER BY avg_er DESC
                 LIMIT 5
-            """, {"channel_ids": channel_ids})
+            """), {"channel_ids": channel_ids})
             
             formats = []
             total_er = 0
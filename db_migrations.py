@@ -0,0 +1,243 @@
+"""
+Индексы горячих запросов DataAnalyzer и проверка планов
+
+Набор индексов — bot.db.HOT_QUERY_INDEXES и все индексы таблиц
+bot.db.LARGE_TABLES (init_db их на существующей БД не строит). На работающей
+PostgreSQL они строятся через CREATE INDEX CONCURRENTLY: запись в таблицы
+не блокируется. Сборку, прерванную на середине, PostgreSQL оставляет
+невалидным индексом; такой индекс удаляется и строится заново. На SQLite
+индексы создаются обычным CREATE INDEX.
+
+Проверка строит EXPLAIN для запросов HOT_QUERIES (они повторяют соединения и
+фильтры DataAnalyzer) и сообщает, какие таблицы читаются целиком. На
+PostgreSQL последовательное чтение на время EXPLAIN запрещено, поэтому Seq Scan
+в плане значит, что подходящего индекса нет, а не что таблица пока маленькая.
+
+    python db_migrations.py            # построить недостающие индексы
+    python db_migrations.py check      # найти Seq Scan в горячих запросах (код выхода 1)
+    python db_migrations.py status     # какие индексы есть
+    python db_migrations.py latest-metrics  # заполнить post_latest_metrics по истории снапшотов
+    python db_migrations.py rollups    # пересобрать дневные агрегаты post_daily_rollup
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import sys
+from typing import Dict, List
+
+from sqlalchemy import select, func, text
+from sqlalchemy.schema import CreateIndex
+
+from bot.db import (
+    engine, init_db, migration_indexes, ChannelSnapshot, Post, PostSnapshot,
+    PostLatestMetrics, PostDailyRollup
+)
+from daily_rollups import rebuild_rollups
+
+SAMPLE_CHANNEL_IDS = ["-1001", "-1002"]
+# Индексы прежних версий, которые больше ни один запрос не использует
+OBSOLETE_INDEXES = ("ix_topics_topic_name_trgm", "ix_channel_topic_channel", "ix_channel_topic_topic")
+
+def _week_ago() -> datetime.datetime:
+    return datetime.datetime.utcnow() - datetime.timedelta(days=7)
+
+# Запросы с теми же соединениями и фильтрами, что в DataAnalyzer
+HOT_QUERIES = {
+    "popular_posts": lambda: (
+        select(Post.post_id, PostLatestMetrics.er, PostLatestMetrics.views_count)
+        .join(PostLatestMetrics, Post.post_id == PostLatestMetrics.post_id)
+        .where(Post.channel_id.in_(SAMPLE_CHANNEL_IDS), PostLatestMetrics.er > 2.0, PostLatestMetrics.views_count > 1000)
+        .order_by(PostLatestMetrics.er.desc())
+        .limit(10)
+    ),
+    "trending_topics": lambda: (
+        select(PostDailyRollup.topic, func.sum(PostDailyRollup.trend_count))
+        .where(PostDailyRollup.channel_id.in_(SAMPLE_CHANNEL_IDS), PostDailyRollup.day >= _week_ago().date())
+        .group_by(PostDailyRollup.topic)
+    ),
+    "channel_posts": lambda: (
+        select(Post.post_id, PostLatestMetrics.er)
+        .join(PostLatestMetrics, Post.post_id == PostLatestMetrics.post_id)
+        .where(Post.channel_id == SAMPLE_CHANNEL_IDS[0])
+        .order_by(PostLatestMetrics.er.desc())
+        .limit(5)
+    ),
+    "recent_channel_posts": lambda: (
+        select(Post.post_id)
+        .where(Post.channel_id == SAMPLE_CHANNEL_IDS[0], Post.posted_at >= _week_ago())
+    ),
+    "final_metrics": lambda: (
+        select(PostSnapshot.post_id, PostSnapshot.er)
+        .where(PostSnapshot.is_final, PostSnapshot.post_id.in_(["p1", "p2"]))
+    ),
+    "latest_channel_snapshot": lambda: (
+        select(ChannelSnapshot.subscribers_count)
+        .where(ChannelSnapshot.channel_id == SAMPLE_CHANNEL_IDS[0])
+        .order_by(ChannelSnapshot.snapshot_date.desc())
+        .limit(1)
+    ),
+}
+
+def _compile(query, dialect) -> str:
+    return str(query.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+
+async def existing_indexes(conn) -> Dict[str, bool]:
+    """Имя индекса -> валиден ли он (на SQLite все существующие валидны)"""
+    if conn.dialect.name == "postgresql":
+        result = await conn.execute(text("""
+            SELECT c.relname AS name, i.indisvalid AS valid
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = current_schema()
+        """))
+        return {row.name: row.valid for row in result}
+    result = await conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))
+    return {row.name: True for row in result}
+
+async def migrate() -> List[str]:
+    """Строит недостающие индексы migration_indexes и удаляет OBSOLETE_INDEXES, возвращает имена построенных"""
+    built = []
+    async with engine.connect() as conn:
+        postgres = conn.dialect.name == "postgresql"
+        if postgres:
+            # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+
+        existing = await existing_indexes(conn)
+        for name in OBSOLETE_INDEXES:
+            if name in existing:
+                print(f"[migrations] {name} не используется, удаляю")
+                await conn.execute(text(f"DROP INDEX {'CONCURRENTLY ' if postgres else ''}IF EXISTS {name}"))
+                if not postgres:
+                    await conn.commit()
+
+        for index in migration_indexes(conn.dialect.name):
+            if existing.get(index.name):
+                continue
+            if index.name in existing:
+                print(f"[migrations] {index.name} невалиден после прерванной сборки, строю заново")
+                await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}"))
+
+            statement = _compile(CreateIndex(index, if_not_exists=True), conn.dialect)
+            if postgres:
+                statement = statement.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)
+            print(f"[migrations] {statement}")
+            await conn.execute(text(statement))
+            if not postgres:
+                await conn.commit()
+            built.append(index.name)
+
+        if built:
+            # Свежая статистика, чтобы планировщик сразу начал выбирать новые индексы
+            for table in sorted({index.table.name for index in migration_indexes(conn.dialect.name) if index.name in built}):
+                await conn.execute(text(f"ANALYZE {table}"))
+            if not postgres:
+                await conn.commit()
+    return built
+
+# Сумма реакций из JSON-колонки reactions: выражение зависит от диалекта
+REACTIONS_TOTAL_SQL = {
+    "postgresql": "(SELECT COALESCE(SUM(value::int), 0) FROM json_each_text(reactions::json))",
+    "sqlite": "(SELECT COALESCE(SUM(value), 0) FROM json_each(reactions))",
+}
+
+async def backfill_latest_metrics() -> int:
+    """Заполняет post_latest_metrics последними снапшотами постов, которых в ней еще нет
+
+    Нужна один раз для БД, где снапшоты писались до появления таблицы; дальше ее
+    поддерживает userbot_stats при записи снапшотов.
+    """
+    async with engine.begin() as conn:
+        reactions_total = REACTIONS_TOTAL_SQL[conn.dialect.name]
+        result = await conn.execute(text(f"""
+            INSERT INTO post_latest_metrics
+                (post_id, views_count, reactions, reactions_total, forwards, comments, er, snapshot_date, is_final)
+            SELECT post_id, views_count, reactions,
+                   CASE WHEN reactions IS NULL THEN 0 ELSE {reactions_total} END,
+                   forwards, comments, er, snapshot_date, is_final
+            FROM (
+                SELECT ps.*, ROW_NUMBER() OVER (
+                    PARTITION BY ps.post_id ORDER BY ps.snapshot_date DESC, ps.id DESC
+                ) AS position
+                FROM posts_snapshot ps
+                WHERE ps.snapshot_date IS NOT NULL
+                AND NOT EXISTS (SELECT 1 FROM post_latest_metrics lm WHERE lm.post_id = ps.post_id)
+            ) latest
+            WHERE position = 1
+            ON CONFLICT (post_id) DO NOTHING
+        """))
+        return result.rowcount
+
+def _postgres_seq_scans(plan: Dict) -> List[str]:
+    tables = [plan["Relation Name"]] if plan.get("Node Type") == "Seq Scan" else []
+    for child in plan.get("Plans", ()):
+        tables.extend(_postgres_seq_scans(child))
+    return tables
+
+async def explain(conn, query) -> Dict:
+    """План запроса и таблицы, которые в нем читаются целиком"""
+    sql = _compile(query, conn.dialect)
+    if conn.dialect.name == "postgresql":
+        async with conn.begin():
+            # Без этого планировщик выбирает Seq Scan на маленьких таблицах даже при наличии индекса
+            await conn.execute(text("SET LOCAL enable_seqscan = off"))
+            result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}")
+            plan = result.scalar()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        return {"plan": plan, "seq_scans": sorted(set(_postgres_seq_scans(plan[0]["Plan"])))}
+
+    rows = (await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")).all()
+    details = [row[3] for row in rows]
+    seq_scans = [
+        detail.split()[1] for detail in details
+        if detail.startswith("SCAN ") and "INDEX" not in detail
+    ]
+    return {"plan": details, "seq_scans": sorted(set(seq_scans))}
+
+async def check() -> Dict[str, List[str]]:
+    """Горячие запросы, в планах которых есть последовательное чтение таблиц"""
+    problems = {}
+    async with engine.connect() as conn:
+        for name, build_query in HOT_QUERIES.items():
+            result = await explain(conn, build_query())
+            if result["seq_scans"]:
+                problems[name] = result["seq_scans"]
+    return problems
+
+async def status() -> Dict[str, str]:
+    async with engine.connect() as conn:
+        existing = await existing_indexes(conn)
+        return {
+            index.name: "ok" if existing.get(index.name) else ("invalid" if index.name in existing else "missing")
+            for index in migration_indexes(conn.dialect.name)
+        }
+
+async def main():
+    parser = argparse.ArgumentParser(description="Индексы горячих запросов DataAnalyzer")
+    parser.add_argument("command", nargs="?", default="migrate", choices=("migrate", "check", "status", "latest-metrics", "rollups"))
+    args = parser.parse_args()
+
+    await init_db()
+    if args.command == "migrate":
+        built = await migrate()
+        print(f"✅ Построено индексов: {len(built)}" if built else "✅ Все индексы уже есть")
+    elif args.command == "latest-metrics":
+        print(f"✅ Добавлено строк post_latest_metrics: {await backfill_latest_metrics():,}")
+    elif args.command == "rollups":
+        print(f"✅ Строк post_daily_rollup: {await rebuild_rollups():,}")
+    elif args.command == "status":
+        for name, state in (await status()).items():
+            print(f"{name}: {state}")
+    else:
+        problems = await check()
+        for name, tables in problems.items():
+            print(f"❌ {name}: Seq Scan по {', '.join(tables)}")
+        if problems:
+            sys.exit(1)
+        print(f"✅ Seq Scan нет ни в одном из {len(HOT_QUERIES)} запросов")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,128 @@
+"""
+Кэш результатов классификации постов по хэшу текста
+
+Ключ — sha1 от версии классификатора и текста. Текст берется как есть: метки
+зависят от регистра, пробелов и переносов строк, так что любая нормализация
+могла бы склеить тексты с разными метками. Перед таблицей post_features стоит
+LRU в памяти процесса; страница сообщений ищется в БД одним запросом.
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, delete
+
+from bot.db import SessionLocal, PostFeatures, upsert_insert
+from post_classifier import CLASSIFIER_VERSION, classify_many_async
+
+LRU_SIZE = 50000  # Записей в памяти процесса
+LOOKUP_CHUNK_SIZE = 500  # Ключей в одном SELECT ... IN
+
+def text_key(text: Optional[str], version: str = CLASSIFIER_VERSION) -> str:
+    """Ключ кэша для текста"""
+    return hashlib.sha1(f"{version}\n{text or ''}".encode("utf-8", "surrogatepass")).hexdigest()
+
+class FeatureCache:
+    def __init__(self, max_size: int = LRU_SIZE, version: str = CLASSIFIER_VERSION, persistent: bool = True):
+        self.max_size = max_size
+        self.version = version
+        self.persistent = persistent
+        self.lru: "OrderedDict[str, Dict]" = OrderedDict()
+        self.stats = {"memory_hits": 0, "db_hits": 0, "misses": 0}
+
+    def _remember(self, key: str, features: Dict):
+        self.lru[key] = features
+        self.lru.move_to_end(key)
+        if len(self.lru) > self.max_size:
+            self.lru.popitem(last=False)
+
+    async def get_many(self, keys: List[str]) -> Dict[str, Dict]:
+        """Находит признаки по ключам: сначала в памяти, остальное одним запросом к БД"""
+        found = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            features = self.lru.get(key)
+            if features is not None:
+                self.lru.move_to_end(key)
+                found[key] = features
+            else:
+                missing.append(key)
+        self.stats["memory_hits"] += len(found)
+
+        if missing and self.persistent:
+            try:
+                async with SessionLocal() as session:
+                    for i in range(0, len(missing), LOOKUP_CHUNK_SIZE):
+                        result = await session.execute(
+                            select(PostFeatures.text_hash, PostFeatures.features).where(
+                                PostFeatures.text_hash.in_(missing[i:i + LOOKUP_CHUNK_SIZE]),
+                                PostFeatures.classifier_version == self.version
+                            )
+                        )
+                        for key, raw in result:
+                            features = json.loads(raw)
+                            found[key] = features
+                            self._remember(key, features)
+                            self.stats["db_hits"] += 1
+            except Exception as e:
+                print(f"[feature_cache] Не удалось прочитать кэш признаков: {e}")
+        return found
+
+    async def put_many(self, entries: Dict[str, Dict]):
+        """Запоминает признаки в памяти и в таблице post_features"""
+        for key, features in entries.items():
+            self._remember(key, features)
+        if not entries or not self.persistent:
+            return
+
+        rows = [
+            {
+                "text_hash": key,
+                "classifier_version": self.version,
+                "features": json.dumps(features, ensure_ascii=False)
+            }
+            for key, features in entries.items()
+        ]
+        try:
+            async with SessionLocal() as session:
+                await session.execute(
+                    upsert_insert(PostFeatures).values(rows).on_conflict_do_nothing(
+                        index_elements=[PostFeatures.text_hash]
+                    )
+                )
+                await session.commit()
+        except Exception as e:
+            print(f"[feature_cache] Не удалось записать кэш признаков: {e}")
+
+    async def classify_many(self, texts: List[Optional[str]]) -> List[Dict]:
+        """classify_many с кэшем: считаются только тексты, которых нет в кэше"""
+        keys = [text_key(text, self.version) for text in texts]
+        found = await self.get_many(keys)
+
+        # Одинаковые тексты внутри пачки классифицируем один раз
+        pending = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in pending:
+                pending[key] = text or ""
+        self.stats["misses"] += len(pending)
+
+        if pending:
+            computed = dict(zip(pending, await classify_many_async(list(pending.values()))))
+            await self.put_many(computed)
+            found.update(computed)
+
+        return [found[key] for key in keys]
+
+    async def purge_stale(self) -> int:
+        """Удаляет записи других версий классификатора"""
+        async with SessionLocal() as session:
+            result = await session.execute(
+                delete(PostFeatures).where(PostFeatures.classifier_version != self.version)
+            )
+            await session.commit()
+            return result.rowcount
+
+# Глобальный экземпляр кэша признаков
+feature_cache = FeatureCache()
@@ -214,15 +214,14 @@ Telegram-бота.
             if not self.validate_input(post_text):
                 return "❌ Текст поста слишком короткий или не содержит осмысленного контента."
             
-            # Получаем контекст из БД для сравнения
+            # Для сравнения берем успешные посты, похожие на текст пользователя
             context = ""
-            if category:
-                popular_posts = await data_analyzer.get_popular_posts_by_category(category, limit=3)
-                if popular_posts:
-                    context += f"\nДля сравнения, популярные посты в теме '{category}':\n"
-                    for i, post in enumerate(popular_posts, 1):
-                        text = post.get('text', '')[:50] + "..." if len(post.get('text', '')) > 50 else post.get('text', '')
-                        context += f"{i}. {text}\n"
+            popular_posts = await data_analyzer.get_similar_successful_posts(post_text, category, limit=3)
+            if popular_posts:
+                context += f"\nДля сравнения, успешные посты на похожую тему:\n"
+                for i, post in enumerate(popular_posts, 1):
+                    text = post.get('text', '')[:50] + "..." if len(post.get('text', '')) > 50 else post.get('text', '')
+                    context += f"{i}. {text}\n"
             
             prompt = f"""Ты — эксперт по контенту в Telegram. Проанализируй пост пользователя и дай детальную обратную связь.
 
@@ -265,15 +264,14 @@ Telegram-бота.
             if not self.validate_input(post_text):
                 return "❌ Текст поста слишком короткий или не содержит осмысленного контента."
             
-            # Получаем контекст из БД
+            # Получаем контекст из БД: успешные посты, похожие на текст пользователя
             context = ""
-            if category:
-                popular_posts = await data_analyzer.get_popular_posts_by_category(category, limit=2)
-                if popular_posts:
-                    context += f"\nУчитывая успешные посты в теме '{category}':\n"
-                    for post in popular_posts:
-                        text = post.get('text', '')[:100] + "..." if len(post.get('text', '')) > 100 else post.get('text', '')
-                        context += f"• {text}\n"
+            popular_posts = await data_analyzer.get_similar_successful_posts(post_text, category, limit=2)
+            if popular_posts:
+                context += f"\nУчитывая успешные посты на похожую тему:\n"
+                for post in popular_posts:
+                    text = post.get('text', '')[:100] + "..." if len(post.get('text', '')) > 100 else post.get('text', '')
+                    context += f"• {text}\n"
             
             prompt = f"""Ты — эксперт по контенту в Telegram. Улучши пост пользователя, сделав его более привлекательным и эффективным.
 
@@ -0,0 +1,268 @@
+"""
+Очередь задач парсинга в БД (замена tasks.json)
+
+Задачи берутся в работу с арендой: на Postgres через SELECT ... FOR UPDATE SKIP LOCKED,
+на SQLite — тем же атомарным UPDATE (SQLite и так сериализует запись). Если воркер упал
+и не продлил аренду, по истечении visibility timeout задача возвращается в очередь.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import uuid
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, update, delete, func, text
+from bot.db import SessionLocal, CrawlJob, engine, init_db, upsert_insert
+
+DEFAULT_VISIBILITY_TIMEOUT = 15 * 60  # секунд аренды задачи
+DEFAULT_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 60  # секунд, удваивается с каждой попыткой
+RETRY_MAX_DELAY = 6 * 60 * 60
+
+ACTIVE_STATUSES = "status IN ('queued', 'leased')"
+
+class JobQueue:
+    async def enqueue(self, payload: Dict, priority: int = 0, dedupe_key: Optional[str] = None,
+                      delay: int = 0, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> bool:
+        """Добавляет задачу. Возвращает False, если активная задача с таким ключом уже есть"""
+        now = datetime.datetime.utcnow()
+        stmt = upsert_insert(CrawlJob).values(
+            job_id=str(uuid.uuid4()),
+            dedupe_key=dedupe_key,
+            payload=json.dumps(payload, ensure_ascii=False),
+            priority=priority,
+            status="queued",
+            attempts=0,
+            max_attempts=max_attempts,
+            available_at=now + datetime.timedelta(seconds=delay),
+            created_at=now,
+            updated_at=now
+        ).on_conflict_do_nothing(index_elements=["dedupe_key"], index_where=text(ACTIVE_STATUSES))
+
+        async with SessionLocal() as session:
+            result = await session.execute(stmt)
+            await session.commit()
+            return result.rowcount > 0
+
+    async def lease(self, owner: str, limit: int = 1,
+                    visibility_timeout: int = DEFAULT_VISIBILITY_TIMEOUT) -> List[Dict]:
+        """Берет в работу до limit задач с наибольшим приоритетом"""
+        if limit <= 0:
+            return []
+
+        await self.requeue_expired()
+
+        now = datetime.datetime.utcnow()
+        candidates = (
+            select(CrawlJob.job_id)
+            .where(CrawlJob.status == "queued", CrawlJob.available_at <= now)
+            .order_by(CrawlJob.priority.desc(), CrawlJob.available_at)
+            .limit(limit)
+        )
+        if engine.dialect.name == "postgresql":
+            candidates = candidates.with_for_update(skip_locked=True)
+
+        stmt = (
+            update(CrawlJob)
+            .where(CrawlJob.job_id.in_(candidates))
+            .values(
+                status="leased",
+                lease_owner=owner,
+                leased_until=now + datetime.timedelta(seconds=visibility_timeout),
+                attempts=CrawlJob.attempts + 1,
+                updated_at=now
+            )
+            .returning(CrawlJob.job_id, CrawlJob.payload, CrawlJob.attempts, CrawlJob.priority)
+            .execution_options(synchronize_session=False)
+        )
+
+        async with SessionLocal() as session:
+            result = await session.execute(stmt)
+            rows = result.all()
+            await session.commit()
+
+        return [
+            {
+                "job_id": row.job_id,
+                "payload": json.loads(row.payload),
+                "attempts": row.attempts,
+                "priority": row.priority
+            }
+            for row in rows
+        ]
+
+    async def extend_lease(self, job_id: str, owner: str,
+                           visibility_timeout: int = DEFAULT_VISIBILITY_TIMEOUT) -> bool:
+        """Продлевает аренду задачи (heartbeat долгих задач)"""
+        now = datetime.datetime.utcnow()
+        return await self._update_leased(job_id, owner, {
+            "leased_until": now + datetime.timedelta(seconds=visibility_timeout),
+            "updated_at": now
+        })
+
+    async def ack(self, job_id: str, owner: str) -> bool:
+        """Отмечает задачу выполненной"""
+        return await self._update_leased(job_id, owner, {
+            "status": "done",
+            "leased_until": None,
+            "updated_at": datetime.datetime.utcnow()
+        })
+
+    async def fail(self, job_id: str, owner: str, error: str = "") -> bool:
+        """Возвращает задачу в очередь с экспоненциальной задержкой или помечает проваленной"""
+        async with SessionLocal() as session:
+            job = await session.get(CrawlJob, job_id)
+            if not job or job.status != "leased" or job.lease_owner != owner:
+                return False
+
+            now = datetime.datetime.utcnow()
+            job.last_error = error[:2000] if error else None
+            job.leased_until = None
+            job.updated_at = now
+            if job.attempts >= job.max_attempts:
+                job.status = "failed"
+            else:
+                delay = min(RETRY_BASE_DELAY * 2 ** max(job.attempts - 1, 0), RETRY_MAX_DELAY)
+                job.status = "queued"
+                job.available_at = now + datetime.timedelta(seconds=delay)
+            await session.commit()
+            return True
+
+    async def release(self, job_id: str, owner: str, delay: int = 0) -> bool:
+        """Возвращает задачу в очередь без учета попытки (например, канал уже обрабатывается)"""
+        now = datetime.datetime.utcnow()
+        return await self._update_leased(job_id, owner, {
+            "status": "queued",
+            "attempts": CrawlJob.attempts - 1,
+            "leased_until": None,
+            "available_at": now + datetime.timedelta(seconds=delay),
+            "updated_at": now
+        })
+
+    async def requeue_expired(self) -> int:
+        """Возвращает в очередь задачи с истекшей арендой"""
+        now = datetime.datetime.utcnow()
+        async with SessionLocal() as session:
+            expired = (
+                CrawlJob.status == "leased",
+                CrawlJob.leased_until < now
+            )
+            # Исчерпавшие попытки больше не возвращаем
+            await session.execute(
+                update(CrawlJob)
+                .where(*expired, CrawlJob.attempts >= CrawlJob.max_attempts)
+                .values(status="failed", leased_until=None, last_error="lease expired", updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            result = await session.execute(
+                update(CrawlJob)
+                .where(*expired)
+                .values(status="queued", leased_until=None, available_at=now, updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+            return result.rowcount
+
+    async def purge(self, older_than_days: int = 7) -> int:
+        """Удаляет старые выполненные задачи"""
+        border = datetime.datetime.utcnow() - datetime.timedelta(days=older_than_days)
+        async with SessionLocal() as session:
+            result = await session.execute(
+                delete(CrawlJob)
+                .where(CrawlJob.status == "done", CrawlJob.updated_at < border)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+            return result.rowcount
+
+    async def get_stats(self) -> Dict[str, int]:
+        """Количество задач по статусам"""
+        async with SessionLocal() as session:
+            result = await session.execute(
+                select(CrawlJob.status, func.count()).group_by(CrawlJob.status)
+            )
+            return {status: count for status, count in result}
+
+    async def _update_leased(self, job_id: str, owner: str, values: Dict) -> bool:
+        async with SessionLocal() as session:
+            result = await session.execute(
+                update(CrawlJob)
+                .where(
+                    CrawlJob.job_id == job_id,
+                    CrawlJob.status == "leased",
+                    CrawlJob.lease_owner == owner
+                )
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+            return result.rowcount > 0
+
+def task_dedupe_key(task: Dict) -> str:
+    """Ключ, по которому не допускаем дубликатов задач парсинга"""
+    return f"{task.get('type', 'crawl')}:{task.get('channel')}"
+
+async def enqueue_parse_task(user_id, channel: str, priority: int = 0, task_type: str = "crawl") -> bool:
+    """Ставит задачу парсинга канала в очередь"""
+    task = {"user_id": user_id, "channel": channel}
+    if task_type != "crawl":
+        task["type"] = task_type
+    return await job_queue.enqueue(task, priority=priority, dedupe_key=task_dedupe_key(task))
+
+async def import_tasks_file(path: str = "tasks.json") -> int:
+    """Переносит невыполненные задачи из старого tasks.json в очередь"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            tasks = json.load(f)
+    except FileNotFoundError:
+        return 0
+
+    imported = 0
+    for task in tasks:
+        if task.get("status") == "done":
+            continue
+        task = {key: value for key, value in task.items() if key != "status"}
+        if await job_queue.enqueue(task, dedupe_key=task_dedupe_key(task)):
+            imported += 1
+    return imported
+
+# Глобальный экземпляр очереди
+job_queue = JobQueue()
+
+async def main():
+    parser = argparse.ArgumentParser(description="Очередь задач парсинга")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = commands.add_parser("enqueue", help="добавить канал в очередь")
+    add_parser.add_argument("channel")
+    add_parser.add_argument("--user-id", type=int, default=None)
+    add_parser.add_argument("--priority", type=int, default=0)
+    add_parser.add_argument("--backfill", action="store_true", help="догрузка старой истории")
+
+    import_parser = commands.add_parser("import-tasks", help="перенести задачи из tasks.json")
+    import_parser.add_argument("path", nargs="?", default="tasks.json")
+
+    commands.add_parser("stats", help="количество задач по статусам")
+
+    purge_parser = commands.add_parser("purge", help="удалить старые выполненные задачи")
+    purge_parser.add_argument("--days", type=int, default=7)
+
+    args = parser.parse_args()
+    await init_db()
+
+    if args.command == "enqueue":
+        added = await enqueue_parse_task(args.user_id, args.channel, args.priority,
+                                         "backfill" if args.backfill else "crawl")
+        print("✅ Задача добавлена" if added else "ℹ️ Такая задача уже в очереди")
+    elif args.command == "import-tasks":
+        print(f"✅ Перенесено задач: {await import_tasks_file(args.path)}")
+    elif args.command == "stats":
+        for status, count in (await job_queue.get_stats()).items():
+            print(f"{status}: {count}")
+    elif args.command == "purge":
+        print(f"🗑 Удалено задач: {await job_queue.purge(args.days)}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
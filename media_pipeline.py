@@ -0,0 +1,211 @@
+"""
+Параллельная загрузка медиа с дедупликацией по file_unique_id
+
+Скачивание идет в ограниченном пуле корутин, ресайз и превью через Pillow —
+в пуле процессов, чтобы не блокировать event loop. Одна и та же картинка,
+перепощенная в разные каналы, скачивается один раз.
+"""
+
+import asyncio
+import datetime
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Set
+
+from PIL import Image
+from sqlalchemy import select, insert, tuple_
+
+from bot.db import SessionLocal, Media
+from rate_limiter import rate_limiter
+
+DOWNLOAD_CONCURRENCY = 4  # Одновременных загрузок
+MAX_IMAGE_SIZE = (1280, 1280)  # Больше этого картинки уменьшаем
+THUMB_SIZE = (320, 320)
+RECORD_BATCH_SIZE = 50  # Сколько строк media копим перед записью в БД
+
+def make_thumbnail(path: str, thumb_path: str, max_size=MAX_IMAGE_SIZE, thumb_size=THUMB_SIZE) -> Optional[str]:
+    """Уменьшает изображение до max_size и сохраняет превью (выполняется в пуле процессов)"""
+    try:
+        with Image.open(path) as img:
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            if img.width > max_size[0] or img.height > max_size[1]:
+                img.thumbnail(max_size)
+                img.save(path, "JPEG", quality=85)
+            img.thumbnail(thumb_size)
+            img.save(thumb_path, "JPEG", quality=80)
+        return thumb_path
+    except Exception as e:
+        print(f"[media] Не удалось сделать превью {path}: {e}")
+        return None
+
+def get_message_media(message):
+    """Возвращает (тип, объект медиа) сообщения или (None, None)"""
+    for media_type in ("photo", "video", "document"):
+        media = getattr(message, media_type, None)
+        if media:
+            return media_type, media
+    return None, None
+
+class MediaPipeline:
+    def __init__(self, client, media_dir: str = "images", concurrency: int = DOWNLOAD_CONCURRENCY,
+                 process_workers: Optional[int] = None, record_to_db: bool = True,
+                 media_types=("photo",), account_id: Optional[str] = None):
+        self.client = client
+        # Загрузки идут в лимиты того же аккаунта, что и остальные вызовы клиента
+        self.account_id = account_id or getattr(client, "name", None)
+        self.media_dir = media_dir
+        self.media_types = media_types
+        self.record_to_db = record_to_db
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.executor = ProcessPoolExecutor(max_workers=process_workers)
+        # file_unique_id → идущая загрузка, чтобы одинаковые файлы не качать дважды;
+        # завершенные загрузки и задачи убираются, повторы дальше находит проверка файла на диске
+        self.downloads: Dict[str, asyncio.Task] = {}
+        self.tasks: Set[asyncio.Task] = set()
+        self.pending_rows: List[Dict] = []
+        self.stats = {"downloaded": 0, "deduplicated": 0, "failed": 0}
+        os.makedirs(media_dir, exist_ok=True)
+
+    def path_for(self, file_unique_id: str) -> str:
+        """Путь, по которому лежит (или будет лежать) файл"""
+        return os.path.join(self.media_dir, f"{file_unique_id}.jpg")
+
+    def thumb_path_for(self, file_unique_id: str) -> str:
+        return os.path.join(self.media_dir, f"{file_unique_id}_thumb.jpg")
+
+    def submit(self, message, post_id: Optional[str] = None) -> Optional[asyncio.Task]:
+        """Ставит медиа сообщения в очередь загрузки
+        
+        Возвращает задачу, которая завершится путем к файлу или None, если скачать не удалось.
+        """
+        media_type, media = get_message_media(message)
+        if media_type not in self.media_types:
+            return None
+
+        task = asyncio.create_task(self._process(message, media_type, media, post_id))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def drain(self):
+        """Дожидается всех загрузок и записывает оставшиеся строки в БД"""
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks))
+        await self._flush()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    async def _process(self, message, media_type: str, media, post_id: Optional[str]) -> Optional[str]:
+        unique_id = media.file_unique_id
+        download = self.downloads.get(unique_id)
+        if download is None:
+            download = asyncio.create_task(self._download(message, media_type, unique_id))
+            self.downloads[unique_id] = download
+            download.add_done_callback(lambda _: self.downloads.pop(unique_id, None))
+        else:
+            self.stats["deduplicated"] += 1
+
+        result = await download
+        if not result:
+            return None
+
+        self.pending_rows.append({
+            "media_id": str(uuid.uuid4()),
+            "post_id": post_id,
+            "media_type": media_type,
+            "file_id": media.file_id,
+            "file_unique_id": unique_id,
+            "external_url": result["path"],
+            "thumb_url": result["thumb"],
+            "file_size": getattr(media, "file_size", None),
+            "created_at": datetime.datetime.utcnow()
+        })
+        if len(self.pending_rows) >= RECORD_BATCH_SIZE:
+            await self._flush()
+        return result["path"]
+
+    async def _download(self, message, media_type: str, unique_id: str) -> Optional[Dict]:
+        path = self.path_for(unique_id)
+        thumb_path = self.thumb_path_for(unique_id)
+
+        # Файл уже скачан в прошлых запусках или другим каналом
+        if os.path.exists(path):
+            self.stats["deduplicated"] += 1
+            return {"path": path, "thumb": thumb_path if os.path.exists(thumb_path) else None}
+
+        known = await self._find_known(unique_id)
+        if known:
+            self.stats["deduplicated"] += 1
+            return known
+
+        async with self.semaphore:
+            try:
+                path = await rate_limiter.call(
+                    self.account_id, "download_media", self.client.download_media, message, file_name=path
+                )
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"[media] Ошибка при скачивании медиа сообщения {message.id}: {e}")
+                return None
+        if not path:
+            self.stats["failed"] += 1
+            return None
+
+        self.stats["downloaded"] += 1
+        thumb = None
+        if media_type == "photo":
+            loop = asyncio.get_running_loop()
+            thumb = await loop.run_in_executor(self.executor, make_thumbnail, path, thumb_path)
+        return {"path": path, "thumb": thumb}
+
+    async def _find_known(self, unique_id: str) -> Optional[Dict]:
+        """Ищет уже записанный файл в таблице media"""
+        if not self.record_to_db:
+            return None
+        try:
+            async with SessionLocal() as session:
+                result = await session.execute(
+                    select(Media.external_url, Media.thumb_url)
+                    .where(Media.file_unique_id == unique_id)
+                    .limit(1)
+                )
+                row = result.first()
+        except Exception as e:
+            print(f"[media] Не удалось проверить медиа в БД: {e}")
+            return None
+
+        if row and row.external_url and os.path.exists(row.external_url):
+            return {"path": row.external_url, "thumb": row.thumb_url}
+        return None
+
+    async def _flush(self):
+        if not self.pending_rows:
+            return
+        rows, self.pending_rows = self.pending_rows, []
+        if not self.record_to_db:
+            return
+        try:
+            async with SessionLocal() as session:
+                # При повторном обходе канала файл поста уже записан
+                keys = {(row["post_id"], row["file_unique_id"]) for row in rows}
+                existing = await session.execute(
+                    select(Media.post_id, Media.file_unique_id)
+                    .where(tuple_(Media.post_id, Media.file_unique_id).in_(list(keys)))
+                )
+                known = set(existing.tuples())
+                new_rows = []
+                for row in rows:
+                    key = (row["post_id"], row["file_unique_id"])
+                    if key not in known:
+                        known.add(key)
+                        new_rows.append(row)
+                rows = new_rows
+                if not rows:
+                    return
+                await session.execute(insert(Media).values(rows))
+                await session.commit()
+        except Exception as e:
+            print(f"[media] Не удалось записать медиа в БД: {e}")
@@ -0,0 +1,247 @@
+"""
+Поиск почти одинаковых постов (MinHash + LSH)
+
+Текст разбивается на шинглы по SHINGLE_SIZE слов, MinHash-подпись из NUM_PERM
+значений считается для всей пачки сразу в NumPy. Подпись делится на BANDS
+полос; у каждой полосы есть ключ корзины, и корзины лежат в таблице
+post_lsh_buckets. Кандидаты в дубли — посты хотя бы с одной общей корзиной,
+поэтому поиск не перебирает всю таблицу. Кандидат считается дублем, если
+оценка сходства Жаккара по подписям не меньше DUPLICATE_THRESHOLD.
+
+Дубли собираются в группы: dup_cluster_id — post_id первого поста группы.
+Если рекламный пост повторяется в другом канале, креатив группы записывается
+в creatives для каждого такого канала.
+"""
+
+import hashlib
+import re
+import uuid
+import zlib
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import select, delete
+
+from bot.db import SessionLocal, Post, PostLshBucket, Creative, upsert_insert
+
+SHINGLE_SIZE = 3  # Слов в шингле
+MIN_TOKENS = 8  # Короче подпись не считаем: короткие подписи к картинкам совпадают случайно
+NUM_PERM = 64  # Значений в подписи
+BANDS = 16  # Полос LSH; по 4 значения, порог срабатывания около 0.5
+ROWS = NUM_PERM // BANDS
+DUPLICATE_THRESHOLD = 0.8  # Минимальная оценка сходства для дубля
+LOOKUP_CHUNK_SIZE = 500  # Ключей корзин в одном SELECT ... IN
+SIGNATURE_CHUNK_SIZE = 20000  # Шинглов за один шаг вычисления подписей (память 8 * NUM_PERM байт на шингл)
+
+MERSENNE_PRIME = (1 << 31) - 1
+WORD_RE = re.compile(r"\w+")
+LINK_RE = re.compile(r"(?:https?://|tg://|t\.me/)\S+")
+
+# Фиксированное зерно: подписи должны совпадать между запусками и процессами
+_random = np.random.RandomState(20240101)
+PERM_A = _random.randint(1, MERSENNE_PRIME, size=NUM_PERM).astype(np.int64)
+PERM_B = _random.randint(0, MERSENNE_PRIME, size=NUM_PERM).astype(np.int64)
+
+def shingle_hashes(text: Optional[str]) -> List[int]:
+    """Хэши шинглов текста; пустой список, если текст короче MIN_TOKENS слов"""
+    tokens = WORD_RE.findall((text or "").lower().replace("ё", "е"))
+    if len(tokens) < MIN_TOKENS:
+        return []
+    return [
+        zlib.crc32(" ".join(tokens[i:i + SHINGLE_SIZE]).encode("utf-8"))
+        for i in range(len(tokens) - SHINGLE_SIZE + 1)
+    ]
+
+def signatures(texts: List[Optional[str]]) -> List[Optional[np.ndarray]]:
+    """MinHash-подписи пачки текстов (None для коротких текстов)"""
+    result: List[Optional[np.ndarray]] = [None] * len(texts)
+    shingles = [(index, hashes) for index, hashes in enumerate(map(shingle_hashes, texts)) if hashes]
+
+    # Тексты берем группами, чтобы матрица NUM_PERM x шинглов не разрасталась
+    start = 0
+    while start < len(shingles):
+        end = start
+        total = 0
+        while end < len(shingles) and (end == start or total + len(shingles[end][1]) <= SIGNATURE_CHUNK_SIZE):
+            total += len(shingles[end][1])
+            end += 1
+
+        group = shingles[start:end]
+        values = np.fromiter(
+            (value for _, hashes in group for value in hashes), dtype=np.int64, count=total
+        ) % MERSENNE_PRIME
+        offsets = np.cumsum([0] + [len(hashes) for _, hashes in group[:-1]])
+        permuted = (PERM_A[:, None] * values[None, :] + PERM_B[:, None]) % MERSENNE_PRIME
+        minimums = np.minimum.reduceat(permuted, offsets, axis=1).astype(np.uint32)
+        for column, (index, _) in enumerate(group):
+            result[index] = minimums[:, column].copy()
+        start = end
+    return result
+
+def signature_bytes(signature: np.ndarray) -> bytes:
+    return signature.astype("<u4").tobytes()
+
+def signature_from_bytes(raw: bytes) -> np.ndarray:
+    return np.frombuffer(raw, dtype="<u4")
+
+def bucket_keys(signature: np.ndarray) -> List[str]:
+    """Ключи корзин LSH: номер полосы и хэш ее значений"""
+    raw = signature.astype("<u4")
+    return [
+        f"{band:02d}:" + hashlib.blake2b(raw[band * ROWS:(band + 1) * ROWS].tobytes(), digest_size=8).hexdigest()
+        for band in range(BANDS)
+    ]
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Оценка сходства Жаккара по двум подписям"""
+    return float(np.count_nonzero(a == b)) / len(a)
+
+def creative_id(cluster_id: str, channel_id: str) -> str:
+    """Один креатив на группу дублей и канал"""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"creative/{cluster_id}/{channel_id}"))
+
+class DuplicateIndex:
+    def __init__(self, threshold: float = DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self.stats = {"signed": 0, "duplicates": 0, "creatives": 0}
+
+    async def _candidates(self, session, keys: List[str], exclude: set) -> Dict[str, List[Dict]]:
+        """Посты из БД по ключам корзин: {ключ: [пост, ...]}"""
+        found: Dict[str, List[Dict]] = {}
+        for i in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+            result = await session.execute(
+                select(PostLshBucket.bucket, Post.post_id, Post.channel_id, Post.minhash, Post.dup_cluster_id)
+                .join(Post, Post.post_id == PostLshBucket.post_id)
+                .where(PostLshBucket.bucket.in_(keys[i:i + LOOKUP_CHUNK_SIZE]))
+            )
+            for row in result:
+                if row.post_id in exclude or row.minhash is None:
+                    continue
+                found.setdefault(row.bucket, []).append({
+                    "post_id": row.post_id,
+                    "channel_id": row.channel_id,
+                    "signature": signature_from_bytes(row.minhash),
+                    "cluster_id": row.dup_cluster_id or row.post_id
+                })
+        return found
+
+    async def assign(self, session, rows: List[Dict], texts: List[Optional[str]]) -> Dict[str, List[Dict]]:
+        """Заполняет minhash и dup_cluster_id у строк posts
+
+        Возвращает строки корзин и креативов; их пишет save() после вставки постов.
+        Прежние корзины постов пачки save() удаляет: подпись могла измениться вместе с текстом.
+        """
+        pending = {"post_ids": [row["post_id"] for row in rows], "buckets": [], "creatives": []}
+        signed = []
+        for row, text, signature in zip(rows, texts, signatures(texts)):
+            row["minhash"] = signature_bytes(signature) if signature is not None else None
+            row["dup_cluster_id"] = None
+            if signature is not None:
+                signed.append((row, text, signature, bucket_keys(signature)))
+        if not signed:
+            return pending
+
+        batch_ids = {row["post_id"] for row in rows}
+        all_keys = list(dict.fromkeys(key for _, _, _, keys in signed for key in keys))
+        buckets = await self._candidates(session, all_keys, exclude=batch_ids)
+
+        creatives = {}
+        for row, text, signature, keys in signed:
+            best, best_score = None, self.threshold
+            seen = set()
+            for key in keys:
+                for candidate in buckets.get(key, ()):
+                    if candidate["post_id"] in seen or candidate["post_id"] == row["post_id"]:
+                        continue
+                    seen.add(candidate["post_id"])
+                    score = similarity(signature, candidate["signature"])
+                    if score >= best_score:
+                        best, best_score = candidate, score
+
+            row["dup_cluster_id"] = best["cluster_id"] if best else row["post_id"]
+            if best:
+                self.stats["duplicates"] += 1
+                # Рекламный текст в другом канале — креатив группы для обоих каналов
+                if row.get("is_ad") and best["channel_id"] != row["channel_id"]:
+                    for channel_id in (best["channel_id"], row["channel_id"]):
+                        creative = self.build_creative(row, text, channel_id)
+                        creatives[creative["creative_id"]] = creative
+
+            # Следующие посты пачки тоже могут оказаться дублями этого
+            candidate = {
+                "post_id": row["post_id"],
+                "channel_id": row["channel_id"],
+                "signature": signature,
+                "cluster_id": row["dup_cluster_id"]
+            }
+            for key in keys:
+                buckets.setdefault(key, []).append(candidate)
+                pending["buckets"].append({"bucket": key, "post_id": row["post_id"]})
+
+        self.stats["signed"] += len(signed)
+        pending["creatives"] = list(creatives.values())
+        return pending
+
+    def build_creative(self, row: Dict, text: Optional[str], channel_id: str) -> Dict:
+        link = LINK_RE.search(text or "")
+        return {
+            "creative_id": creative_id(row["dup_cluster_id"], channel_id),
+            "channel_id": channel_id,
+            "cluster_id": row["dup_cluster_id"],
+            "ad_topic": row.get("topic"),
+            "channel_topic": None,
+            "tags": row.get("tags"),
+            "ad_title": row.get("title"),
+            "ad_text": row.get("body"),
+            "link": link.group(0) if link else None,
+            "cta": row.get("cta"),
+            "media_id": None,
+            "created_at": row.get("created_at")
+        }
+
+    async def save(self, session, pending: Dict[str, List[Dict]]):
+        """Пишет корзины LSH и креативы (в той же транзакции, что и посты)"""
+        post_ids = pending["post_ids"]
+        for i in range(0, len(post_ids), LOOKUP_CHUNK_SIZE):
+            await session.execute(
+                delete(PostLshBucket).where(PostLshBucket.post_id.in_(post_ids[i:i + LOOKUP_CHUNK_SIZE]))
+            )
+        if pending["buckets"]:
+            await session.execute(
+                upsert_insert(PostLshBucket).values(pending["buckets"]).on_conflict_do_nothing(
+                    index_elements=[PostLshBucket.bucket, PostLshBucket.post_id]
+                )
+            )
+        if pending["creatives"]:
+            await session.execute(
+                upsert_insert(Creative).values(pending["creatives"]).on_conflict_do_nothing(
+                    index_elements=[Creative.creative_id]
+                )
+            )
+            self.stats["creatives"] += len(pending["creatives"])
+
+    async def find_duplicates(self, post_id: str, threshold: float = None) -> List[Dict]:
+        """Почти одинаковые посты для поста из БД, по убыванию сходства"""
+        threshold = self.threshold if threshold is None else threshold
+        async with SessionLocal() as session:
+            raw = await session.scalar(select(Post.minhash).where(Post.post_id == post_id))
+            if raw is None:
+                return []
+            signature = signature_from_bytes(raw)
+            buckets = await self._candidates(session, bucket_keys(signature), exclude={post_id})
+
+        matches = {}
+        for candidates in buckets.values():
+            for candidate in candidates:
+                score = similarity(signature, candidate["signature"])
+                if score >= threshold:
+                    matches[candidate["post_id"]] = {
+                        "post_id": candidate["post_id"],
+                        "channel_id": candidate["channel_id"],
+                        "cluster_id": candidate["cluster_id"],
+                        "similarity": score
+                    }
+        return sorted(matches.values(), key=lambda match: match["similarity"], reverse=True)
+
+# Глобальный индекс дублей
+duplicate_index = DuplicateIndex()
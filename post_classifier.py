@@ -0,0 +1,432 @@
+"""
+Классификация постов: формат, CTA, признаки рекламы и тема одной записью
+
+Все наборы паттернов компилируются один раз при импорте. Паттерны-строки
+проверяются поиском подстроки, а регулярки запускаются, только если в тексте
+есть их обязательный литеральный префикс (например "@" для r'@\w+').
+Одна большая альтернация в модуле re медленнее: он перебирает все ветки
+на каждой позиции. Метки совпадают с прежними функциями из userbot_stats.
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import text_stats
+from ad_model import STATS_FIELDS, AdModel
+from config import AD_MODEL_PATH, CLASSIFIER_WORKERS
+from topic_tagger import TOPIC_KEYWORDS, TOPIC_MIN_SCORE, topic_tagger
+
+# --- Форматы постов ---
+POST_FORMATS = {
+    "list": {
+        "name": "Список",
+        "patterns": [r'\d+\.', r'[-•]', r'во-первых', r'далее'],
+        "conditions": ["3+ строк с похожим шаблоном"]
+    },
+    "story": {
+        "name": "История",
+        "patterns": [r'однажды', r'я помню', r'вчера', r'когда-то'],
+        "conditions": ["нарратив", "личный рассказ", "временные указания"]
+    },
+    "analytics": {
+        "name": "Аналитика",
+        "patterns": [r'по данным', r'рост', r'%', r'исследование'],
+        "conditions": ["факты", "цифры", "источники", "графики"]
+    },
+    "opinion": {
+        "name": "Мнение/позиция",
+        "patterns": [r'мне кажется', r'по моему мнению', r'я думаю'],
+        "conditions": ["субъективные утверждения", "оценка событий"]
+    },
+    "howto": {
+        "name": "Инструкция",
+        "patterns": [r'сделай', r'настрой', r'скачай', r'шаг \d+'],
+        "conditions": ["последовательные действия", "повелительное наклонение"]
+    },
+    "news": {
+        "name": "Новость",
+        "patterns": [r'произошло', r'в \d{4}', r'сегодня', r'по сообщениям'],
+        "conditions": ["дата/время", "событие", "краткость"]
+    },
+    "motivation": {
+        "name": "Вдохновение",
+        "patterns": [r'ты можешь', r'поверь в себя', r'не сдавайся'],
+        "conditions": ["пафос", "мотивационные слова", "призыв к действию"]
+    },
+    "fun": {
+        "name": "Развлечение/юмор",
+        "patterns": [r'лол', r'ахаха', r'мем', r'прикол'],
+        "conditions": ["шутки", "неформальный стиль", "эмодзи"]
+    },
+    "quote": {
+        "name": "Цитата",
+        "patterns": [r'—', r'сказал', r'цитата'],
+        "conditions": ["кавычки", "имя автора", "меньше 3 строк"]
+    }
+}
+
+# --- CTA паттерны ---
+CTA_PATTERNS = [
+    r'подпишись', r'следи за', r'присоединяйся', r'жми подписаться',
+    r'пиши в комменты', r'оцени', r'смотри дальше', r'сохрани',
+    r'жми на ссылку', r'а ты как думаешь\?', r'пиши \+ если полезно',
+    r'что скажешь\?', r'читай', r'узнай', r'начни', r'перейди',
+    r'жми', r'вступай', r'переходи сюда', r'канал', r'бот'
+]
+
+# --- Детекция рекламных постов ---
+AD_DETECTION = {
+    "external_links": [r'https://', r't\.me/', r'@\w+', r'tg://', r'bit\.ly'],
+    "brand_mentions": [r'@\w+', r't\.me/\w+', r'переходи сюда', r'канал', r'бот'],
+    "cta_phrases": [r'подпишись', r'читай', r'узнай', r'начни', r'перейди', r'жми', r'вступай'],
+    "brand_words": [],  # Будет заполнено известными брендами
+    "emoji_threshold": 0.1,  # 10% эмодзи
+    "caps_threshold": 0.3    # 30% заглавных букв
+}
+
+# Вес совпадения каждого паттерна в скоре рекламы
+AD_WEIGHTS = {"external_links": 2, "brand_mentions": 2, "cta_phrases": 1}
+AD_SCORE_THRESHOLD = 3  # Если 3+ признака - это реклама
+STRUCTURE_WEIGHT = 2  # 1 абзац + призыв
+
+# Модель рекламы (ad_model.py): если файла весов нет, is_ad считается по правилам выше
+ad_model = AdModel.load_if_exists(AD_MODEL_PATH)
+
+# Версия классификатора: ревизия кода плюс отпечаток наборов паттернов и файла модели.
+# Меняется при любой правке паттернов или замене модели, и кэш post_features перестает отдавать старые записи
+CLASSIFIER_REVISION = 4  # Увеличить при изменении логики классификации
+CLASSIFIER_VERSION = f"{CLASSIFIER_REVISION}-" + hashlib.sha1(json.dumps(
+    [POST_FORMATS, CTA_PATTERNS, AD_DETECTION, AD_WEIGHTS, AD_SCORE_THRESHOLD, STRUCTURE_WEIGHT,
+     TOPIC_KEYWORDS, TOPIC_MIN_SCORE, ad_model.digest if ad_model else None],
+    ensure_ascii=False, sort_keys=True
+).encode("utf-8")).hexdigest()[:8]
+
+PROCESS_POOL_MIN_BATCH = 2000  # Пачки меньше классифицируем в текущем процессе: пересылка дороже
+PROCESS_CHUNK_SIZE = 500  # Постов в одной задаче пула процессов
+
+# Символы, которые re.IGNORECASE считает равными букве, хотя str.lower() их не меняет
+# (таблица эквивалентностей модуля re); после lower() приводим их к основной букве
+CASE_FOLD_FIXES = str.maketrans({
+    "ı": "i", "ſ": "s", "µ": "μ", "\u0345": "ι", "\u1fbe": "ι", "\u1fd3": "\u0390", "\u1fe3": "\u03b0",
+    "ϐ": "β", "ϵ": "ε", "ϑ": "θ", "ϰ": "κ", "ϖ": "π", "ϱ": "ρ", "ς": "σ", "ϕ": "φ",
+    "ᲀ": "в", "ᲁ": "д", "ᲂ": "о", "ᲃ": "с", "ᲄ": "т", "ᲅ": "т", "ᲆ": "ъ", "ᲇ": "ѣ",
+    "ẛ": "ṡ", "ﬅ": "ﬆ"
+})
+
+REGEX_META = set(".^$*+?{}[]|()")
+QUANTIFIERS = set("*+?{")
+
+def _literal_prefix(pattern: str) -> tuple:
+    """Литеральное начало паттерна и признак того, что паттерн целиком литерал"""
+    if "|" in pattern:
+        return "", False
+    chars = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            if i + 1 >= len(pattern) or pattern[i + 1].isalnum():
+                return "".join(chars), False  # \w, \d и т.п.
+            char = pattern[i + 1]
+            step = 2
+        elif char in REGEX_META:
+            return "".join(chars), False
+        else:
+            step = 1
+        if i + step < len(pattern) and pattern[i + step] in QUANTIFIERS:
+            return "".join(chars), False
+        chars.append(char)
+        i += step
+    return "".join(chars), True
+
+def _matcher(pattern: str):
+    """Проверка "есть ли паттерн в тексте" с тем же результатом, что и re.search"""
+    prefix, is_literal = _literal_prefix(pattern)
+    if is_literal:
+        return lambda text: prefix in text
+    regex = re.compile(pattern)
+    if prefix:
+        return lambda text: prefix in text and regex.search(text) is not None
+    return lambda text: regex.search(text) is not None
+
+def _fold(text: str) -> str:
+    """Нижний регистр с теми же совпадениями, что дает re.IGNORECASE"""
+    return text.replace("İ", "i").lower().translate(CASE_FOLD_FIXES)
+
+def _any(patterns: List[str], flags: int = 0):
+    """Одна регулярка, которая находит совпадение, если его находит хоть один паттерн"""
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns), flags)
+
+_NOT_GIVEN = object()  # extract_features: CTA не передан, ищем сами
+
+class PostClassifier:
+    def __init__(self, formats: Dict = POST_FORMATS, cta_patterns: List[str] = CTA_PATTERNS,
+                 ad_detection: Dict = AD_DETECTION, model: Optional[AdModel] = ad_model):
+        self.ad_detection = ad_detection
+        self.model = model
+        # CTA-паттерны записаны в нижнем регистре: ищем без IGNORECASE по _fold(строки), так в разы быстрее
+        self.cta_re = _any(cta_patterns)
+        self.emoji_re = re.compile(r'[^\w\s]')
+        self.caps_re = re.compile(r'[А-Я]')
+        self.title_punct_re = re.compile(r'[.!?]{2,}')
+
+        # Формат: условия — обычные подстроки, паттерны формата смотрим,
+        # только если в тексте нашлось хоть одно условие
+        self.formats = [
+            (key, _any(data["patterns"]), tuple(data["conditions"]))
+            for key, data in formats.items()
+        ]
+        self.all_conditions = tuple(c for data in formats.values() for c in data["conditions"])
+
+        # Реклама: каждый уникальный паттерн проверяем один раз, даже если он в нескольких категориях
+        categories: Dict[str, List[str]] = {}
+        for category in AD_WEIGHTS:
+            for pattern in ad_detection[category]:
+                categories.setdefault(pattern, []).append(category)
+        self.ad_matchers = [(_matcher(pattern), labels) for pattern, labels in categories.items()]
+
+    def detect_post_format(self, text: str, text_lower: Optional[str] = None) -> str:
+        """Автоматически определяет формат поста"""
+        if not text:
+            return "other"
+
+        text_lower = text.lower() if text_lower is None else text_lower
+        if not any(condition in text_lower for condition in self.all_conditions):
+            return "other"
+
+        for format_key, patterns_re, conditions in self.formats:
+            if any(condition in text_lower for condition in conditions) and patterns_re.search(text_lower):
+                return format_key
+        return "other"
+
+    def extract_cta(self, text: str) -> Optional[str]:
+        """Извлекает CTA из текста поста (последние 1-3 строки)"""
+        if not text:
+            return None
+
+        lines = text.split('\n')
+        for i in range(min(3, len(lines))):
+            line = lines[-(i+1)].strip()
+            if self.cta_re.search(_fold(line)):
+                return line
+        return None
+
+    def ad_components(self, text: str, emoji_ratio: float = None, caps_ratio: float = None) -> Dict:
+        """Составляющие скора рекламы
+
+        emoji_ratio и caps_ratio можно передать готовыми из text_stats (пакетный режим).
+        """
+        components = {category: 0 for category in AD_WEIGHTS}
+        for matches, labels in self.ad_matchers:
+            if matches(text):
+                for category in labels:
+                    components[category] += AD_WEIGHTS[category]
+
+        length = len(text)
+        if emoji_ratio is None:
+            emoji_ratio = len(self.emoji_re.findall(text)) / length
+        if caps_ratio is None:
+            caps_ratio = len(self.caps_re.findall(text)) / length
+        components["emoji"] = 1 if emoji_ratio > self.ad_detection["emoji_threshold"] else 0
+        components["caps"] = 1 if caps_ratio > self.ad_detection["caps_threshold"] else 0
+
+        paragraphs = text.split('\n\n')
+        components["structure"] = STRUCTURE_WEIGHT if len(paragraphs) == 2 and self.extract_cta(paragraphs[-1]) else 0
+        return {"components": components, "emoji_ratio": emoji_ratio, "caps_ratio": caps_ratio}
+
+    def detect_ad_post(self, text: str, title: str = None) -> bool:
+        """Определяет, является ли пост рекламным"""
+        if not text:
+            return False
+        if self.model is not None:
+            return bool(self.model.predict_proba([text], [self.extract_cta(text)])[0] >= self.model.threshold)
+        return sum(self.ad_components(text)["components"].values()) >= AD_SCORE_THRESHOLD
+
+    def extract_features(self, text: str, emoji_ratio: float = None, caps_ratio: float = None,
+                         ad_probability: float = None, cta=_NOT_GIVEN) -> Dict:
+        """Все признаки поста одной записью
+
+        ad_probability и cta — готовые результаты пакетного режима; с моделью
+        правила рекламы не считаются и ad_score/ad_components пустые.
+        """
+        if not text:
+            return {
+                "format": "other", "cta": None, "is_ad": False, "ad_score": 0,
+                "ad_components": {}, "ad_probability": None, "emoji_ratio": 0.0, "caps_ratio": 0.0,
+                "topic": None, "tags": []
+            }
+
+        if cta is _NOT_GIVEN:
+            cta = self.extract_cta(text)
+        if self.model is not None:
+            if ad_probability is None:
+                ad_probability = float(self.model.predict_proba([text], [cta])[0])
+            is_ad = ad_probability >= self.model.threshold
+            score, components = None, {}
+            if emoji_ratio is None:
+                emoji_ratio = len(self.emoji_re.findall(text)) / len(text)
+            if caps_ratio is None:
+                caps_ratio = len(self.caps_re.findall(text)) / len(text)
+        else:
+            ad = self.ad_components(text, emoji_ratio, caps_ratio)
+            score, components = sum(ad["components"].values()), ad["components"]
+            is_ad = score >= AD_SCORE_THRESHOLD
+            emoji_ratio, caps_ratio = ad["emoji_ratio"], ad["caps_ratio"]
+
+        topic = topic_tagger.tag(text)
+        return {
+            "format": self.detect_post_format(text),
+            "cta": cta,
+            "is_ad": bool(is_ad),
+            "ad_score": score,
+            "ad_components": components,
+            "ad_probability": ad_probability,
+            "emoji_ratio": emoji_ratio,
+            "caps_ratio": caps_ratio,
+            "topic": topic["topic"],
+            "tags": topic["tags"]
+        }
+
+    def extract_title_and_body(self, text: str) -> tuple:
+        """Разделяет текст на заголовок и основной контент"""
+        if not text:
+            return None, text
+
+        lines = text.split('\n')
+        first_line = lines[0].strip()
+
+        # Проверяем, является ли первая строка заголовком
+        if (len(first_line) < 100 and
+            not self.title_punct_re.search(first_line) and
+            (first_line.startswith('🔴') or first_line.startswith('🔵') or
+             first_line.startswith('⚡') or first_line[0].isupper() or
+             '!' in first_line)):
+
+            title = first_line
+            body = '\n'.join(lines[1:]).strip()
+            return title, body
+
+        return None, text
+
+def join_title_and_body(title: Optional[str], body: Optional[str]) -> str:
+    """Собирает текст поста обратно из title и body (обратное extract_title_and_body)
+
+    Пробелы по краям первой строки и тела, срезанные при разделении, не восстанавливаются.
+    """
+    if title:
+        return f"{title}\n{body}" if body else title
+    return body or ""
+
+def stored_post_text(text: Optional[str]) -> Optional[str]:
+    """Текст поста в том виде, в каком его можно собрать из posts.title и posts.body
+
+    Классификация при сохранении идет по нему же, поэтому reclassify видит тот же текст.
+    """
+    if not text:
+        return text
+    return join_title_and_body(*post_classifier.extract_title_and_body(text))
+
+# Глобальный экземпляр классификатора
+post_classifier = PostClassifier()
+
+def detect_post_format(text: str) -> str:
+    return post_classifier.detect_post_format(text)
+
+def extract_cta(text: str) -> Optional[str]:
+    return post_classifier.extract_cta(text)
+
+def detect_ad_post(text: str, title: str = None) -> bool:
+    return post_classifier.detect_ad_post(text, title)
+
+def extract_title_and_body(text: str) -> tuple:
+    return post_classifier.extract_title_and_body(text)
+
+def extract_features(text: str) -> Dict:
+    return post_classifier.extract_features(text)
+
+# --- Пакетная классификация ---
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=CLASSIFIER_WORKERS)
+    return _process_pool
+
+def shutdown_process_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True)
+        _process_pool = None
+
+def _classify_chunk(texts: List[str]) -> List[Dict]:
+    # Доли эмодзи и заглавных (и признаки модели рекламы) считаем сразу для всей пачки
+    model = post_classifier.model
+    encoded = text_stats.encode(texts)
+    stats = text_stats.text_arrays(texts, STATS_FIELDS if model is not None else ("emoji", "caps"), encoded)
+    ratios = text_stats.style_ratios(stats)
+    if model is None:
+        return [
+            post_classifier.extract_features(text, emoji_ratio, caps_ratio)
+            for text, emoji_ratio, caps_ratio in zip(texts, ratios["emoji_ratio"].tolist(), ratios["caps_ratio"].tolist())
+        ]
+
+    ctas = [post_classifier.extract_cta(text) for text in texts]
+    probabilities = model.predict_proba(texts, ctas, stats, encoded).tolist()
+    return [
+        post_classifier.extract_features(text, emoji_ratio, caps_ratio, probability, cta)
+        for text, emoji_ratio, caps_ratio, probability, cta in zip(
+            texts, ratios["emoji_ratio"].tolist(), ratios["caps_ratio"].tolist(), probabilities, ctas
+        )
+    ]
+
+def _chunks(texts: List[str], size: int = PROCESS_CHUNK_SIZE) -> List[List[str]]:
+    return [texts[i:i + size] for i in range(0, len(texts), size)]
+
+def classify_many(texts: List[Optional[str]], min_batch: int = PROCESS_POOL_MIN_BATCH) -> List[Dict]:
+    """Признаки для списка текстов в том же порядке; большие пачки — в пуле процессов"""
+    texts = [text or "" for text in texts]
+    if len(texts) < min_batch:
+        return _classify_chunk(texts)
+
+    features = []
+    for part in get_process_pool().map(_classify_chunk, _chunks(texts)):
+        features.extend(part)
+    return features
+
+async def classify_many_async(texts: List[Optional[str]], min_batch: int = PROCESS_POOL_MIN_BATCH) -> List[Dict]:
+    """classify_many для асинхронного кода: большие пачки не блокируют event loop"""
+    texts = [text or "" for text in texts]
+    if len(texts) < min_batch:
+        return _classify_chunk(texts)
+
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    parts = await asyncio.gather(*(
+        loop.run_in_executor(pool, _classify_chunk, chunk) for chunk in _chunks(texts)
+    ))
+    return [features for part in parts for features in part]
+
+if __name__ == "__main__":
+    # Быстрый замер: python post_classifier.py results/<канал>_posts.json
+    path = sys.argv[1] if len(sys.argv) > 1 else "russiaarts_posts.json"
+    with open(path, "r", encoding="utf-8") as f:
+        texts = [post.get("text") or "" for post in json.load(f)]
+    rounds = max(1, 20000 // max(len(texts), 1))
+    batch = texts * rounds
+    started = time.perf_counter()
+    classify_many(batch, min_batch=len(batch) + 1)
+    elapsed = time.perf_counter() - started
+    print(f"В одном процессе: {len(batch) / elapsed:,.0f} постов/сек ({len(texts)} постов x {rounds})")
+
+    started = time.perf_counter()
+    classify_many(batch, min_batch=0)
+    elapsed = time.perf_counter() - started
+    print(f"Пул процессов: {len(batch) / elapsed:,.0f} постов/сек")
+    shutdown_process_pool()
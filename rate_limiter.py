@@ -0,0 +1,201 @@
+"""
+Лимиты запросов Telegram-аккаунтов (token bucket)
+
+Для каждого аккаунта заводятся ведра на час и на сутки из
+AntiSpamGuide.account_limits и ведро на каждый тип действия с паузой из
+get_action_delays(). Вызов Pyrogram ждет, пока во всех нужных ведрах есть токен.
+FloodWait блокирует аккаунт на указанное Telegram время.
+"""
+
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+from pyrogram.errors import FloodWait
+
+from anti_spam_guide import anti_spam_guide
+
+MAX_FLOOD_SLEEP = 5 * 60  # FloodWait длиннее этого не пересиживаем, а отдаем вызывающему
+MAX_FLOOD_RETRIES = 3
+FLOOD_WAIT_MARGIN = 1  # секунд сверх FloodWait, чтобы не поймать его снова
+POST_ACTIONS = ("send_message",)  # Действия, которые считаются публикацией постов
+
+class TokenBucket:
+    def __init__(self, capacity: float, period: float):
+        """capacity токенов восстанавливаются равномерно за period секунд"""
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until_available(self, amount: float = 1, now: Optional[float] = None) -> float:
+        """Сколько секунд ждать, пока в ведре наберется amount токенов"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float = 1, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens -= amount
+
+class AccountRateLimiter:
+    def __init__(self, account_id: str, limits: Optional[Dict] = None, delays: Optional[Dict] = None):
+        self.account_id = account_id
+        limits = limits or anti_spam_guide.account_limits
+        self.delays = delays if delays is not None else anti_spam_guide.get_action_delays()
+        self.request_buckets = [
+            TokenBucket(limits["max_requests_per_hour"], 60 * 60),
+            TokenBucket(limits["max_requests_per_day"], 24 * 60 * 60)
+        ]
+        self.post_buckets = [
+            TokenBucket(limits["max_posts_per_hour"], 60 * 60),
+            TokenBucket(limits["max_posts_per_day"], 24 * 60 * 60)
+        ]
+        # Пауза между однотипными действиями: ведро на один токен
+        self.action_buckets: Dict[str, TokenBucket] = {
+            action: TokenBucket(1, delay) for action, delay in self.delays.items() if delay > 0
+        }
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+        self.stats = {"requests": 0, "waited": 0.0, "flood_waits": 0}
+
+    def _buckets(self, action: str) -> List[TokenBucket]:
+        buckets = list(self.request_buckets)
+        if action in POST_ACTIONS:
+            buckets.extend(self.post_buckets)
+        if action in self.action_buckets:
+            buckets.append(self.action_buckets[action])
+        return buckets
+
+    def time_until_free(self, action: str) -> float:
+        """Сколько секунд до того, как аккаунт сможет выполнить действие"""
+        now = time.monotonic()
+        wait = max(self.blocked_until - now, 0.0)
+        for bucket in self._buckets(action):
+            wait = max(wait, bucket.time_until_available(now=now))
+        return wait
+
+    async def acquire(self, action: str):
+        """Ждет свободного бюджета и списывает токены под действие"""
+        async with self.lock:
+            while True:
+                wait = self.time_until_free(action)
+                if wait <= 0:
+                    break
+                self.stats["waited"] += wait
+                await asyncio.sleep(wait)
+
+            now = time.monotonic()
+            for bucket in self._buckets(action):
+                bucket.consume(now=now)
+            self.stats["requests"] += 1
+
+    def report_flood_wait(self, seconds: float):
+        """Блокирует аккаунт на время FloodWait"""
+        self.stats["flood_waits"] += 1
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds + FLOOD_WAIT_MARGIN)
+
+    def get_stats(self) -> Dict:
+        """Счетчики и оценка запросов за последний час/сутки для check_account_health"""
+        now = time.monotonic()
+        hour, day = self.request_buckets
+        hour._refill(now)
+        day._refill(now)
+        return {
+            **self.stats,
+            "requests_last_hour": int(hour.capacity - hour.tokens),
+            "requests_last_day": int(day.capacity - day.tokens),
+            "blocked_for": max(self.blocked_until - now, 0.0)
+        }
+
+class RateLimiter:
+    def __init__(self, limits: Optional[Dict] = None, delays: Optional[Dict] = None):
+        self.limits = limits
+        self.delays = delays
+        self.accounts: Dict[str, AccountRateLimiter] = {}
+
+    def for_account(self, account_id: str) -> AccountRateLimiter:
+        limiter = self.accounts.get(account_id)
+        if limiter is None:
+            limiter = AccountRateLimiter(account_id, self.limits, self.delays)
+            self.accounts[account_id] = limiter
+        return limiter
+
+    def time_until_free(self, account_id: str, action: str) -> float:
+        """Сколько секунд аккаунту ждать до свободного бюджета под действие"""
+        return self.for_account(account_id).time_until_free(action)
+
+    def next_free_account(self, account_ids: List[str], action: str) -> Tuple[Optional[str], float]:
+        """Аккаунт, который раньше всех освободится под действие, и время ожидания"""
+        best, best_wait = None, float("inf")
+        for account_id in account_ids:
+            wait = self.time_until_free(account_id, action)
+            if wait < best_wait:
+                best, best_wait = account_id, wait
+        return best, best_wait
+
+    def report_flood_wait(self, account_id: str, seconds: float):
+        self.for_account(account_id).report_flood_wait(seconds)
+        print(f"[rate_limiter] FloodWait {seconds} с для аккаунта {account_id}")
+
+    async def call(self, account_id: str, action: str, func, *args, **kwargs):
+        """Выполняет вызов Pyrogram с учетом лимитов аккаунта
+
+        Короткий FloodWait пересиживается и вызов повторяется, длинный
+        пробрасывается вызывающему, чтобы тот мог взять другой аккаунт.
+        """
+        limiter = self.for_account(account_id)
+        for attempt in range(MAX_FLOOD_RETRIES + 1):
+            await limiter.acquire(action)
+            try:
+                return await func(*args, **kwargs)
+            except FloodWait as e:
+                self.report_flood_wait(account_id, e.value)
+                if e.value > MAX_FLOOD_SLEEP or attempt == MAX_FLOOD_RETRIES:
+                    raise
+
+    async def iter_history(self, account_id: str, client, chat_id, limit: int = 0,
+                           offset_id: int = 0, page_size: int = 100, action: str = "get_chat_history"):
+        """get_chat_history под лимитами: каждая страница истории — отдельный запрос
+
+        После короткого FloodWait история продолжается с последнего отданного сообщения.
+        """
+        limiter = self.for_account(account_id)
+        yielded = 0
+        flood_retries = 0
+        while True:
+            await limiter.acquire(action)
+            remaining = limit - yielded if limit else 0
+            try:
+                page_limit = min(page_size, remaining) if remaining else page_size
+                page = [
+                    message async for message in
+                    client.get_chat_history(chat_id, limit=page_limit, offset_id=offset_id)
+                ]
+            except FloodWait as e:
+                self.report_flood_wait(account_id, e.value)
+                flood_retries += 1
+                if e.value > MAX_FLOOD_SLEEP or flood_retries > MAX_FLOOD_RETRIES:
+                    raise
+                continue
+
+            flood_retries = 0
+            for message in page:
+                yield message
+            yielded += len(page)
+            if len(page) < page_limit or (limit and yielded >= limit):
+                return
+            offset_id = page[-1].id
+
+    def get_stats(self) -> Dict[str, Dict]:
+        return {account_id: limiter.get_stats() for account_id, limiter in self.accounts.items()}
+
+# Глобальный экземпляр лимитера
+rate_limiter = RateLimiter()
@@ -0,0 +1,176 @@
+"""
+Переклассификация уже сохраненных постов после изменения паттернов
+
+Посты читаются курсором на стороне сервера (на SQLite — запросами по ключу)
+в порядке post_id кусками по chunk_size строк. Куски классифицируются в пуле
+процессов, при этом в работе одновременно не больше workers кусков. В posts
+обновляются format, cta, is_ad, topic и tags только у строк, где метки
+поменялись; у остальных проставляется classifier_version. Дневные агрегаты
+post_daily_rollup сдвигаются на разницу в той же транзакции. Позиция сохраняется
+в JSON-файл после каждого куска, поэтому прерванный проход продолжается с места
+остановки.
+
+    python reclassify.py [--chunk-size 5000] [--workers 4] [--restart]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from sqlalchemy import select, update, or_
+
+from bot.db import engine, SessionLocal, Post, init_db
+from daily_rollups import rollup_states, update_rollups
+from post_classifier import CLASSIFIER_VERSION, classify_many_async, join_title_and_body, shutdown_process_pool
+from topic_tagger import tags_column
+
+CHECKPOINT_FILE = "reclassify_checkpoint.json"
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_WORKERS = 4  # Кусков в работе одновременно
+LABELS = ("format", "cta", "is_ad", "topic", "tags")
+
+def load_checkpoint(path: str) -> Optional[Dict]:
+    """Позиция прошлого прохода, если он был для текущей версии классификатора"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if checkpoint.get("version") != CLASSIFIER_VERSION:
+        return None
+    return checkpoint
+
+def save_checkpoint(path: str, checkpoint: Dict):
+    # Пишем во временный файл и переименовываем, чтобы не оставить половину JSON при падении
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+async def stream_posts(after_id: Optional[str], chunk_size: int):
+    """Куски постов со старой версией классификатора, по возрастанию post_id"""
+    query = (
+        select(Post.post_id, Post.title, Post.body, Post.format, Post.cta, Post.is_ad,
+               Post.topic, Post.tags)
+        .where(or_(Post.classifier_version.is_(None), Post.classifier_version != CLASSIFIER_VERSION))
+        .order_by(Post.post_id)
+    )
+    if engine.dialect.name == "sqlite":
+        # Открытый курсор SQLite держит блокировку чтения и не дает писать обновления,
+        # поэтому здесь читаем по ключу: каждый кусок — отдельный короткий запрос
+        while True:
+            page = query if after_id is None else query.where(Post.post_id > after_id)
+            async with engine.connect() as conn:
+                rows = (await conn.execute(page.limit(chunk_size))).all()
+            if not rows:
+                return
+            yield rows
+            after_id = rows[-1].post_id
+
+    if after_id is not None:
+        query = query.where(Post.post_id > after_id)
+
+    async with engine.connect() as conn:
+        result = await conn.stream(query.execution_options(yield_per=chunk_size))
+        async for rows in result.partitions(chunk_size):
+            yield rows
+
+async def reclassify_chunk(rows) -> Dict:
+    """Классифицирует кусок и пишет только изменившиеся метки"""
+    features = await classify_many_async(
+        [join_title_and_body(row.title, row.body) for row in rows], min_batch=0
+    )
+
+    changed = []
+    unchanged = []
+    for row, post_features in zip(rows, features):
+        labels = {
+            "format": post_features["format"],
+            "cta": post_features["cta"],
+            "is_ad": post_features["is_ad"],
+            "topic": post_features["topic"],
+            "tags": tags_column(post_features["tags"])
+        }
+        if any(getattr(row, label) != labels[label] for label in LABELS):
+            changed.append({"post_id": row.post_id, **labels, "classifier_version": CLASSIFIER_VERSION})
+        else:
+            unchanged.append(row.post_id)
+
+    async with SessionLocal() as session:
+        if changed:
+            changed_ids = [row["post_id"] for row in changed]
+            rollups_before = await rollup_states(session, changed_ids)
+            await session.execute(update(Post), changed)
+            await update_rollups(session, rollups_before, changed_ids)
+        if unchanged:
+            await session.execute(
+                update(Post)
+                .where(Post.post_id.in_(unchanged))
+                .values(classifier_version=CLASSIFIER_VERSION)
+                .execution_options(synchronize_session=False)
+            )
+        await session.commit()
+
+    return {"last_id": rows[-1].post_id, "scanned": len(rows), "updated": len(changed)}
+
+async def reclassify(chunk_size: int = DEFAULT_CHUNK_SIZE, workers: int = DEFAULT_WORKERS,
+                     checkpoint_path: str = CHECKPOINT_FILE, restart: bool = False) -> Dict:
+    """Проход по всем постам со старой версией классификатора"""
+    checkpoint = None if restart else load_checkpoint(checkpoint_path)
+    if checkpoint:
+        print(f"[reclassify] Продолжаю после {checkpoint['last_id']} "
+              f"(просмотрено {checkpoint['scanned']}, обновлено {checkpoint['updated']})")
+    else:
+        checkpoint = {"version": CLASSIFIER_VERSION, "last_id": None, "scanned": 0, "updated": 0}
+
+    started = time.monotonic()
+    scanned_at_start = checkpoint["scanned"]
+    in_flight = deque()
+
+    async def finish_oldest():
+        # Позицию двигаем только по кускам, завершенным по порядку
+        result = await in_flight.popleft()
+        checkpoint["last_id"] = result["last_id"]
+        checkpoint["scanned"] += result["scanned"]
+        checkpoint["updated"] += result["updated"]
+        save_checkpoint(checkpoint_path, checkpoint)
+
+        rate = (checkpoint["scanned"] - scanned_at_start) / max(time.monotonic() - started, 1e-9)
+        print(f"[reclassify] Просмотрено {checkpoint['scanned']:,}, обновлено {checkpoint['updated']:,} "
+              f"({rate:,.0f} постов/сек)")
+
+    try:
+        async for rows in stream_posts(checkpoint["last_id"], chunk_size):
+            in_flight.append(asyncio.create_task(reclassify_chunk(rows)))
+            if len(in_flight) >= workers:
+                await finish_oldest()
+        while in_flight:
+            await finish_oldest()
+    finally:
+        for task in in_flight:
+            task.cancel()
+        shutdown_process_pool()
+
+    checkpoint["done"] = True
+    save_checkpoint(checkpoint_path, checkpoint)
+    return checkpoint
+
+async def main():
+    parser = argparse.ArgumentParser(description="Переклассификация постов текущей версией классификатора")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="кусков в работе одновременно")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE)
+    parser.add_argument("--restart", action="store_true", help="начать заново, игнорируя checkpoint")
+    args = parser.parse_args()
+
+    await init_db()
+    print(f"[reclassify] Версия классификатора {CLASSIFIER_VERSION}")
+    result = await reclassify(args.chunk_size, args.workers, args.checkpoint, args.restart)
+    print(f"✅ Готово: просмотрено {result['scanned']:,}, обновлено {result['updated']:,}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,335 @@
+"""
+Локальный индекс похожих постов: TF-IDF на хэшированных признаках
+
+Слова текста обрезаются до STEM_LENGTH символов (грубая основа для русской
+морфологии) и хэшируются в DIMENSIONS признаков. Вектор поста — log-частоты
+слов, умноженные на idf на момент добавления, с нормой 1; запрос взвешивается
+текущим idf, сходство — косинус.
+
+На диске индекс лежит поколениями в SIMILARITY_INDEX_DIR/<поколение>/: массивы
+документов (indptr, terms, weights) и они же, переложенные по признакам
+(postings), чтобы поиск читал только списки слов запроса. Файлы открываются
+через mmap, поэтому загрузка мгновенная, а память делится между процессами.
+Новые посты копятся в памяти и сливаются в новое поколение каждые SAVE_EVERY
+документов; файл CURRENT с номером поколения заменяется атомарно. Запись идет
+под файловой блокировкой LOCK и сливает новые документы с поколением из
+CURRENT, поэтому несколько процессов-сборщиков не теряют документы друг друга.
+
+    python similarity_index.py --rebuild  # собрать индекс заново по таблице posts
+"""
+
+import argparse
+import asyncio
+import fcntl
+import json
+import os
+import re
+import shutil
+import time
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config import SIMILARITY_INDEX_DIR
+
+DIMENSIONS = 1 << 18  # Признаков после хэширования
+STEM_LENGTH = 6  # Символов основы слова
+MIN_TOKEN_LENGTH = 3  # Более короткие слова (предлоги, союзы) пропускаем
+SAVE_EVERY = 5000  # Новых документов до записи поколения на диск
+KEEP_GENERATIONS = 2  # Сколько старых поколений не удаляем (их могут читать другие процессы)
+
+WORD_RE = re.compile(r"\w+")
+ARRAYS = ("indptr", "terms", "weights", "term_ptr", "posting_docs", "posting_weights", "df")
+
+def vectorize(text: Optional[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Номера признаков текста по возрастанию и их веса 1 + log(tf)"""
+    counts = Counter()
+    for token in WORD_RE.findall((text or "").lower().replace("ё", "е")):
+        if len(token) >= MIN_TOKEN_LENGTH and not token.isdigit():
+            counts[zlib.crc32(token[:STEM_LENGTH].encode("utf-8")) % DIMENSIONS] += 1
+    if not counts:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+    terms = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+    weights = 1 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+    order = np.argsort(terms)
+    return terms[order], weights[order].astype(np.float32)
+
+def _normalize(weights: np.ndarray) -> np.ndarray:
+    norm = float(np.sqrt(np.dot(weights, weights)))
+    return weights / norm if norm else weights
+
+def _document_frequencies(documents: List[Tuple[str, np.ndarray, np.ndarray]]) -> np.ndarray:
+    """df по документам (признаки документа уникальны)"""
+    if not documents:
+        return np.zeros(DIMENSIONS, dtype=np.int32)
+    terms = np.concatenate([terms for _, terms, _ in documents])
+    return np.bincount(terms, minlength=DIMENSIONS).astype(np.int32)
+
+def _postings(indptr: np.ndarray, terms: np.ndarray, weights: np.ndarray) -> Dict[str, np.ndarray]:
+    """Перекладывает документы по признакам: для признака t его документы в posting_docs[term_ptr[t]:term_ptr[t+1]]"""
+    docs = np.repeat(np.arange(len(indptr) - 1, dtype=np.int32), np.diff(indptr))
+    order = np.argsort(terms, kind="stable")
+    term_ptr = np.zeros(DIMENSIONS + 1, dtype=np.int64)
+    np.cumsum(np.bincount(terms, minlength=DIMENSIONS), out=term_ptr[1:])
+    return {"term_ptr": term_ptr, "posting_docs": docs[order], "posting_weights": weights[order]}
+
+class SimilarityIndex:
+    def __init__(self, path: str = SIMILARITY_INDEX_DIR, save_every: int = SAVE_EVERY):
+        self.path = path
+        self.save_every = save_every
+        self.generation = 0
+        self.arrays: Dict[str, np.ndarray] = {}
+        self.post_ids: List[str] = []
+        self.df = np.zeros(DIMENSIONS, dtype=np.int32)
+        self.known = set()
+        # Документы, добавленные после последней записи: (post_id, признаки, веса)
+        self.pending: List[Tuple[str, np.ndarray, np.ndarray]] = []
+        self.loaded = False
+        self.saving = False
+
+    # --- Диск ---
+    def _current_generation(self) -> int:
+        try:
+            with open(os.path.join(self.path, "CURRENT"), "r", encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def load(self):
+        """Открывает последнее записанное поколение (через mmap)"""
+        generation = self._current_generation()
+        self.loaded = True
+        if not generation:
+            return
+        arrays, post_ids = self._read_generation(generation)
+
+        self.generation = generation
+        self.arrays = arrays
+        self.post_ids = post_ids
+        self.known = set(post_ids)
+        self.df = np.array(arrays["df"])  # df меняется при добавлении, держим копию в памяти
+        self.pending = []
+        print(f"[similarity] Загружено поколение {generation}: {len(post_ids):,} документов")
+
+    def reload_if_changed(self):
+        """Подхватывает поколение, записанное другим процессом (если своих несохраненных нет)"""
+        if not self.loaded:
+            self.load()
+        elif not self.pending and self._current_generation() != self.generation:
+            self.load()
+
+    def _read_generation(self, generation: int) -> Tuple[Dict[str, np.ndarray], List[str]]:
+        directory = os.path.join(self.path, str(generation))
+        with open(os.path.join(directory, "post_ids.json"), "r", encoding="utf-8") as f:
+            post_ids = json.load(f)
+        return {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in ARRAYS}, post_ids
+
+    def _write(self, pending: List[Tuple[str, np.ndarray, np.ndarray]],
+               merge: bool = True) -> Tuple[int, List[str], np.ndarray]:
+        """Пишет поколение из последнего записанного плюс pending; возвращает его номер, post_id и df
+
+        Под файловой блокировкой основой берется поколение из CURRENT, а не
+        загруженное в этот процесс: иначе процесс со старой основой выбросил бы
+        документы, записанные другими процессами. merge=False пишет только
+        pending (полная пересборка).
+        """
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, "LOCK"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                current = self._current_generation()
+                if not merge:
+                    base, base_ids = {}, []
+                elif current == self.generation:
+                    base, base_ids = self.arrays, self.post_ids
+                else:
+                    base, base_ids = self._read_generation(current) if current else ({}, [])
+                # Тот же пост мог успеть записать другой процесс
+                base_known = set(base_ids)
+                pending = [doc for doc in pending if doc[0] not in base_known]
+
+                lengths = np.array([len(terms) for _, terms, _ in pending], dtype=np.int64)
+                base_indptr = np.asarray(base["indptr"]) if base else np.zeros(1, dtype=np.int64)
+                indptr = np.concatenate([base_indptr, base_indptr[-1] + np.cumsum(lengths)])
+                terms = np.concatenate(([np.asarray(base["terms"])] if base else []) + [t for _, t, _ in pending])
+                weights = np.concatenate(([np.asarray(base["weights"])] if base else []) + [w for _, _, w in pending])
+                df = np.array(base["df"]) if base else np.zeros(DIMENSIONS, dtype=np.int32)
+                df += _document_frequencies(pending)
+                arrays = {"indptr": indptr, "terms": terms.astype(np.int32), "weights": weights.astype(np.float32), "df": df}
+                arrays.update(_postings(indptr, arrays["terms"], arrays["weights"]))
+                post_ids = base_ids + [post_id for post_id, _, _ in pending]
+
+                generation = max(self.generation, current) + 1
+                directory = os.path.join(self.path, str(generation))
+                os.makedirs(directory, exist_ok=True)
+                for name, array in arrays.items():
+                    np.save(os.path.join(directory, f"{name}.npy"), array)
+                with open(os.path.join(directory, "post_ids.json"), "w", encoding="utf-8") as f:
+                    json.dump(post_ids, f)
+
+                # Номер поколения пишем последним: до этого читатели видят старое целиком
+                tmp_path = os.path.join(self.path, f"CURRENT.{os.getpid()}.tmp")
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(str(generation))
+                os.replace(tmp_path, os.path.join(self.path, "CURRENT"))
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return generation, post_ids, df
+
+    def _activate(self, generation: int, post_ids: List[str], df: np.ndarray, written: int):
+        """Переключает поиск на записанное поколение"""
+        self.generation = generation
+        self.arrays, _ = self._read_generation(generation)
+        self.post_ids = post_ids
+        self.known.update(post_ids)
+        # Пока писали, могли добавиться новые документы — они остаются в pending
+        self.pending = self.pending[written:]
+        self.df = df + _document_frequencies(self.pending)
+        self._cleanup()
+        print(f"[similarity] Записано поколение {generation}: {len(post_ids):,} документов")
+
+    def save(self, merge: bool = True):
+        """Сливает накопленные документы с последним поколением и пишет новое"""
+        if self.pending:
+            pending = self.pending[:]
+            self._activate(*self._write(pending, merge), len(pending))
+
+    def _cleanup(self):
+        for name in os.listdir(self.path):
+            if name.isdigit() and int(name) < self.generation - KEEP_GENERATIONS:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    async def maybe_save(self):
+        """Пишет поколение в отдельном потоке, когда накопилось save_every документов"""
+        if self.saving or len(self.pending) < self.save_every:
+            return
+        self.saving = True
+        try:
+            # Тяжелая часть — в потоке; переключение на новое поколение — в event loop,
+            # чтобы поиск и add не видели индекс наполовину обновленным
+            pending = self.pending[:]
+            generation, post_ids, df = await asyncio.to_thread(self._write, pending)
+            self._activate(generation, post_ids, df, len(pending))
+        except Exception as e:
+            print(f"[similarity] Не удалось записать индекс: {e}")
+        finally:
+            self.saving = False
+
+    # --- Индекс ---
+    @property
+    def size(self) -> int:
+        return len(self.post_ids) + len(self.pending)
+
+    def idf(self, terms: np.ndarray) -> np.ndarray:
+        return (np.log((self.size + 1) / (self.df[terms] + 1)) + 1).astype(np.float32)
+
+    def add(self, post_id: str, text: Optional[str]) -> bool:
+        """Добавляет пост; повторный post_id и текст без слов пропускаются"""
+        if not self.loaded:
+            self.load()
+        if post_id in self.known:
+            return False
+        terms, weights = vectorize(text)
+        if not len(terms):
+            return False
+        self.df[terms] += 1
+        self.pending.append((post_id, terms, _normalize(weights * self.idf(terms))))
+        self.known.add(post_id)
+        return True
+
+    def add_many(self, items: Iterable[Tuple[str, Optional[str]]]) -> int:
+        return sum(self.add(post_id, text) for post_id, text in items)
+
+    def search(self, text: str, k: int = 10, exclude: Iterable[str] = ()) -> List[Tuple[str, float]]:
+        """k самых похожих постов: [(post_id, косинус), ...] по убыванию"""
+        self.reload_if_changed()
+        terms, weights = vectorize(text)
+        if not len(terms) or not self.size:
+            return []
+        query = _normalize(weights * self.idf(terms))
+
+        arrays, post_ids, pending = self.arrays, self.post_ids, self.pending
+        base_count = len(post_ids)
+        scores = np.zeros(base_count + len(pending), dtype=np.float32)
+        if arrays:
+            term_ptr = arrays["term_ptr"]
+            posting_docs = arrays["posting_docs"]
+            posting_weights = arrays["posting_weights"]
+            for term, weight in zip(terms.tolist(), query.tolist()):
+                start, end = int(term_ptr[term]), int(term_ptr[term + 1])
+                if start != end:
+                    # В списке признака каждый документ встречается один раз
+                    scores[posting_docs[start:end]] += weight * posting_weights[start:end]
+        for offset, (_, doc_terms, doc_weights) in enumerate(pending):
+            _, query_at, doc_at = np.intersect1d(terms, doc_terms, assume_unique=True, return_indices=True)
+            if len(query_at):
+                scores[base_count + offset] = float(np.dot(query[query_at], doc_weights[doc_at]))
+
+        excluded = set(exclude)
+        matches = []
+        candidates = min(len(scores), k + len(excluded))
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+        for index in top[np.argsort(-scores[top], kind="stable")].tolist():
+            if scores[index] <= 0:
+                break
+            post_id = post_ids[index] if index < base_count else pending[index - base_count][0]
+            if post_id not in excluded:
+                matches.append((post_id, float(scores[index])))
+        return matches[:k]
+
+# Глобальный индекс похожих постов
+similarity_index = SimilarityIndex()
+
+async def rebuild(chunk_size: int = 5000) -> int:
+    """Собирает индекс заново по всем постам (копии из групп дублей пропускаются)"""
+    from sqlalchemy import select, or_
+    from bot.db import engine, Post
+    from post_classifier import join_title_and_body
+
+    query = (
+        select(Post.post_id, Post.title, Post.body)
+        .where(or_(Post.dup_cluster_id.is_(None), Post.dup_cluster_id == Post.post_id))
+        .order_by(Post.post_id)
+        .execution_options(yield_per=chunk_size)
+    )
+    started = time.monotonic()
+    documents = []
+    async with engine.connect() as conn:
+        result = await conn.stream(query)
+        async for rows in result.partitions(chunk_size):
+            for row in rows:
+                terms, weights = vectorize(join_title_and_body(row.title, row.body))
+                if len(terms):
+                    documents.append((row.post_id, terms, weights))
+
+    # idf считаем по всей коллекции сразу, а не по мере добавления
+    index = SimilarityIndex(similarity_index.path)
+    index.loaded = True  # старое поколение не читаем
+    for _, terms, _ in documents:
+        index.df[terms] += 1
+    index.pending = [
+        (post_id, terms, _normalize(weights * index.idf(terms))) for post_id, terms, weights in documents
+    ]
+    index.known = {post_id for post_id, _, _ in documents}
+    index.save(merge=False)
+    print(f"[similarity] Индекс собран за {time.monotonic() - started:.1f} с: {index.size:,} документов")
+    return index.size
+
+async def main():
+    parser = argparse.ArgumentParser(description="Индекс похожих постов")
+    parser.add_argument("--rebuild", action="store_true", help="собрать индекс заново по таблице posts")
+    parser.add_argument("--query", help="найти посты, похожие на текст")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        from bot.db import init_db
+        await init_db()
+        await rebuild()
+    if args.query:
+        for post_id, score in similarity_index.search(args.query, k=10):
+            print(f"{score:.3f}  {post_id}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
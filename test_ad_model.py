@@ -0,0 +1,81 @@
+import csv
+import datetime
+import random
+
+import numpy as np
+import pytest
+
+from ad_model import AdModel, export_unlabeled, fit, import_labels, load_labeled_posts, parse_label
+from bot.db import SessionLocal, Post
+
+WORDS = "проект идея команда город выставка художник книга история результат неделя работа опыт".split()
+AD_LINES = ["Подпишись на канал @brand{n}: https://t.me/brand{n}", "Жми на ссылку https://bit.ly/sale{n} и забирай скидку"]
+
+def post_text(rng, is_ad):
+    text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20)))
+    if is_ad:
+        text += "\n\n" + rng.choice(AD_LINES).format(n=rng.randint(1, 30))
+    return text
+
+async def seed_posts(count, seed=0):
+    """Посты без разметки; по четным номерам — реклама"""
+    rng = random.Random(seed)
+    async with SessionLocal() as session:
+        for i in range(count):
+            session.add(Post(post_id=f"c1_{i}", channel_id="c1", posted_at=datetime.datetime(2025, 3, 3),
+                             body=post_text(rng, i % 2 == 0)))
+        await session.commit()
+
+def label_csv(path, labels):
+    """Заполняет колонку is_ad выгрузки export"""
+    with open(path, encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        row["is_ad"] = labels(row["post_id"])
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["post_id", "is_ad", "text"])
+        writer.writeheader()
+        writer.writerows(rows)
+
+def test_parse_label():
+    assert parse_label("1") is True and parse_label(" Да ") is True and parse_label("false") is False
+    assert parse_label("") is None and parse_label(None) is None
+    with pytest.raises(ValueError):
+        parse_label("maybe")
+
+def test_export_and_import_labels(run, tmp_path):
+    run(seed_posts(10))
+    path = str(tmp_path / "labels.csv")
+    assert run(export_unlabeled(path, limit=6)) == 6
+    # Один пост оставляем без метки, один — удален из БД
+    label_csv(path, lambda post_id: "" if post_id == "c1_1" else "1" if int(post_id[3:]) % 2 == 0 else "0")
+    with open(path, "a", encoding="utf-8", newline="") as f:
+        csv.writer(f).writerow(("c1_missing", "1", ""))
+
+    result = run(import_labels(path))
+    data = run(load_labeled_posts())
+    assert result["missing"] == 1 and result["labeled"] == len(data["labels"])
+    assert result["labeled"] + result["skipped"] == 6
+    # Размеченные посты больше не выгружаются
+    assert run(export_unlabeled(path, limit=100)) == 10 - result["labeled"]
+
+def test_train_from_saved_labels_and_load(run, tmp_path):
+    run(seed_posts(240))
+    path = str(tmp_path / "labels.csv")
+    run(export_unlabeled(path, limit=1000))
+    label_csv(path, lambda post_id: "1" if int(post_id[3:]) % 2 == 0 else "0")
+    run(import_labels(path))
+
+    data = run(load_labeled_posts())
+    assert len(data["labels"]) == 240 and sum(data["labels"]) == 120
+    result = fit(data["texts"], [None] * len(data["texts"]), data["labels"])
+    assert result["validation"]["f1"] > 0.9
+
+    model_path = str(tmp_path / "ad_model.npz")
+    result["model"].save(model_path)
+    loaded = AdModel.load(model_path)
+    assert loaded.digest == result["model"].digest and loaded.threshold == result["model"].threshold
+    assert loaded.meta["samples"] == 240
+    probabilities = loaded.predict_proba(data["texts"], [None] * len(data["texts"]))
+    np.testing.assert_allclose(probabilities, result["model"].predict_proba(data["texts"], [None] * len(data["texts"])), atol=1e-5)
+    assert AdModel.load_if_exists(str(tmp_path / "missing.npz")) is None
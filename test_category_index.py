@@ -0,0 +1,61 @@
+from sqlalchemy import delete, update
+
+from bot.db import SessionLocal, ChannelTopic, Topic
+from category_index import CategoryIndex, topic_matches
+
+CATEGORIES = ["Маркетинг", "Бизнес"]
+
+async def seed(topics=(), links=()):
+    """topics: (topic_id, topic_name); links: (id, channel_id, topic_id)"""
+    async with SessionLocal() as session:
+        for topic_id, topic_name in topics:
+            session.add(Topic(topic_id=topic_id, topic_name=topic_name))
+        for link_id, channel_id, topic_id in links:
+            session.add(ChannelTopic(id=link_id, channel_id=channel_id, topic_id=topic_id))
+        await session.commit()
+
+async def execute(statement):
+    async with SessionLocal() as session:
+        await session.execute(statement)
+        await session.commit()
+
+async def lookup(index, *categories):
+    return [sorted(await index.channel_ids(category)) for category in categories]
+
+def test_topic_matches_like_ilike():
+    assert topic_matches("маркетинг", "Интернет-МАРКЕТИНГ")
+    assert not topic_matches("Маркетинг", "Бизнес") and not topic_matches("Маркетинг", None)
+
+def test_lookup_and_incremental_refresh(run):
+    run(seed(topics=[("t1", "Интернет-маркетинг"), ("t2", "Малый бизнес"), ("t3", "Кино")],
+             links=[("l1", "c1", "t1"), ("l2", "c2", "t1"), ("l3", "c2", "t2"), ("l4", "c3", "t3")]))
+    index = CategoryIndex(CATEGORIES, refresh_interval=3600)
+    assert run(lookup(index, "Маркетинг", "Бизнес")) == [["c1", "c2"], ["c2"]]
+    # Категория не из списка считается по связям в памяти
+    assert run(lookup(index, "кино")) == [["c3"]]
+
+    # Без invalidate индекс не ходит в БД до истечения интервала
+    run(seed(links=[("l5", "c4", "t2")]))
+    run(execute(delete(ChannelTopic).where(ChannelTopic.id == "l1")))
+    assert run(lookup(index, "Маркетинг", "Бизнес")) == [["c1", "c2"], ["c2"]]
+
+    index.invalidate()
+    assert run(lookup(index, "Маркетинг", "Бизнес")) == [["c2"], ["c2", "c4"]]
+    assert index.stats == {"refreshes": 2, "added": 5, "removed": 1}
+
+def test_channel_stays_while_any_topic_matches(run):
+    run(seed(topics=[("t1", "Маркетинг"), ("t2", "Контент-маркетинг")],
+             links=[("l1", "c1", "t1"), ("l2", "c1", "t2")]))
+    index = CategoryIndex(CATEGORIES, refresh_interval=0)
+    assert run(lookup(index, "Маркетинг")) == [["c1"]]
+    run(execute(delete(ChannelTopic).where(ChannelTopic.id == "l1")))
+    assert run(lookup(index, "Маркетинг")) == [["c1"]]
+    run(execute(delete(ChannelTopic).where(ChannelTopic.id == "l2")))
+    assert run(lookup(index, "Маркетинг")) == [[]]
+
+def test_renamed_topic_rebuilds_sets(run):
+    run(seed(topics=[("t1", "Маркетинг")], links=[("l1", "c1", "t1")]))
+    index = CategoryIndex(CATEGORIES, refresh_interval=0)
+    assert run(lookup(index, "Маркетинг", "Бизнес")) == [["c1"], []]
+    run(execute(update(Topic).where(Topic.topic_id == "t1").values(topic_name="Бизнес")))
+    assert run(lookup(index, "Маркетинг", "Бизнес")) == [[], ["c1"]]
@@ -0,0 +1,53 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+import channel_ingest
+
+CHAT = SimpleNamespace(id=1)
+
+def message(message_id, text="пост"):
+    return SimpleNamespace(
+        id=message_id, text=text, caption=None, date=datetime.datetime(2025, 3, 3, 12, 0),
+        views=100, reactions=None, forwards=0
+    )
+
+async def history(messages):
+    for msg in messages:
+        yield msg
+
+def ingest(monkeypatch, messages, fail_on=None):
+    """ingest_history со страницами по 2 сообщения; страница с id fail_on не записывается"""
+    saved = []
+
+    async def save_page(chat_id, page, media=None):
+        if fail_on in [msg.id for msg in page]:
+            raise RuntimeError("БД недоступна")
+        saved.append([msg.id for msg in page])
+
+    monkeypatch.setattr(channel_ingest, "HISTORY_PAGE_SIZE", 2)
+    monkeypatch.setattr(channel_ingest, "save_page", save_page)
+    return asyncio.run(channel_ingest.ingest_history(CHAT, history(messages))), saved
+
+def test_all_pages_saved(monkeypatch):
+    batch, saved = ingest(monkeypatch, [message(i) for i in range(10, 4, -1)])
+    assert saved == [[10, 9], [8, 7], [6, 5]]
+    assert (batch["newest_id"], batch["oldest_id"], batch["error"]) == (10, 5, None)
+
+def test_failed_page_stops_and_keeps_committed_marks(monkeypatch):
+    batch, saved = ingest(monkeypatch, [message(i) for i in range(10, 4, -1)], fail_on=8)
+    assert saved == [[10, 9]]
+    assert batch["error"]
+    # Посты новее старой отметки не все записаны: newest_id не двигаем
+    assert batch["newest_id"] is None
+    assert batch["oldest_id"] == 9
+
+def test_failed_last_page(monkeypatch):
+    batch, saved = ingest(monkeypatch, [message(i) for i in range(10, 7, -1)], fail_on=8)
+    assert saved == [[10, 9]]
+    assert batch["error"] and batch["oldest_id"] == 9
+
+def test_messages_without_text_move_marks(monkeypatch):
+    batch, saved = ingest(monkeypatch, [message(5), message(4, text=None), message(3)])
+    assert saved == [[5, 3]]
+    assert (batch["newest_id"], batch["oldest_id"]) == (5, 3)
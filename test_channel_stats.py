@@ -0,0 +1,63 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from channel_stats import collect, iter_ndjson, last_saved_id
+
+def post_line(post_id, text="пост"):
+    return json.dumps({"id": post_id, "text": text}, ensure_ascii=False) + "\n"
+
+class FakeApp:
+    """История канала с id от top до 1, от новых к старым"""
+    name = "channel_stats_test"
+
+    def __init__(self, top):
+        self.top = top
+
+    async def get_chat(self, username):
+        return SimpleNamespace(messages_count=self.top)
+
+    async def get_chat_history(self, username, offset_id=0, limit=0):
+        start = offset_id - 1 if offset_id else self.top
+        stop = max(start - limit, 0) if limit else 0
+        for message_id in range(start, stop, -1):
+            yield SimpleNamespace(id=message_id, text=f"пост {message_id}", caption=None, reactions=None,
+                                  views=message_id, photo=None, topic_id=None, topic_name=None)
+
+def test_last_saved_id(tmp_path):
+    path = tmp_path / "posts.ndjson"
+    assert last_saved_id(str(path)) is None
+    path.write_text(post_line(10) + post_line(9), encoding="utf-8")
+    assert last_saved_id(str(path)) == 9
+    path.write_text("", encoding="utf-8")
+    assert last_saved_id(str(path)) is None
+
+def test_last_saved_id_truncates_partial_line(tmp_path):
+    path = tmp_path / "posts.ndjson"
+    whole = post_line(10) + post_line(9)
+    path.write_text(whole + '{"id": 8, "te', encoding="utf-8")
+    assert last_saved_id(str(path)) == 9
+    assert path.read_text(encoding="utf-8") == whole
+
+    # Единственная строка недописана: файл пустеет
+    path.write_text('{"id": 8', encoding="utf-8")
+    assert last_saved_id(str(path)) is None and path.read_text(encoding="utf-8") == ""
+
+def test_last_saved_id_with_lines_longer_than_read_block(tmp_path):
+    path = tmp_path / "posts.ndjson"
+    long_text = "слово " * 2000
+    path.write_text(post_line(10, long_text) + post_line(9, long_text) + '{"id": 8, "text": "' + long_text,
+                    encoding="utf-8")
+    assert last_saved_id(str(path)) == 9
+    assert [post["id"] for post in iter_ndjson(str(path))] == [10, 9]
+
+def test_streaming_export_resumes_after_crash(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "chan_posts.ndjson")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(post_line(120) + post_line(119) + '{"id": 118, "vi')
+
+    asyncio.run(collect(FakeApp(120), "chan", None, True, path))
+    ids = [post["id"] for post in iter_ndjson(path)]
+    assert ids == list(range(120, 0, -1))
+    assert next(iter_ndjson(path))["text"] == "пост"  # уже записанные строки не переписаны
@@ -0,0 +1,147 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+import pytest
+from pyrogram.errors import FloodWait, UserDeactivated
+
+import channel_ingest
+import crawl_coordinator
+from bot.db import AccountStatus
+
+def message(message_id):
+    return SimpleNamespace(
+        id=message_id, text="пост", caption=None, date=datetime.datetime(2025, 3, 3, 12, 0),
+        views=100, reactions=None, forwards=0
+    )
+
+class FakeManager:
+    """История канала от нового к старому, как у get_chat_history"""
+    def __init__(self, ids):
+        self.ids = ids
+
+    async def get_chat(self, account_id, channel):
+        return SimpleNamespace(id=1)
+
+    async def get_chat_history(self, account_id, chat_id, limit=None):
+        for message_id in self.ids[:limit]:
+            yield message(message_id)
+
+@pytest.fixture
+def pages(monkeypatch):
+    """Страницы по 2 сообщения; страницы с id из failing не записываются"""
+    saved, failing = [], set()
+
+    async def save_page(chat_id, page, media=None):
+        if failing & {msg.id for msg in page}:
+            raise RuntimeError("БД недоступна")
+        saved.extend(msg.id for msg in page)
+
+    async def save_channel_and_snapshot(chat):
+        pass
+
+    monkeypatch.setattr(channel_ingest, "HISTORY_PAGE_SIZE", 2)
+    monkeypatch.setattr(channel_ingest, "save_page", save_page)
+    monkeypatch.setattr(crawl_coordinator, "save_channel_and_snapshot", save_channel_and_snapshot)
+    return SimpleNamespace(saved=saved, failing=failing)
+
+def test_failed_page_keeps_mark_and_fails_channel(run, pages):
+    run(channel_ingest.update_crawl_state("1", newest_id=3, oldest_id=1))
+    manager = FakeManager([8, 7, 6, 5, 4, 3, 2, 1])
+    pages.failing.add(6)
+
+    with pytest.raises(RuntimeError):
+        run(crawl_coordinator.crawl_channel(manager, "a1", "chan"))
+    state = run(channel_ingest.load_crawl_state("1"))
+    assert state.last_message_id == 3 and state.oldest_message_id == 1
+
+    # Повтор забирает все посты, потерянные при сбое
+    pages.failing.clear()
+    result = run(crawl_coordinator.crawl_channel(manager, "a1", "chan"))
+    assert result["fetched"] == 5 and {6, 5, 4} <= set(pages.saved)
+    assert run(channel_ingest.load_crawl_state("1")).last_message_id == 8
+
+def test_failed_initial_crawl_keeps_committed_prefix(run, pages):
+    pages.failing.add(2)
+    with pytest.raises(RuntimeError):
+        run(crawl_coordinator.crawl_channel(FakeManager([4, 3, 2, 1]), "a1", "chan"))
+    state = run(channel_ingest.load_crawl_state("1"))
+    assert state.last_message_id is None and state.oldest_message_id == 3
+
+class CoordinatorManager:
+    """Аккаунты и начальная раскладка каналов для CrawlCoordinator"""
+    def __init__(self, distribution):
+        self.accounts = {account_id: None for account_id in distribution}
+        self.distribution = distribution
+        self.statuses = {}
+        self.blocked = {}  # аккаунт -> секунд до конца FloodWait
+
+    async def distribute_channels(self, channels):
+        return {account_id: list(shard) for account_id, shard in self.distribution.items()}
+
+    def time_until_free(self, account_id):
+        return self.blocked.get(account_id, 0)
+
+    async def update_account_status(self, account_id, status):
+        self.statuses[account_id] = status
+
+def coordinate(monkeypatch, distribution, handler, channels=None):
+    monkeypatch.setattr(crawl_coordinator, "IDLE_POLL_INTERVAL", 0.001)
+    manager = CoordinatorManager(distribution)
+    coordinator = crawl_coordinator.CrawlCoordinator(manager, handler)
+    channels = channels or [channel for shard in distribution.values() for channel in shard]
+    stats = asyncio.run(coordinator.run(channels))
+    return coordinator, manager, stats
+
+def test_idle_account_steals_from_longest_queue(monkeypatch):
+    crawled = []
+
+    async def handler(manager, account_id, channel):
+        crawled.append((account_id, channel))
+        await asyncio.sleep(0.01)
+        return channel
+
+    coordinator, _, stats = coordinate(monkeypatch, {"a1": [f"c{i}" for i in range(6)], "a2": []}, handler)
+    assert stats["done"] == 6 and stats["failed"] == 0
+    assert stats["accounts"]["a2"]["stolen"] > 0
+    # Свои каналы идут с головы очереди, чужие забираются с хвоста
+    assert crawled[0] == ("a1", "c0") and ("a2", "c5") in crawled
+    assert sorted(channel for _, channel in crawled) == [f"c{i}" for i in range(6)]
+
+def test_banned_account_share_goes_to_others(monkeypatch):
+    async def handler(manager, account_id, channel):
+        if account_id == "a1":
+            raise UserDeactivated()
+        await asyncio.sleep(0.001)
+        return channel
+
+    coordinator, manager, stats = coordinate(monkeypatch, {"a1": ["c1", "c2", "c3"], "a2": ["c4"]}, handler)
+    assert stats["banned"] == ["a1"] and stats["done"] == 4
+    assert manager.statuses == {"a1": AccountStatus.Banned}
+
+def test_flood_wait_reassigns_channel(monkeypatch):
+    crawled = []
+
+    async def handler(manager, account_id, channel):
+        if account_id == "a1" and channel == "c1":
+            # Лимитер AccountManager блокирует аккаунт на время FloodWait
+            manager.blocked[account_id] = 600
+            raise FloodWait(value=600)
+        crawled.append((account_id, channel))
+        return channel
+
+    _, _, stats = coordinate(monkeypatch, {"a1": ["c1"], "a2": []}, handler)
+    assert crawled == [("a2", "c1")] and stats["done"] == 1
+
+def test_channel_errors_retried_then_failed(monkeypatch):
+    attempts = {}
+
+    async def handler(manager, account_id, channel):
+        attempts[channel] = attempts.get(channel, 0) + 1
+        if channel == "broken" or attempts[channel] == 1:
+            raise RuntimeError("страница не сохранена")
+        return channel
+
+    coordinator, _, stats = coordinate(monkeypatch, {"a1": ["ok", "broken"], "a2": []}, handler)
+    assert attempts == {"ok": 2, "broken": crawl_coordinator.MAX_CHANNEL_ATTEMPTS}
+    assert stats["done"] == 1 and list(coordinator.failed) == ["broken"]
@@ -0,0 +1,76 @@
+import asyncio
+
+from crawl_scheduler import CrawlScheduler
+
+class Handler:
+    """Задачи ждут сигнала release; считается пик одновременных задач по аккаунтам"""
+    def __init__(self):
+        self.running = {}
+        self.peak = {}
+        self.done = []
+        self.release = asyncio.Event()
+
+    async def __call__(self, task):
+        account = task["account"]
+        self.running[account] = self.running.get(account, 0) + 1
+        self.peak[account] = max(self.peak.get(account, 0), self.running[account])
+        try:
+            await self.release.wait()
+            if task.get("fail"):
+                raise RuntimeError("сбой")
+            return {"success": not task.get("soft_fail")}
+        finally:
+            self.running[account] -= 1
+            self.done.append(task["channel"])
+
+def test_workers_capped_by_account_limits():
+    scheduler = CrawlScheduler(Handler(), workers=10, per_account_limit=2, accounts=3)
+    assert scheduler.workers_count == 6
+    assert CrawlScheduler(Handler(), workers=4, per_account_limit=2, accounts=3).workers_count == 4
+
+def test_per_account_limit_and_free_slots():
+    async def main():
+        handler = Handler()
+        scheduler = CrawlScheduler(handler, workers=4, per_account_limit=2, accounts=2)
+        await scheduler.start()
+        assert scheduler.free_slots() == 4
+        for i in range(3):
+            assert await scheduler.submit({"account": "a", "channel": f"a{i}"})
+        assert await scheduler.submit({"account": "b", "channel": "b0"})
+        await asyncio.sleep(0.01)
+        assert scheduler.free_slots() == 0
+        assert handler.running == {"a": 2, "b": 1}
+        handler.release.set()
+        await scheduler.stop(drain=True)
+        assert handler.peak == {"a": 2, "b": 1} and sorted(handler.done) == ["a0", "a1", "a2", "b0"]
+        assert scheduler.free_slots() == 4
+    asyncio.run(main())
+
+def test_duplicate_key_rejected_until_done():
+    async def main():
+        handler = Handler()
+        scheduler = CrawlScheduler(handler, workers=2)
+        await scheduler.start()
+        assert await scheduler.submit({"account": "a", "channel": "c"})
+        assert not await scheduler.submit({"account": "a", "channel": "c"})
+        handler.release.set()
+        await scheduler.queue.join()
+        assert await scheduler.submit({"account": "a", "channel": "c"})
+        await scheduler.stop(drain=True)
+        assert handler.done == ["c", "c"]
+        # После остановки задачи не принимаются
+        assert not await scheduler.submit({"account": "a", "channel": "d"})
+    asyncio.run(main())
+
+def test_failures_counted_and_worker_survives():
+    async def main():
+        handler = Handler()
+        handler.release.set()
+        scheduler = CrawlScheduler(handler, workers=1)
+        await scheduler.start()
+        for task in ({"channel": "x", "fail": True}, {"channel": "y", "soft_fail": True}, {"channel": "z"}):
+            await scheduler.submit(dict(task, account="a"))
+        await scheduler.stop(drain=True)
+        stats = scheduler.get_stats()
+        assert (stats["processed"], stats["failed"], stats["queue_depth"]) == (1, 2, 0)
+    asyncio.run(main())
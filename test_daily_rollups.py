@@ -0,0 +1,62 @@
+import datetime
+from types import SimpleNamespace
+
+from daily_rollups import ROLLUP_VALUES, TREND_MIN_ER, rollup_deltas
+
+POSTED_AT = datetime.datetime(2025, 3, 3, 14, 30)  # понедельник
+
+def state(post_id="p1", views=1000, er=2.0, topic="Маркетинг", format="list", cta=None,
+          is_ad=False, dup_cluster_id=None, channel_id="c1", posted_at=POSTED_AT):
+    return SimpleNamespace(
+        post_id=post_id, channel_id=channel_id, posted_at=posted_at, topic=topic, format=format,
+        cta=cta, is_ad=is_ad, dup_cluster_id=dup_cluster_id, views_count=views, er=er
+    )
+
+def apply(table, rows):
+    for row in rows:
+        key = tuple(row[field] for field in ("channel_id", "day", "topic", "format", "cta", "hour", "dow"))
+        current = table.setdefault(key, dict.fromkeys(ROLLUP_VALUES, 0))
+        for field in ROLLUP_VALUES:
+            current[field] += row[field]
+    return {key: values for key, values in table.items() if any(values.values())}
+
+def test_new_post_adds_full_contribution():
+    [row] = rollup_deltas({}, {"p1": state(is_ad=True)})
+    assert (row["channel_id"], row["day"], row["hour"], row["dow"]) == ("c1", POSTED_AT.date(), 14, 0)
+    assert row["topic"] == "Маркетинг" and row["cta"] == ""
+    assert row["posts_count"] == 1 and row["originals_count"] == 1 and row["ad_count"] == 1
+    assert row["views_sum"] == 1000 and row["er_sum"] == 2.0
+    assert row["trend_count"] == 1 and row["trend_ad_count"] == 1
+    assert row["timing_count"] == 1 and row["timing_views_sum"] == 1000
+
+def test_metrics_change_keeps_counts():
+    [row] = rollup_deltas({"p1": state(views=1000, er=2.0)}, {"p1": state(views=1500, er=0.5)})
+    assert row["posts_count"] == 0
+    assert row["views_sum"] == 500 and row["er_sum"] == -1.5
+    # ER упал ниже порога трендов: пост уходит из trend_*
+    assert row["trend_count"] == -1 and row["trend_views_sum"] == -1000 and row["trend_er_sum"] == -2.0
+
+def test_label_change_moves_post_between_keys():
+    rows = rollup_deltas({"p1": state(topic="Маркетинг")}, {"p1": state(topic="Бизнес")})
+    by_topic = {row["topic"]: row for row in rows}
+    assert by_topic["Маркетинг"]["posts_count"] == -1
+    assert by_topic["Бизнес"]["posts_count"] == 1
+    assert [row["topic"] for row in rows] == sorted(row["topic"] for row in rows)
+
+def test_unchanged_post_gives_no_rows():
+    assert rollup_deltas({"p1": state()}, {"p1": state()}) == []
+
+def test_duplicate_copy_is_not_original():
+    [row] = rollup_deltas({}, {"p2": state(post_id="p2", dup_cluster_id="p1")})
+    assert row["posts_count"] == 1 and row["originals_count"] == 0
+
+def test_trend_threshold_is_strict():
+    [row] = rollup_deltas({}, {"p1": state(er=TREND_MIN_ER)})
+    assert row["trend_count"] == 0
+
+def test_sequential_deltas_equal_direct_delta():
+    s0, s1, s2 = state(views=100, er=0.5), state(views=900, er=1.5, topic="Бизнес"), state(views=2000, er=3.0)
+    stepwise = apply(apply({}, rollup_deltas({}, {"p1": s0})), rollup_deltas({"p1": s0}, {"p1": s1}))
+    stepwise = apply(stepwise, rollup_deltas({"p1": s1}, {"p1": s2}))
+    direct = apply({}, rollup_deltas({}, {"p1": s2}))
+    assert stepwise == direct
@@ -0,0 +1,55 @@
+import datetime
+import sys
+from types import SimpleNamespace
+
+# data_analyzer и gpt_service импортируют друг друга; анализатору GPT не нужен
+sys.modules.setdefault("gpt_service", SimpleNamespace(gpt_service=None))
+
+from bot.db import SessionLocal, Channel, ChannelSnapshot, Post, PostLatestMetrics
+from channel_ingest import save_channel_and_snapshot
+from data_analyzer import DataAnalyzer
+
+DAY = datetime.datetime(2025, 3, 3, 12, 0)
+
+async def seed_channel(subscribers, posts=2):
+    """Канал со снапшотом на каждый день из subscribers и постами с метриками"""
+    async with SessionLocal() as session:
+        session.add(Channel(channel_id="c1", username="chan", title="Канал"))
+        for i, count in enumerate(subscribers):
+            session.add(ChannelSnapshot(
+                channel_snapshot_id=f"s{i}", channel_id="c1", snapshot_date=DAY + datetime.timedelta(days=i),
+                subscribers_count=count, engagement_rate=float(i)
+            ))
+        for i in range(posts):
+            session.add(Post(post_id=f"c1_{i}", channel_id="c1", posted_at=DAY, format="list"))
+            session.add(PostLatestMetrics(post_id=f"c1_{i}", views_count=100 * (i + 1), er=1.0, snapshot_date=DAY))
+        await session.commit()
+
+def test_channel_analysis_uses_latest_snapshot(run):
+    run(seed_channel([1000, 1100, 1050], posts=2))
+    analysis = run(DataAnalyzer().get_channel_analysis("c1"))
+    assert analysis["channel"]["subscribers"] == 1050
+    assert analysis["channel"]["engagement_rate"] == 2.0
+    # Посты не умножаются на число снапшотов
+    assert analysis["channel"]["total_posts"] == 2
+    assert analysis["formats"] == [{"format": "list", "count": 2, "avg_er": 1.0}]
+    assert [post["views"] for post in analysis["top_posts"]] == [200, 100]
+
+def test_channel_analysis_without_snapshots(run):
+    run(seed_channel([], posts=1))
+    analysis = run(DataAnalyzer().get_channel_analysis("c1"))
+    assert analysis["channel"]["subscribers"] is None and analysis["channel"]["total_posts"] == 1
+
+def test_audience_analysis_reads_snapshot_deltas(run):
+    async def crawl(subscribers):
+        for count in subscribers:
+            chat = SimpleNamespace(id="c1", username="chan", title="Канал", members_count=count)
+            await save_channel_and_snapshot(chat)
+
+    run(crawl([1000, 1000, 1100, 1050]))
+    audience = run(DataAnalyzer().get_audience_analysis("c1"))
+    # Без изменения подписчиков снапшот не пишется; прирост и отток — от предыдущего
+    assert [s["subscribers"] for s in audience["snapshots"]] == [1050, 1100, 1000]
+    assert [(s["new_followers"], s["lost_followers"]) for s in audience["snapshots"]] == [(0, 50), (100, 0), (None, None)]
+    assert audience["current_subscribers"] == 1050 and audience["growth_rate"] == 5.0
+    assert isinstance(audience["snapshots"][0]["date"], str)
@@ -0,0 +1,51 @@
+import pytest
+
+import feature_cache
+from feature_cache import FeatureCache, text_key
+
+@pytest.fixture
+def classified(monkeypatch):
+    """Подменяет классификатор: запоминает тексты, которые реально считались"""
+    texts = []
+
+    async def classify_many_async(batch):
+        texts.extend(batch)
+        return [{"format": "list" if "1." in text else "other", "length": len(text)} for text in batch]
+    monkeypatch.setattr(feature_cache, "classify_many_async", classify_many_async)
+    return texts
+
+def test_text_key_depends_on_version_and_exact_text():
+    assert text_key("Пост") == text_key("Пост")
+    assert text_key("Пост") != text_key("пост") != text_key("Пост ")
+    assert text_key("Пост", "v1") != text_key("Пост", "v2")
+    assert text_key(None) == text_key("")
+
+def test_memory_cache_and_batch_dedupe(run, classified):
+    cache = FeatureCache(persistent=False)
+    first = run(cache.classify_many(["1. пункт", "текст", "1. пункт"]))
+    assert classified == ["1. пункт", "текст"]
+    assert [features["format"] for features in first] == ["list", "other", "list"]
+
+    assert run(cache.classify_many(["текст", None])) == [first[1], {"format": "other", "length": 0}]
+    assert classified == ["1. пункт", "текст", ""]
+    assert cache.stats == {"memory_hits": 1, "db_hits": 0, "misses": 3}
+
+def test_lru_evicts_oldest(run, classified):
+    cache = FeatureCache(max_size=2, persistent=False)
+    run(cache.classify_many(["a", "b"]))
+    run(cache.classify_many(["a"]))  # a теперь свежее b
+    run(cache.classify_many(["c"]))
+    assert list(cache.lru) == [text_key("a"), text_key("c")]
+
+def test_table_shared_between_processes_and_versions(run, classified):
+    run(FeatureCache(version="v1").classify_many(["текст"]))
+    other_process = FeatureCache(version="v1")
+    assert run(other_process.classify_many(["текст"])) == [{"format": "other", "length": 5}]
+    assert other_process.stats["db_hits"] == 1 and classified == ["текст"]
+
+    # Новая версия классификатора не видит старые записи и удаляет их
+    new_version = FeatureCache(version="v2")
+    run(new_version.classify_many(["текст"]))
+    assert classified == ["текст", "текст"]
+    assert run(new_version.purge_stale()) == 1
+    assert run(FeatureCache(version="v1").get_many([text_key("текст", "v1")])) == {}
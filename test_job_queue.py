@@ -0,0 +1,107 @@
+import datetime
+
+from sqlalchemy import update
+
+from bot.db import SessionLocal, CrawlJob
+from job_queue import RETRY_BASE_DELAY, JobQueue, enqueue_parse_task, import_tasks_file, job_queue, task_dedupe_key
+
+async def get_job(job_id):
+    async with SessionLocal() as session:
+        return await session.get(CrawlJob, job_id)
+
+async def make_available(job_id):
+    """Снимает задержку повтора, как будто она уже прошла"""
+    async with SessionLocal() as session:
+        await session.execute(update(CrawlJob).where(CrawlJob.job_id == job_id).values(available_at=datetime.datetime.utcnow()))
+        await session.commit()
+
+def retry_delay(job):
+    return (job.available_at - job.updated_at).total_seconds()
+
+def test_dedupe_key_blocks_only_active_jobs(run):
+    queue = JobQueue()
+    assert run(queue.enqueue({"channel": "a"}, dedupe_key="crawl:a"))
+    assert not run(queue.enqueue({"channel": "a"}, dedupe_key="crawl:a"))
+    [job] = run(queue.lease("w1"))
+    assert not run(queue.enqueue({"channel": "a"}, dedupe_key="crawl:a"))
+    assert run(queue.ack(job["job_id"], "w1"))
+    # Выполненная задача не мешает поставить канал снова
+    assert run(queue.enqueue({"channel": "a"}, dedupe_key="crawl:a"))
+    # Без ключа дубли разрешены
+    assert run(queue.enqueue({"channel": "b"})) and run(queue.enqueue({"channel": "b"}))
+    assert run(queue.get_stats()) == {"done": 1, "queued": 3}
+
+def test_lease_by_priority_and_owner(run):
+    queue = JobQueue()
+    run(queue.enqueue({"channel": "low"}, priority=0))
+    run(queue.enqueue({"channel": "high"}, priority=5))
+    run(queue.enqueue({"channel": "later"}, priority=9, delay=3600))
+    [first] = run(queue.lease("w1", limit=1))
+    jobs = [first] + run(queue.lease("w1", limit=5))
+    # Отложенная задача не выдается, несмотря на приоритет
+    assert [job["payload"]["channel"] for job in jobs] == ["high", "low"]
+    assert all(job["attempts"] == 1 for job in jobs)
+    assert run(queue.lease("w2", limit=5)) == []
+    # Чужой воркер не может подтвердить или продлить аренду
+    assert not run(queue.ack(jobs[0]["job_id"], "w2"))
+    assert not run(queue.extend_lease(jobs[0]["job_id"], "w2"))
+    assert run(queue.extend_lease(jobs[0]["job_id"], "w1"))
+    assert run(queue.lease("w1", limit=0)) == []
+
+def test_fail_backs_off_exponentially_then_gives_up(run):
+    queue = JobQueue()
+    run(queue.enqueue({"channel": "a"}, max_attempts=3))
+    delays = []
+    for _ in range(2):
+        [job] = run(queue.lease("w1"))
+        assert run(queue.fail(job["job_id"], "w1", "ошибка"))
+        stored = run(get_job(job["job_id"]))
+        assert stored.status == "queued" and stored.last_error == "ошибка"
+        delays.append(retry_delay(stored))
+        assert run(queue.lease("w1")) == []  # задержка еще не прошла
+        run(make_available(job["job_id"]))
+    assert delays == [RETRY_BASE_DELAY, RETRY_BASE_DELAY * 2]
+
+    [job] = run(queue.lease("w1"))
+    run(queue.fail(job["job_id"], "w1", "ошибка"))
+    assert run(get_job(job["job_id"])).status == "failed"
+    assert not run(queue.fail(job["job_id"], "w1"))
+
+def test_release_does_not_count_attempt(run):
+    queue = JobQueue()
+    run(queue.enqueue({"channel": "a"}))
+    [job] = run(queue.lease("w1"))
+    assert run(queue.release(job["job_id"], "w1"))
+    [job] = run(queue.lease("w1"))
+    assert job["attempts"] == 1
+
+def test_expired_lease_is_requeued(run):
+    queue = JobQueue()
+    run(queue.enqueue({"channel": "a"}))
+    run(queue.enqueue({"channel": "b"}, max_attempts=1))
+    jobs = run(queue.lease("w1", limit=2, visibility_timeout=-1))
+    # Воркер w1 пропал: задача a достается w2, у b попытки кончились
+    [job] = run(queue.lease("w2", limit=2))
+    assert job["payload"]["channel"] == "a" and job["attempts"] == 2
+    assert not run(queue.ack(job["job_id"], "w1"))
+    failed = next(job for job in jobs if job["payload"]["channel"] == "b")
+    assert run(get_job(failed["job_id"])).last_error == "lease expired"
+    assert run(queue.get_stats()) == {"leased": 1, "failed": 1}
+
+def test_parse_tasks_and_tasks_file_import(run, tmp_path):
+    assert task_dedupe_key({"channel": "a"}) == "crawl:a"
+    assert task_dedupe_key({"channel": "a", "type": "backfill"}) == "backfill:a"
+    assert run(enqueue_parse_task(1, "a"))
+    assert run(enqueue_parse_task(1, "a", task_type="backfill"))
+    assert not run(enqueue_parse_task(2, "a"))
+
+    path = tmp_path / "tasks.json"
+    path.write_text('[{"user_id": 1, "channel": "b", "status": "pending"},'
+                    ' {"user_id": 1, "channel": "c", "status": "done"},'
+                    ' {"user_id": 1, "channel": "a"}]', encoding="utf-8")
+    assert run(import_tasks_file(str(path))) == 1
+    assert run(import_tasks_file(str(tmp_path / "missing.json"))) == 0
+    jobs = run(job_queue.lease("w1", limit=10))
+    assert sorted((job["payload"]["channel"], job["payload"].get("type", "crawl")) for job in jobs) == [
+        ("a", "backfill"), ("a", "crawl"), ("b", "crawl")
+    ]
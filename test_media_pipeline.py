@@ -0,0 +1,79 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+from sqlalchemy import select
+
+import media_pipeline
+from bot.db import SessionLocal, Media
+from media_pipeline import MediaPipeline
+from rate_limiter import RateLimiter
+
+class FakeClient:
+    """download_media пишет картинку 2000x1000; файлы из broken не скачиваются"""
+    name = "media_test"
+
+    def __init__(self, broken=()):
+        self.downloads = []
+        self.broken = set(broken)
+
+    async def download_media(self, message, file_name):
+        self.downloads.append(message.photo.file_unique_id)
+        await asyncio.sleep(0.01)
+        if message.photo.file_unique_id in self.broken:
+            raise RuntimeError("сеть")
+        Image.new("RGB", (2000, 1000), "red").save(file_name, "JPEG")
+        return file_name
+
+def photo_message(message_id, unique_id):
+    return SimpleNamespace(id=message_id, photo=SimpleNamespace(file_id=f"f{message_id}", file_unique_id=unique_id,
+                                                                file_size=100), video=None, document=None)
+
+@pytest.fixture(autouse=True)
+def no_action_delays(monkeypatch):
+    monkeypatch.setattr(media_pipeline, "rate_limiter", RateLimiter(delays={}))
+
+async def download(pipeline, messages):
+    try:
+        tasks = [pipeline.submit(message, post_id=f"c1_{message.id}") for message in messages]
+        paths = [await task if task else None for task in tasks]
+        await pipeline.drain()
+        return paths
+    finally:
+        pipeline.close()
+
+def test_same_file_downloaded_once_and_resized(tmp_path):
+    client = FakeClient()
+    pipeline = MediaPipeline(client, media_dir=str(tmp_path), record_to_db=False, process_workers=1)
+    text_only = SimpleNamespace(id=3, photo=None, video=None, document=None)
+    paths = asyncio.run(download(pipeline, [photo_message(1, "u1"), photo_message(2, "u1"), text_only]))
+
+    assert client.downloads == ["u1"]
+    assert paths == [pipeline.path_for("u1"), pipeline.path_for("u1"), None]
+    assert pipeline.stats == {"downloaded": 1, "deduplicated": 1, "failed": 0}
+    with Image.open(pipeline.path_for("u1")) as img:
+        assert max(img.size) <= media_pipeline.MAX_IMAGE_SIZE[0]
+    assert os.path.exists(pipeline.thumb_path_for("u1"))
+
+    # Следующий запуск находит файл на диске
+    client = FakeClient()
+    pipeline = MediaPipeline(client, media_dir=str(tmp_path), record_to_db=False, process_workers=1)
+    assert asyncio.run(download(pipeline, [photo_message(4, "u1")])) == [pipeline.path_for("u1")]
+    assert client.downloads == [] and pipeline.stats["deduplicated"] == 1
+
+def test_failed_download_returns_none(tmp_path):
+    pipeline = MediaPipeline(FakeClient(broken={"u2"}), media_dir=str(tmp_path), record_to_db=False, process_workers=1)
+    assert asyncio.run(download(pipeline, [photo_message(1, "u2")])) == [None]
+    assert pipeline.stats["failed"] == 1
+
+def test_media_rows_written_once_per_post(run, tmp_path):
+    async def media_rows():
+        async with SessionLocal() as session:
+            return sorted((await session.execute(select(Media.post_id, Media.file_unique_id))).tuples())
+
+    for _ in range(2):
+        pipeline = MediaPipeline(FakeClient(), media_dir=str(tmp_path), record_to_db=True, process_workers=1)
+        run(download(pipeline, [photo_message(1, "u1"), photo_message(2, "u1")]))
+    assert run(media_rows()) == [("c1_1", "u1"), ("c1_2", "u1")]
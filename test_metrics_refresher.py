@@ -0,0 +1,98 @@
+import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+import userbot_stats
+from bot.db import SessionLocal, Post, PostLatestMetrics, PostRefresh, PostSnapshot
+from channel_ingest import REFRESH_SCHEDULE, get_next_refresh
+from rate_limiter import RateLimiter
+
+HOUR = datetime.timedelta(hours=1)
+
+class FakeApp:
+    """get_messages отдает просмотры из views; id вне views Telegram не вернул"""
+    name = "refresher_test"
+
+    def __init__(self, views, fail_channels=(), empty=()):
+        self.views = views
+        self.fail_channels = set(fail_channels)
+        self.empty = set(empty)
+        self.calls = []
+
+    async def get_messages(self, chat_id, message_ids):
+        self.calls.append((chat_id, sorted(message_ids)))
+        if chat_id in self.fail_channels:
+            raise RuntimeError("сеть")
+        return [
+            SimpleNamespace(id=message_id, empty=message_id in self.empty, views=self.views[message_id],
+                            reactions=None, forwards=0)
+            for message_id in message_ids if message_id in self.views
+        ]
+
+@pytest.fixture
+def fake_app(monkeypatch):
+    def install(app):
+        monkeypatch.setattr(userbot_stats, "app", app)
+        monkeypatch.setattr(userbot_stats, "rate_limiter", RateLimiter(delays={}))
+        return app
+    return install
+
+async def seed(posts):
+    """posts: (channel_id, message_id, возраст поста); все посты уже пора обновить"""
+    now = datetime.datetime.utcnow()
+    async with SessionLocal() as session:
+        for channel_id, message_id, age in posts:
+            post_id = f"{channel_id}_{message_id}"
+            session.add(Post(post_id=post_id, channel_id=channel_id, posted_at=now - age))
+            session.add(PostRefresh(post_id=post_id, channel_id=channel_id, message_id=message_id,
+                                    posted_at=now - age, stage=0, next_refresh_at=now - datetime.timedelta(seconds=1)))
+        await session.commit()
+
+async def schedule():
+    async with SessionLocal() as session:
+        return {row.post_id: row for row in (await session.execute(select(PostRefresh))).scalars()}
+
+async def latest_views():
+    async with SessionLocal() as session:
+        rows = await session.execute(select(PostLatestMetrics.post_id, PostLatestMetrics.views_count, PostLatestMetrics.is_final))
+        return {row.post_id: (row.views_count, row.is_final) for row in rows}
+
+async def snapshot_count():
+    async with SessionLocal() as session:
+        return len((await session.execute(select(PostSnapshot))).all())
+
+def test_next_refresh_steps_through_schedule():
+    posted_at = datetime.datetime(2025, 3, 3)
+    assert get_next_refresh(posted_at, posted_at) == (0, posted_at + REFRESH_SCHEDULE[0])
+    assert get_next_refresh(posted_at, posted_at + 2 * HOUR) == (1, posted_at + REFRESH_SCHEDULE[1])
+    assert get_next_refresh(posted_at, posted_at + REFRESH_SCHEDULE[-1]) == (len(REFRESH_SCHEDULE), None)
+
+def test_refresh_reschedules_finalizes_and_drops_missing(run, fake_app):
+    run(seed([("1", 1, 2 * HOUR), ("1", 2, 100 * HOUR), ("1", 3, 2 * HOUR), ("1", 4, 2 * HOUR)]))
+    app = fake_app(FakeApp({1: 150, 2: 900, 4: 0}, empty={4}))
+
+    result = run(userbot_stats.refresh_post_metrics())
+    assert result == {"refreshed": 2, "finalized": 1, "missing": 2}
+    assert app.calls == [(1, [1, 2, 3, 4])]
+    assert run(latest_views()) == {"1_1": (150, False), "1_2": (900, True)}
+
+    # Дальше по расписанию остается только молодой пост, на следующей ступени
+    rows = run(schedule())
+    assert list(rows) == ["1_1"] and rows["1_1"].stage == 1
+    assert rows["1_1"].next_refresh_at == rows["1_1"].posted_at + REFRESH_SCHEDULE[1]
+    assert run(snapshot_count()) == 2
+
+def test_failed_channel_backs_off(run, fake_app):
+    run(seed([("1", 1, 2 * HOUR), ("2", 1, 2 * HOUR)]))
+    fake_app(FakeApp({1: 10}, fail_channels={2}))
+    started = datetime.datetime.utcnow()
+
+    assert run(userbot_stats.refresh_post_metrics())["refreshed"] == 1
+    rows = run(schedule())
+    assert rows["2_1"].stage == 0 and rows["2_1"].next_refresh_at >= started + userbot_stats.REFRESH_FAILURE_BACKOFF
+    # Ни один пост не подошел снова: следующий проход ничего не запрашивает
+    app = fake_app(FakeApp({1: 20}))
+    assert run(userbot_stats.refresh_post_metrics()) == {"refreshed": 0, "finalized": 0, "missing": 0}
+    assert app.calls == []
@@ -0,0 +1,79 @@
+import datetime
+import random
+
+from sqlalchemy import select
+
+from bot.db import SessionLocal, Post, PostLshBucket, Creative, upsert_insert
+from near_duplicates import BANDS, DuplicateIndex, bucket_keys, signatures, similarity
+
+WORDS = ("проект идея команда город выставка художник книга история результат неделя работа "
+         "время деньги рынок клиент продукт сервис вопрос ответ опыт путь задача").split()
+
+def words(seed, count=40):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+def row(post_id, channel_id="c1", is_ad=False):
+    return {"post_id": post_id, "channel_id": channel_id, "posted_at": datetime.datetime(2025, 3, 3),
+            "is_ad": is_ad, "body": None}
+
+async def store(index, posts):
+    """Сохраняет посты так же, как save_posts_batch: assign, upsert постов, save"""
+    rows = [row(post_id, channel_id, is_ad) for post_id, channel_id, is_ad, _ in posts]
+    async with SessionLocal() as session:
+        pending = await index.assign(session, rows, [text for *_, text in posts])
+        stmt = upsert_insert(Post).values(rows)
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=[Post.post_id],
+            set_={field: stmt.excluded[field] for field in ("minhash", "dup_cluster_id")}
+        ))
+        await index.save(session, pending)
+        await session.commit()
+    return {post["post_id"]: post["dup_cluster_id"] for post in rows}
+
+async def buckets(post_id):
+    async with SessionLocal() as session:
+        return set((await session.execute(
+            select(PostLshBucket.bucket).where(PostLshBucket.post_id == post_id)
+        )).scalars())
+
+async def creatives():
+    async with SessionLocal() as session:
+        return sorted((await session.execute(select(Creative.channel_id, Creative.cluster_id))).all())
+
+def test_signatures_are_stable_and_skip_short_texts():
+    first, second, short = signatures([words(1), words(1), "коротко"])
+    assert (first == second).all() and short is None
+    assert similarity(first, signatures([words(2)])[0]) < 0.5
+
+def test_near_copies_join_first_post_cluster(run):
+    index = DuplicateIndex()
+    base = words(1)
+    clusters = run(store(index, [("p1", "c1", False, base), ("p2", "c1", False, words(2))]))
+    assert clusters == {"p1": "p1", "p2": "p2"}
+
+    # Копия с одним измененным словом, из следующей пачки и из той же пачки
+    clusters = run(store(index, [("p3", "c2", False, base + " подробнее"), ("p4", "c2", False, base + " еще")]))
+    assert clusters == {"p3": "p1", "p4": "p1"}
+    assert len(run(buckets("p1"))) == BANDS
+
+def test_ad_repeated_in_other_channel_creates_creatives(run):
+    index = DuplicateIndex()
+    text = words(3) + " https://t.me/brand"
+    run(store(index, [("p1", "c1", True, text)]))
+    run(store(index, [("p2", "c2", True, text)]))
+    assert run(creatives()) == [("c1", "p1"), ("c2", "p1")]
+
+def test_resaved_text_replaces_bucket_rows(run):
+    index = DuplicateIndex()
+    run(store(index, [("p1", "c1", False, words(1))]))
+    run(store(index, [("p1", "c1", False, words(2))]))
+    assert run(buckets("p1")) == set(bucket_keys(signatures([words(2)])[0]))
+
+    # Старый текст больше не находит p1 как дубль
+    clusters = run(store(index, [("p2", "c2", False, words(1))]))
+    assert clusters == {"p2": "p2"}
+
+    # Короткий текст без подписи убирает все корзины поста
+    run(store(index, [("p1", "c1", False, "коротко")]))
+    assert run(buckets("p1")) == set()
@@ -0,0 +1,84 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from pyrogram.errors import FloodWait
+
+import rate_limiter as limiter_module
+from rate_limiter import AccountRateLimiter, RateLimiter, TokenBucket
+
+LIMITS = {"max_requests_per_hour": 3600, "max_requests_per_day": 86400,
+          "max_posts_per_hour": 1, "max_posts_per_day": 10}
+
+def test_bucket_refills_at_rate():
+    bucket = TokenBucket(10, 10)  # токен в секунду
+    bucket.consume(10, now=bucket.updated)
+    start = bucket.updated
+    assert bucket.time_until_available(now=start) == 1.0
+    assert bucket.time_until_available(now=start + 0.5) == pytest.approx(0.5)
+    assert bucket.time_until_available(now=start + 100) == 0.0
+    # Больше capacity не копится
+    assert bucket.tokens == 10
+
+def test_action_delay_and_post_limits():
+    limiter = AccountRateLimiter("a1", LIMITS, {"get_chat_history": 3})
+    asyncio.run(limiter.acquire("get_chat_history"))
+    assert limiter.time_until_free("get_chat_history") == pytest.approx(3, abs=0.1)
+    assert limiter.time_until_free("get_chat") == 0.0
+    asyncio.run(limiter.acquire("send_message"))
+    assert limiter.time_until_free("send_message") == pytest.approx(3600, abs=1)
+
+def test_flood_wait_blocks_account():
+    limiter = AccountRateLimiter("a1", LIMITS, {})
+    limiter.report_flood_wait(10)
+    assert limiter.time_until_free("get_chat") == pytest.approx(10 + limiter_module.FLOOD_WAIT_MARGIN, abs=0.1)
+
+def test_call_retries_short_flood_wait(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    slept = []
+
+    async def sleep(seconds):
+        slept.append(seconds)
+        clock.now += seconds
+    monkeypatch.setattr(limiter_module.time, "monotonic", lambda: clock.now)
+    monkeypatch.setattr(limiter_module.asyncio, "sleep", sleep)
+
+    calls = []
+
+    async def get_chat(chat_id):
+        calls.append(chat_id)
+        if len(calls) == 1:
+            raise FloodWait(value=5)
+        return "chat"
+
+    limiter = RateLimiter(LIMITS, {})
+    assert asyncio.run(limiter.call("a1", "get_chat", get_chat, "chan")) == "chat"
+    assert calls == ["chan", "chan"] and slept == [5 + limiter_module.FLOOD_WAIT_MARGIN]
+
+def test_call_raises_long_flood_wait():
+    async def get_chat(chat_id):
+        raise FloodWait(value=limiter_module.MAX_FLOOD_SLEEP + 1)
+
+    limiter = RateLimiter(LIMITS, {})
+    with pytest.raises(FloodWait):
+        asyncio.run(limiter.call("a1", "get_chat", get_chat, "chan"))
+    assert limiter.time_until_free("a1", "get_chat") > limiter_module.MAX_FLOOD_SLEEP
+
+def test_iter_history_pages_through_limiter():
+    requests = []
+
+    class Client:
+        async def get_chat_history(self, chat_id, limit, offset_id):
+            requests.append((limit, offset_id))
+            start = offset_id - 1 if offset_id else 10
+            for message_id in range(start, max(start - limit, 0), -1):
+                yield SimpleNamespace(id=message_id)
+
+    async def collect(**kwargs):
+        return [msg.id async for msg in RateLimiter(LIMITS, {}).iter_history("a1", Client(), 1, page_size=4, **kwargs)]
+
+    assert asyncio.run(collect()) == list(range(10, 0, -1))
+    assert requests == [(4, 0), (4, 7), (4, 3)]
+    requests.clear()
+    assert asyncio.run(collect(limit=6, offset_id=9)) == [8, 7, 6, 5, 4, 3]
+    assert requests == [(4, 9), (2, 5)]
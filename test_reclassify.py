@@ -0,0 +1,71 @@
+import datetime
+import json
+
+import pytest
+from sqlalchemy import select
+
+import reclassify
+from bot.db import SessionLocal, Post
+from post_classifier import CLASSIFIER_VERSION
+
+@pytest.fixture
+def classified(monkeypatch):
+    """Подменяет классификатор: формат list у текстов с «1.», тег из первого слова"""
+    texts = []
+
+    async def classify_many_async(batch, min_batch=0):
+        texts.extend(batch)
+        return [{"format": "list" if "1." in text else "other", "cta": None, "is_ad": False,
+                 "topic": None, "tags": [text.split()[0]]} for text in batch]
+    monkeypatch.setattr(reclassify, "classify_many_async", classify_many_async)
+    return texts
+
+async def seed(posts):
+    """posts: (post_id, body, format, tags, classifier_version)"""
+    async with SessionLocal() as session:
+        for post_id, body, format, tags, version in posts:
+            session.add(Post(post_id=post_id, channel_id="c1", posted_at=datetime.datetime(2025, 3, 3), body=body,
+                             format=format, cta=None, is_ad=False, tags=tags, classifier_version=version))
+        await session.commit()
+
+async def labels():
+    async with SessionLocal() as session:
+        rows = await session.execute(select(Post.post_id, Post.format, Post.classifier_version).order_by(Post.post_id))
+        return [tuple(row) for row in rows]
+
+def test_load_checkpoint_ignores_other_version(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    assert reclassify.load_checkpoint(path) is None
+    reclassify.save_checkpoint(path, {"version": "old", "last_id": "p1", "scanned": 1, "updated": 0})
+    assert reclassify.load_checkpoint(path) is None
+    reclassify.save_checkpoint(path, {"version": CLASSIFIER_VERSION, "last_id": "p1", "scanned": 1, "updated": 0})
+    assert reclassify.load_checkpoint(path)["last_id"] == "p1"
+
+def test_updates_only_changed_labels(run, classified, tmp_path):
+    run(seed([("p1", "1. пункт", "other", '["1."]', None),
+              ("p2", "просто текст", "other", '["просто"]', "old"),
+              ("p3", "1. новое", "list", '["1."]', CLASSIFIER_VERSION)]))
+    path = str(tmp_path / "checkpoint.json")
+
+    result = run(reclassify.reclassify(chunk_size=1, workers=2, checkpoint_path=path))
+    assert (result["scanned"], result["updated"], result["last_id"], result["done"]) == (2, 1, "p2", True)
+    # Пост уже с текущей версией не перечитывается
+    assert classified == ["1. пункт", "просто текст"]
+    assert run(labels()) == [("p1", "list", CLASSIFIER_VERSION), ("p2", "other", CLASSIFIER_VERSION),
+                             ("p3", "list", CLASSIFIER_VERSION)]
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f)["done"]
+
+def test_resumes_after_checkpoint(run, classified, tmp_path):
+    run(seed([(f"p{i}", f"текст {i}", None, None, None) for i in range(1, 6)]))
+    path = str(tmp_path / "checkpoint.json")
+    reclassify.save_checkpoint(path, {"version": CLASSIFIER_VERSION, "last_id": "p3", "scanned": 3, "updated": 3})
+
+    result = run(reclassify.reclassify(chunk_size=2, workers=1, checkpoint_path=path))
+    assert classified == ["текст 4", "текст 5"]
+    assert (result["scanned"], result["updated"], result["last_id"]) == (5, 5, "p5")
+
+    # --restart игнорирует checkpoint, но доклассифицирует только оставшиеся посты со старой версией
+    result = run(reclassify.reclassify(chunk_size=2, workers=1, checkpoint_path=path, restart=True))
+    assert classified == ["текст 4", "текст 5", "текст 1", "текст 2", "текст 3"]
+    assert (result["scanned"], result["updated"], result["last_id"]) == (3, 3, "p3")
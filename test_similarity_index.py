@@ -0,0 +1,73 @@
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+from similarity_index import KEEP_GENERATIONS, SimilarityIndex, vectorize
+
+TEXTS = {
+    "p1": "Как продвигать телеграм канал без бюджета: пять рабочих способов",
+    "p2": "Рецепт домашнего хлеба на закваске с хрустящей корочкой",
+    "p3": "Продвижение телеграм канала: рабочие способы без вложений",
+    "p4": "Выставка современного искусства открылась в городе",
+}
+
+def filled(path, **kwargs):
+    index = SimilarityIndex(str(path), **kwargs)
+    index.add_many(TEXTS.items())
+    return index
+
+def test_vectorize_uses_stems_and_skips_short_words():
+    terms, weights = vectorize("Продвижение и продвигать в 2024")
+    assert len(terms) == 1 and weights[0] == pytest.approx(1 + np.log(2))
+    assert len(vectorize("и в на")[0]) == 0
+
+def test_search_before_and_after_save(tmp_path):
+    index = filled(tmp_path)
+    assert not index.add("p1", TEXTS["p1"]) and not index.add("p5", "и в")
+    before = index.search(TEXTS["p1"], k=2, exclude={"p1"})
+    assert before[0][0] == "p3"
+
+    index.save()
+    assert index.pending == [] and index.generation == 1
+    after = index.search(TEXTS["p1"], k=2, exclude={"p1"})
+    assert [post_id for post_id, _ in after] == [post_id for post_id, _ in before]
+    assert after[0][1] == pytest.approx(before[0][1], rel=1e-5)
+
+def test_load_from_disk_in_another_process(tmp_path):
+    filled(tmp_path).save()
+    loaded = SimilarityIndex(str(tmp_path))
+    loaded.load()
+    assert loaded.size == len(TEXTS) and loaded.known == set(TEXTS)
+    assert loaded.search(TEXTS["p3"], k=1, exclude={"p3"})[0][0] == "p1"
+    # Уже записанные посты повторно не добавляются
+    assert loaded.add_many(TEXTS.items()) == 0
+
+def test_concurrent_writers_keep_each_others_documents(tmp_path):
+    first, second = SimilarityIndex(str(tmp_path)), SimilarityIndex(str(tmp_path))
+    first.add("a1", TEXTS["p1"])
+    second.add("b1", TEXTS["p2"])
+    second.add("a1", TEXTS["p1"])  # тот же пост собрал и второй процесс
+    first.save()
+    second.save()
+
+    reader = SimilarityIndex(str(tmp_path))
+    reader.load()
+    assert sorted(reader.post_ids) == ["a1", "b1"] and reader.generation == 2
+
+def test_maybe_save_and_old_generation_cleanup(tmp_path):
+    index = SimilarityIndex(str(tmp_path), save_every=2)
+    generations = []
+    for post_id in ("p1", "p2", "p3"):
+        index.add(post_id, TEXTS[post_id])
+        asyncio.run(index.maybe_save())
+        generations.append((index.generation, len(index.pending)))
+    # Поколение пишется, только когда накопилось save_every документов
+    assert generations == [(0, 1), (1, 0), (1, 1)]
+
+    for i in range(KEEP_GENERATIONS + 2):
+        index.add(f"x{i}", f"{TEXTS['p4']} номер{i}")
+        index.save()
+    kept = sorted(int(name) for name in os.listdir(tmp_path) if name.isdigit())
+    assert kept == list(range(index.generation - KEEP_GENERATIONS, index.generation + 1))
@@ -0,0 +1,162 @@
+"""
+Векторизованная статистика по пачке постов (NumPy)
+
+Все тексты пачки склеиваются через "\n" и переводятся в массив кодов символов.
+Классы символов считаются по таблицам поиска, построенным из тех же регулярок,
+что и раньше ([^\w\s], \w), и по диапазону кодов А-Я, поэтому счетчики
+совпадают с re.findall.
+Счетчики по постам — np.bincount по номеру текста для позиций, где маска True
+(маски редкие, так дешевле накопленных сумм по всей пачке).
+"""
+
+import re
+from typing import Dict, List, Optional
+
+import numpy as np
+
+MAX_CODEPOINT = 0x110000
+SEPARATOR = "\n"  # Пробельный символ: не слово и не "эмодзи", на счетчики не влияет
+TEXT_FIELDS = ("length", "lines", "emoji", "caps", "links", "mentions")
+
+_tables: Dict[str, np.ndarray] = {}
+
+def _table_from_regex(pattern: str) -> np.ndarray:
+    """Таблица по всем кодам Unicode: True, если символ подходит под класс pattern"""
+    table = np.zeros(MAX_CODEPOINT, dtype=bool)
+    chunk = 0x10000
+    for start in range(0, MAX_CODEPOINT, chunk):
+        chars = "".join(map(chr, range(start, start + chunk)))
+        positions = [match.start() for match in re.finditer(pattern, chars)]
+        table[np.asarray(positions, dtype=np.int64) + start] = True
+    return table
+
+def get_table(name: str) -> np.ndarray:
+    """Ленивая таблица класса символов (строится один раз, ~1 МБ)"""
+    table = _tables.get(name)
+    if table is None:
+        if name == "emoji":
+            table = _table_from_regex(r'[^\w\s]')
+        elif name == "word":
+            table = _table_from_regex(r'\w')
+        else:
+            raise KeyError(name)
+        _tables[name] = table
+    return table
+
+def _codes(texts: List[str]):
+    """Коды символов склеенной пачки, номер текста для каждой позиции и длины текстов
+
+    Разделителям между текстами достается номер len(texts), в счетчики они не попадают.
+    """
+    count = len(texts)
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=count)
+    joined = SEPARATOR.join(texts)
+    codes = np.frombuffer(joined.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+    segments = np.repeat(np.arange(count, dtype=np.int32), lengths + 1)[:len(codes)]
+    if count > 1:
+        separators = np.cumsum(lengths[:-1] + 1) - 1
+        segments[separators] = count
+    return codes, segments, lengths
+
+def _segment_sums(mask: np.ndarray, segments: np.ndarray, count: int) -> np.ndarray:
+    """Количество True в mask по каждому тексту"""
+    return np.bincount(segments[mask], minlength=count + 1)[:count]
+
+def _literal_mask(codes: np.ndarray, literal: str) -> np.ndarray:
+    """True в позициях, с которых начинается literal"""
+    mask = np.zeros(len(codes), dtype=bool)
+    size = len(literal)
+    if len(codes) < size:
+        return mask
+    window = np.ones(len(codes) - size + 1, dtype=bool)
+    for offset, char in enumerate(literal):
+        window &= codes[offset:len(codes) - size + 1 + offset] == ord(char)
+    mask[:len(window)] = window
+    return mask
+
+def reaction_total(reactions) -> int:
+    """Сумма реакций: словарь {эмодзи: количество} или уже готовое число"""
+    if not reactions:
+        return 0
+    if isinstance(reactions, dict):
+        return sum(reactions.values())
+    return int(reactions)
+
+def encode(texts: List[Optional[str]]):
+    """Коды символов пачки для text_arrays(..., encoded=...), если они нужны и вызывающему"""
+    return _codes([text or "" for text in texts])
+
+def text_arrays(texts: List[Optional[str]], fields=TEXT_FIELDS, encoded=None) -> Dict[str, np.ndarray]:
+    """Счетчики по текстам: длина, строки, эмодзи, заглавные, ссылки, упоминания
+
+    fields ограничивает набор счетчиков, длина считается всегда. encoded — готовый
+    результат encode(texts), чтобы не кодировать пачку второй раз.
+    """
+    texts = [text or "" for text in texts]
+    count = len(texts)
+    codes, segments, lengths = encoded if encoded is not None else _codes(texts)
+    stats = {"length": lengths}
+
+    if "emoji" in fields:
+        stats["emoji"] = _segment_sums(get_table("emoji")[codes], segments, count)
+    if "caps" in fields:
+        stats["caps"] = _segment_sums((codes >= ord("А")) & (codes <= ord("Я")), segments, count)
+    if "lines" in fields:
+        newlines = _segment_sums(codes == ord("\n"), segments, count)
+        stats["lines"] = np.where(lengths > 0, newlines + 1, 0)
+
+    if "mentions" in fields:
+        # Упоминание — "@" и сразу символ слова (как r'@\w+')
+        mention_mask = np.zeros(len(codes), dtype=bool)
+        if len(codes) > 1:
+            mention_mask[:-1] = (codes[:-1] == ord("@")) & get_table("word")[codes[1:]]
+        stats["mentions"] = _segment_sums(mention_mask, segments, count)
+
+    if "links" in fields:
+        # Ссылки: все "://" плюс "t.me/" без схемы перед ним
+        scheme_mask = _literal_mask(codes, "://")
+        bare_tme = _literal_mask(codes, "t.me/")
+        bare_tme[1:] &= codes[:-1] != ord("/")
+        stats["links"] = _segment_sums(scheme_mask | bare_tme, segments, count)
+
+    return stats
+
+def post_arrays(posts: List[Dict]) -> Dict[str, np.ndarray]:
+    """text_arrays плюс просмотры, реакции и наличие картинки для списка постов"""
+    stats = text_arrays([post.get("text") for post in posts])
+    stats["views"] = np.fromiter((post.get("views") or 0 for post in posts), dtype=np.int64, count=len(posts))
+    stats["reactions"] = np.fromiter(
+        (reaction_total(post.get("reactions")) for post in posts), dtype=np.int64, count=len(posts)
+    )
+    stats["has_image"] = np.fromiter((bool(post.get("has_image")) for post in posts), dtype=bool, count=len(posts))
+    return stats
+
+def ratio(counts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """counts / lengths, для пустых текстов 0"""
+    result = np.zeros(len(counts), dtype=np.float64)
+    np.divide(counts, lengths, out=result, where=lengths > 0)
+    return result
+
+def style_ratios(stats: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Доля эмодзи и заглавных букв в каждом тексте"""
+    return {
+        "emoji_ratio": ratio(stats["emoji"], stats["length"]),
+        "caps_ratio": ratio(stats["caps"], stats["length"])
+    }
+
+def over_threshold(values: np.ndarray, threshold: float) -> np.ndarray:
+    return values > threshold
+
+def averages(stats: Dict[str, np.ndarray], fields=("views", "reactions", "length", "emoji", "links")) -> Dict[str, float]:
+    """Средние по пачке (0 для пустой пачки)"""
+    return {
+        field: float(stats[field].mean()) if len(stats[field]) else 0.0
+        for field in fields if field in stats
+    }
+
+def top_indices(values: np.ndarray, n: int) -> List[int]:
+    """Индексы n наибольших значений по убыванию (при равенстве — в исходном порядке)"""
+    if not len(values):
+        return []
+    order = np.argsort(-values, kind="stable")
+    return order[:n].tolist()
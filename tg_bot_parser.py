@@ -16,7 +16,7 @@ from subscription_service import subscription_service
 from payment_service import payment_service
 from channel_analyzer import channel_analyzer
 
-TASKS_FILE = "tasks.json"
+# Задачи парсинга ставятся в очередь в БД: job_queue.enqueue_parse_task()
 RESULTS_DIR = "results"
 
 os.makedirs(RESULTS_DIR, exist_ok=True)
@@ -932,20 +932,6 @@ async def growth_tips(client: Client, message: Message):
         "введите username канала (например: @mychannel) или отправьте ссылку на канал."
     )
 
-# --- Вспомогательные функции ---
-def load_tasks():
-    """Загружает задачи из файла"""
-    try:
-        with open(TASKS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
-
-def save_tasks(tasks):
-    """Сохраняет задачи в файл"""
-    with open(TASKS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(tasks, f, ensure_ascii=False, indent=2)
-
 # --- Обработка текстовых сообщений для PRO функций ---
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка текстовых сообщений для PRO функций"""
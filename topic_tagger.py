@@ -0,0 +1,198 @@
+"""
+Определение темы поста по ключевым словам категорий config.CATEGORIES
+
+Ключевые слова всех категорий собраны в один словарь основа -> категории.
+Текст разбивается на слова один раз, каждое слово ищется в словаре по своим
+префиксам тех длин, что встречаются среди основ, поэтому работа пропорциональна
+числу слов, а не числу категорий и ключевых слов. Основы короче
+MIN_PREFIX_LENGTH ("ai", "it", "smm") совпадают только с целым словом, а
+основы короче SHORT_STEM_LENGTH ("акци", "проз") — только со словами, где
+после основы не больше MAX_ENDING_LENGTH букв окончания: "акции", но не
+"акционер", "проза", но не "прозрачный".
+"""
+
+import json
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+from config import CATEGORIES
+
+# Основы слов в нижнем регистре, "ё" записывается как "е"
+TOPIC_KEYWORDS = {
+    "Маркетинг и продажи": [
+        "маркетинг", "маркетолог", "продаж", "продава", "воронк", "лидогенерац", "конверси",
+        "клиент", "покупател", "оффер", "upsell", "crm", "b2b", "b2c", "ltv", "cac"
+    ],
+    "Бизнес и стартапы": [
+        "бизнес", "стартап", "предприним", "основател", "инвестор", "выручк", "прибыл",
+        "компани", "масштабир", "франшиз", "венчур", "startup", "founder"
+    ],
+    "Психология и саморазвитие": [
+        "психолог", "психик", "саморазвит", "эмоци", "тревог", "выгоран", "самооценк",
+        "осознанн", "терапи", "отношени", "травм", "личностн"
+    ],
+    "Образование и курсы": [
+        "образовани", "курс", "обучени", "учеб", "урок", "студент", "школ", "школьн", "вебинар",
+        "лекци", "экзамен", "преподава", "универ", "егэ"
+    ],
+    "Технологии и IT": [
+        "технолог", "гаджет", "смартфон", "iphone", "android", "процессор", "компьютер",
+        "ноутбук", "софт", "айти", "кибербезопасн", "облачн", "it"
+    ],
+    "Финансы и инвестиции": [
+        "финанс", "инвестиц", "инвестир", "акци", "акционер", "облигаци", "дивиденд", "бирж", "биржев",
+        "вклад", "вкладыва", "кредит", "ипотек", "крипт", "криптовалют", "биткоин", "bitcoin", "рубл", "доллар", "портфел"
+    ],
+    "Мотивация и продуктивность": [
+        "мотиваци", "продуктивн", "привычк", "дисциплин", "тайм-менеджмент", "прокрастинац",
+        "фокус", "фокусир", "целеустремл", "планирован", "достига", "успех"
+    ],
+    "Юмор и мемы": [
+        "юмор", "юморист", "мем", "мемы", "мемас", "шутк", "смешн", "анекдот", "прикол", "ахаха", "хаха", "лол", "ржу", "угар"
+    ],
+    "Путешествия и география": [
+        "путешеств", "туризм", "турист", "поездк", "отпуск", "страна", "перелет", "авиабилет",
+        "отел", "виза", "маршрут", "географ", "travel"
+    ],
+    "Здоровье и спорт": [
+        "здоров", "спорт", "спортив", "спортсмен", "тренировк", "фитнес", "бег", "зож", "питани", "врач", "медицин",
+        "иммунитет", "сон", "похуд", "похуден", "мышц", "йог"
+    ],
+    "Книги и литература": [
+        "книг", "литератур", "писател", "роман", "поэзи", "поэтесс", "поэтов", "стих", "автор", "чтени",
+        "библиотек", "издательств", "проз"
+    ],
+    "Кино и сериалы": [
+        "фильм", "кино", "сериал", "режиссер", "актер", "актрис", "премьер", "netflix",
+        "трейлер", "оскар", "кинотеатр", "сезон"
+    ],
+    "Новости и события": [
+        "новост", "сообща", "заявил", "произошл", "событи", "экстренн", "официальн", "срочн",
+        "правительств", "президент", "выбор"
+    ],
+    "Дизайн и креатив": [
+        "дизайн", "креатив", "логотип", "шрифт", "типограф", "иллюстрац", "figma", "фигм",
+        "ux", "ui", "брендинг", "визуал", "палитр"
+    ],
+    "Личный бренд и блогинг": [
+        "блог", "блогер", "бренд", "аудитори", "подписчик", "охват", "инфлюенсер",
+        "репутац", "экспертн", "сторис"
+    ],
+    "Мода и стиль": [
+        "модн", "стил", "стильн", "одежд", "гардероб", "платье", "обув", "коллекци", "тренд", "трендов",
+        "fashion", "аксессуар", "бьюти", "макияж"
+    ],
+    "Еда и рецепты": [
+        "рецепт", "еда", "блюд", "готовить", "приготов", "кухн", "ресторан", "вкусн",
+        "ингредиент", "завтрак", "обед", "ужин", "выпечк", "десерт", "кофе"
+    ],
+    "Игры и гейминг": [
+        "гейм", "игров", "геймер", "киберспорт", "консол", "playstation", "xbox", "nintendo",
+        "steam", "стрим", "видеоигр", "dota", "cs2"
+    ],
+    "Музыка и культура": [
+        "музык", "песн", "альбом", "концерт", "исполнител", "трек", "культур", "театр", "театрал",
+        "выставк", "музе", "галере", "художник", "живопис", "картин", "искусств", "арт"
+    ],
+    "Питомцы и животные": [
+        "питом", "животн", "кошк", "кот", "котик", "собак", "пес", "щенк", "щенок", "котят",
+        "ветеринар", "корм", "приют", "зоопарк"
+    ],
+    "AI / ChatGPT / нейросети": [
+        "нейросет", "нейронк", "chatgpt", "gpt", "openai", "midjourney", "промпт", "prompt",
+        "llm", "искусственн", "интеллект", "машинн", "ai", "ии"
+    ],
+    "Разработка и кодинг": [
+        "разработ", "программир", "программист", "код", "кодинг", "python", "javascript", "backend",
+        "frontend", "github", "api", "фреймворк", "алгоритм", "баг", "деплой", "sql"
+    ],
+    "Таргет и реклама": [
+        "таргет", "таргетолог", "реклам", "объявлени", "креатив", "cpm", "cpc", "ctr",
+        "бюджет", "посев", "закуп", "рекламодател"
+    ],
+    "SMM / ведение соцсетей": [
+        "smm", "соцсет", "контент-план", "инстаграм", "instagram", "вконтакт", "тикток",
+        "tiktok", "reels", "рилс", "телеграм", "telegram", "постинг", "вовлечен"
+    ],
+    "Контент-маркетинг": [
+        "контент", "контент-маркетинг", "копирайт", "копирайтер", "сторителлинг", "редактор",
+        "статья", "статей", "рассылк", "seo", "лонгрид", "заголовк"
+    ]
+}
+
+MIN_PREFIX_LENGTH = 4  # Основы короче совпадают только с целым словом
+SHORT_STEM_LENGTH = 6  # Основы короче совпадают только со словом основа + окончание
+MAX_ENDING_LENGTH = 3  # Самое длинное окончание после короткой основы ("акциями")
+TOPIC_MIN_SCORE = 1  # Сколько совпадений нужно, чтобы назначить тему
+MAX_TAGS = 5  # Сколько слов поста сохраняем в tags
+
+WORD_RE = re.compile(r"[\w-]+")
+
+class TopicTagger:
+    def __init__(self, keywords: Dict[str, List[str]] = TOPIC_KEYWORDS, categories: List[str] = CATEGORIES):
+        # Неизвестная категория в словаре — опечатка, лучше упасть при импорте
+        unknown = set(keywords) - set(categories)
+        if unknown:
+            raise ValueError(f"Категорий нет в config.CATEGORIES: {sorted(unknown)}")
+
+        self.categories = [category for category in categories if category in keywords]
+        self.prefixes: Dict[str, List[int]] = {}
+        self.words: Dict[str, List[int]] = {}
+        for index, category in enumerate(self.categories):
+            for keyword in keywords[category]:
+                stem = keyword.lower().replace("ё", "е")
+                target = self.prefixes if len(stem) >= MIN_PREFIX_LENGTH else self.words
+                bucket = target.setdefault(stem, [])
+                if index not in bucket:
+                    bucket.append(index)
+        self.lengths = sorted({len(stem) for stem in self.prefixes})
+
+    def tokenize(self, text: str) -> List[str]:
+        return WORD_RE.findall(text.lower().replace("ё", "е"))
+
+    def lookup(self, token: str) -> List[int]:
+        """Категории, ключевые слова которых совпали с токеном"""
+        found = self.words.get(token, [])
+        for length in self.lengths:
+            if length > len(token):
+                break
+            if length < SHORT_STEM_LENGTH and len(token) - length > MAX_ENDING_LENGTH:
+                continue
+            hits = self.prefixes.get(token[:length])
+            if hits:
+                found = found + hits
+        return found
+
+    def scores(self, text: str) -> tuple:
+        """Счет каждой категории и совпавшие слова поста"""
+        scores = Counter()
+        matched = Counter()
+        for token in self.tokenize(text):
+            hits = self.lookup(token)
+            if hits:
+                # Слово считается категории один раз, даже если совпало несколько основ
+                scores.update(set(hits))
+                matched[token] += 1
+        return scores, matched
+
+    def tag(self, text: Optional[str]) -> Dict:
+        """Тема поста (или None) и до MAX_TAGS совпавших слов, частые первыми"""
+        if not text:
+            return {"topic": None, "tags": []}
+
+        scores, matched = self.scores(text)
+        topic = None
+        if scores:
+            (index, best), *rest = scores.most_common(2)
+            # При равном счете двух категорий тему не угадываем
+            if best >= TOPIC_MIN_SCORE and (not rest or rest[0][1] < best):
+                topic = self.categories[index]
+        return {"topic": topic, "tags": [word for word, _ in matched.most_common(MAX_TAGS)]}
+
+def tags_column(tags: List[str]) -> Optional[str]:
+    """Значение колонки posts.tags: JSON-список или None"""
+    return json.dumps(tags, ensure_ascii=False) if tags else None
+
+# Глобальный экземпляр определителя темы
+topic_tagger = TopicTagger()
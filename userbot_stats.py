@@ -4,6 +4,8 @@ import time
 import asyncio
 import re
 import uuid
+import signal
+import socket
 import datetime
 from pyrogram import Client
 from tqdm import tqdm
@@ -20,298 +22,169 @@ ACCOUNTS = [
     # Добавьте до 15 аккаунтов
 ]
 
-# --- Форматы постов ---
-POST_FORMATS = {
-    "list": {
-        "name": "Список",
-        "patterns": [r'\d+\.', r'[-•]', r'во-первых', r'далее'],
-        "conditions": ["3+ строк с похожим шаблоном"]
-    },
-    "story": {
-        "name": "История", 
-        "patterns": [r'однажды', r'я помню', r'вчера', r'когда-то'],
-        "conditions": ["нарратив", "личный рассказ", "временные указания"]
-    },
-    "analytics": {
-        "name": "Аналитика",
-        "patterns": [r'по данным', r'рост', r'%', r'исследование'],
-        "conditions": ["факты", "цифры", "источники", "графики"]
-    },
-    "opinion": {
-        "name": "Мнение/позиция",
-        "patterns": [r'мне кажется', r'по моему мнению', r'я думаю'],
-        "conditions": ["субъективные утверждения", "оценка событий"]
-    },
-    "howto": {
-        "name": "Инструкция",
-        "patterns": [r'сделай', r'настрой', r'скачай', r'шаг \d+'],
-        "conditions": ["последовательные действия", "повелительное наклонение"]
-    },
-    "news": {
-        "name": "Новость",
-        "patterns": [r'произошло', r'в \d{4}', r'сегодня', r'по сообщениям'],
-        "conditions": ["дата/время", "событие", "краткость"]
-    },
-    "motivation": {
-        "name": "Вдохновение",
-        "patterns": [r'ты можешь', r'поверь в себя', r'не сдавайся'],
-        "conditions": ["пафос", "мотивационные слова", "призыв к действию"]
-    },
-    "fun": {
-        "name": "Развлечение/юмор",
-        "patterns": [r'лол', r'ахаха', r'мем', r'прикол'],
-        "conditions": ["шутки", "неформальный стиль", "эмодзи"]
-    },
-    "quote": {
-        "name": "Цитата",
-        "patterns": [r'—', r'сказал', r'цитата'],
-        "conditions": ["кавычки", "имя автора", "меньше 3 строк"]
-    }
-}
-
-# --- CTA паттерны ---
-CTA_PATTERNS = [
-    r'подпишись', r'следи за', r'присоединяйся', r'жми подписаться',
-    r'пиши в комменты', r'оцени', r'смотри дальше', r'сохрани',
-    r'жми на ссылку', r'а ты как думаешь\?', r'пиши \+ если полезно',
-    r'что скажешь\?', r'читай', r'узнай', r'начни', r'перейди',
-    r'жми', r'вступай', r'переходи сюда', r'канал', r'бот'
-]
-
-# --- Детекция рекламных постов ---
-AD_DETECTION = {
-    "external_links": [r'https://', r't\.me/', r'@\w+', r'tg://', r'bit\.ly'],
-    "brand_mentions": [r'@\w+', r't\.me/\w+', r'переходи сюда', r'канал', r'бот'],
-    "cta_phrases": [r'подпишись', r'читай', r'узнай', r'начни', r'перейди', r'жми', r'вступай'],
-    "brand_words": [],  # Будет заполнено известными брендами
-    "emoji_threshold": 0.1,  # 10% эмодзи
-    "caps_threshold": 0.3    # 30% заглавных букв
-}
-
 app = Client("userbot_session", api_id=api_id, api_hash=api_hash)
 
-THEMES = {
-    "Художество": ["картина", "живопись", "художник", "рисунок", "арт", "галерея"],
-    "Литература": ["книга", "поэзия", "роман", "литература", "стих", "писатель"],
-    "Кино": ["фильм", "кино", "режиссер", "актер", "сериал", "премьера"],
-    "Музыка": ["музыка", "песня", "альбом", "концерт", "группа", "исполнитель"],
-}
-
 os.makedirs("images", exist_ok=True)
 os.makedirs("results", exist_ok=True)
 
-TASKS_FILE = "tasks.json"
 RESULTS_DIR = "results"
+BACKFILL_PAGE_LIMIT = 1000  # Сколько старых сообщений догружаем за одну задачу backfill
+TASKS_POLL_INTERVAL = 5  # Как часто (сек) забираем новые задачи из очереди
+STATS_LOG_INTERVAL = 60  # Как часто (сек) печатаем счетчики планировщика
+JOB_VISIBILITY_TIMEOUT = 15 * 60  # Аренда задачи; продлевается, пока задача выполняется
+
+REFRESH_BATCH_SIZE = 100  # Максимум id сообщений в одном вызове get_messages
+REFRESH_POSTS_LIMIT = 2000  # Сколько постов обновляем за один проход
+REFRESH_INTERVAL = 300  # Пауза (сек) между проходами обновления метрик
+REFRESH_CLAIM_TIMEOUT = datetime.timedelta(minutes=15)  # На сколько отодвигаем взятые в проход посты
+REFRESH_FAILURE_BACKOFF = datetime.timedelta(hours=1)  # Пауза для постов канала, если get_messages упал
 
 # --- SQLAlchemy async setup ---
 import sys
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from sqlalchemy import select, insert, update, delete
+from config import CRAWL_WORKERS, CRAWL_ACCOUNT_CONCURRENCY
+from crawl_scheduler import CrawlScheduler
+from job_queue import job_queue
+from rate_limiter import rate_limiter
+from topic_tagger import topic_tagger
+from similarity_index import similarity_index
+from daily_rollups import rollup_states, update_rollups
+from media_pipeline import MediaPipeline
+from post_classifier import (
+    CLASSIFIER_VERSION, POST_FORMATS, CTA_PATTERNS, AD_DETECTION,
+    detect_post_format, extract_cta, detect_ad_post, extract_title_and_body, extract_features
+)
 from bot.db import (
-    SessionLocal, Channel, Post, ChannelSnapshot, PostSnapshot, Base, Account, AccountStatus
+    engine, SessionLocal, Channel, Post, ChannelSnapshot, PostSnapshot, Base, Account, AccountStatus, PostRefresh
+)
+from channel_ingest import (
+    HISTORY_PAGE_SIZE, INITIAL_CRAWL_LIMIT, REFRESH_SCHEDULE,
+    save_channel_and_snapshot, message_date_utc, get_media_type, build_post_row, get_next_refresh,
+    build_post_snapshot_row, save_latest_metrics, save_posts_batch, save_post_and_snapshot,
+    load_crawl_state, update_crawl_state, ingest_history
 )
 
-def detect_post_format(text: str) -> str:
-    """Автоматически определяет формат поста"""
-    if not text:
-        return "other"
-    
-    text_lower = text.lower()
-    lines = text.split('\n')
-    
-    # Проверяем каждый формат
-    for format_key, format_data in POST_FORMATS.items():
-        pattern_matches = 0
-        condition_matches = 0
-        
-        # Проверяем паттерны
-        for pattern in format_data["patterns"]:
-            if re.search(pattern, text_lower):
-                pattern_matches += 1
-        
-        # Проверяем условия
-        for condition in format_data["conditions"]:
-            if condition in text_lower:
-                condition_matches += 1
-        
-        # Если найдено достаточно совпадений
-        if pattern_matches >= 1 and condition_matches >= 1:
-            return format_key
-    
-    return "other"
-
-def extract_cta(text: str) -> Optional[str]:
-    """Извлекает CTA из текста поста"""
-    if not text:
-        return None
-    
-    lines = text.split('\n')
-    # Проверяем последние 1-3 строки
-    for i in range(min(3, len(lines))):
-        line = lines[-(i+1)].strip()
-        for pattern in CTA_PATTERNS:
-            if re.search(pattern, line, re.IGNORECASE):
-                return line
-    
-    return None
+# Фоновая загрузка фото сохраненных постов с записью в таблицу media (создается в main_loop)
+media_pipeline: Optional[MediaPipeline] = None
 
-def detect_ad_post(text: str, title: str = None) -> bool:
-    """Определяет, является ли пост рекламным"""
-    if not text:
-        return False
+# --- Обновление метрик постов по затухающему расписанию ---
+async def refresh_post_metrics(limit: int = REFRESH_POSTS_LIMIT) -> Dict[str, int]:
+    """Перечитывает метрики постов, у которых подошло время обновления
     
-    text_lower = text.lower()
-    score = 0
+    Сообщения запрашиваются пачками до REFRESH_BATCH_SIZE id на канал,
+    снапшоты пишутся одним INSERT. После последней ступени снапшот помечается
+    is_final, а пост убирается из расписания.
     
-    # Проверяем внешние ссылки
-    for pattern in AD_DETECTION["external_links"]:
-        if re.search(pattern, text):
-            score += 2
+    Взятые посты в той же транзакции отодвигаются на REFRESH_CLAIM_TIMEOUT, поэтому
+    параллельные процессы их не возьмут повторно, а при падении процесса они вернутся
+    в проход. Посты канала, для которого get_messages упал, откладываются на
+    REFRESH_FAILURE_BACKOFF.
+    """
+    now = datetime.datetime.utcnow()
+    result = {"refreshed": 0, "finalized": 0, "missing": 0}
     
-    # Проверяем упоминания каналов/ботов
-    for pattern in AD_DETECTION["brand_mentions"]:
-        if re.search(pattern, text):
-            score += 2
-    
-    # Проверяем CTA фразы
-    for pattern in AD_DETECTION["cta_phrases"]:
-        if re.search(pattern, text):
-            score += 1
-    
-    # Проверяем количество эмодзи
-    emoji_count = len(re.findall(r'[^\w\s]', text))
-    if emoji_count / len(text) > AD_DETECTION["emoji_threshold"]:
-        score += 1
-    
-    # Проверяем количество заглавных букв
-    caps_count = len(re.findall(r'[А-Я]', text))
-    if caps_count / len(text) > AD_DETECTION["caps_threshold"]:
-        score += 1
-    
-    # Проверяем структуру (1 абзац + призыв)
-    paragraphs = text.split('\n\n')
-    if len(paragraphs) == 2 and extract_cta(paragraphs[-1]):
-        score += 2
+    async with SessionLocal() as session:
+        due = (
+            select(PostRefresh)
+            .where(PostRefresh.next_refresh_at <= now)
+            .order_by(PostRefresh.next_refresh_at)
+            .limit(limit)
+        )
+        if engine.dialect.name == "postgresql":
+            due = due.with_for_update(skip_locked=True)
+        due_rows = (await session.execute(due)).scalars().all()
+        if due_rows:
+            await session.execute(
+                update(PostRefresh)
+                .where(PostRefresh.post_id.in_([row.post_id for row in due_rows]))
+                .values(next_refresh_at=now + REFRESH_CLAIM_TIMEOUT)
+                .execution_options(synchronize_session=False)
+            )
+        await session.commit()
     
-    return score >= 3  # Если 3+ признака - это реклама
-
-def extract_title_and_body(text: str) -> tuple:
-    """Разделяет текст на заголовок и основной контент"""
-    if not text:
-        return None, text
+    if not due_rows:
+        return result
     
-    lines = text.split('\n')
-    first_line = lines[0].strip()
+    by_channel = {}
+    for row in due_rows:
+        by_channel.setdefault(row.channel_id, []).append(row)
     
-    # Проверяем, является ли первая строка заголовком
-    if (len(first_line) < 100 and 
-        not re.search(r'[.!?]{2,}', first_line) and
-        (first_line.startswith('🔴') or first_line.startswith('🔵') or 
-         first_line.startswith('⚡') or first_line[0].isupper() or
-         '!' in first_line)):
-        
-        title = first_line
-        body = '\n'.join(lines[1:]).strip()
-        return title, body
+    snapshot_rows = []
+    schedule_updates = []
+    finished_ids = []
+    for channel_id, rows in by_channel.items():
+        for i in range(0, len(rows), REFRESH_BATCH_SIZE):
+            chunk = {row.message_id: row for row in rows[i:i + REFRESH_BATCH_SIZE]}
+            try:
+                messages = await rate_limiter.call(app.name, "get_messages", app.get_messages, int(channel_id), list(chunk))
+            except Exception as e:
+                print(f"[refresher] Не удалось получить сообщения канала {channel_id}: {e}")
+                # Остаток канала откладываем, чтобы не дергать его каждый проход
+                schedule_updates.extend(
+                    {"post_id": row.post_id, "stage": row.stage, "next_refresh_at": now + REFRESH_FAILURE_BACKOFF}
+                    for row in rows[i:]
+                )
+                break
+            
+            if not isinstance(messages, list):
+                messages = [messages]
+            
+            for msg in messages:
+                row = chunk.pop(msg.id, None)
+                if row is None:
+                    continue
+                if getattr(msg, 'empty', False):
+                    finished_ids.append(row.post_id)
+                    result["missing"] += 1
+                    continue
+                
+                stage, next_refresh_at = get_next_refresh(row.posted_at, now)
+                snapshot_rows.append(build_post_snapshot_row(
+                    row.post_id, msg, now, is_final=next_refresh_at is None
+                ))
+                if next_refresh_at is None:
+                    finished_ids.append(row.post_id)
+                    result["finalized"] += 1
+                else:
+                    schedule_updates.append({
+                        "post_id": row.post_id,
+                        "stage": stage,
+                        "next_refresh_at": next_refresh_at
+                    })
+            
+            # Сообщения, которые Telegram не вернул, считаем удаленными
+            for row in chunk.values():
+                finished_ids.append(row.post_id)
+                result["missing"] += 1
     
-    return None, text
-
-async def save_channel_and_snapshot(chat):
     async with SessionLocal() as session:
-        # Проверяем, есть ли канал
-        channel_id = str(chat.id)
-        channel = await session.get(Channel, channel_id)
-        if not channel:
-            channel = Channel(
-                channel_id=channel_id,
-                username=chat.username or f"{chat.id}",
-                title=chat.title or chat.first_name or chat.username or str(chat.id),
-                description=getattr(chat, 'description', None),
-                is_bot_admin=False
-            )
-            session.add(channel)
-            await session.commit()
-        
-        # Сохраняем snapshot (если есть инфа о подписчиках)
-        try:
-            snapshot = ChannelSnapshot(
-                channel_snapshot_id=str(uuid.uuid4()),
-                channel_id=channel_id,
-                snapshot_date=datetime.datetime.utcnow(),
-                subscribers_count=getattr(chat, 'members_count', None),
-                reach_rate=None, avg_reactions=None, avg_reposts=None, avg_post_comments=None,
-                new_followers=None, lost_followers=None, silent_users_percent=None, active_users_percent=None,
-                posts_count=None, total_views=None, engagement_rate=None, source_info=None,
-                notification_percent=None, avg_positive_reactions=None, avg_negative_reactions=None
-            )
-            session.add(snapshot)
-            await session.commit()
-        except Exception as e:
-            print(f"[userbot] Не удалось сохранить snapshot канала: {e}")
+        if snapshot_rows:
+            post_ids = list({row["post_id"] for row in snapshot_rows})
+            rollups_before = await rollup_states(session, post_ids)
+            await session.execute(insert(PostSnapshot).values(snapshot_rows))
+            await save_latest_metrics(session, snapshot_rows)
+            await update_rollups(session, rollups_before, post_ids)
+        if schedule_updates:
+            await session.execute(update(PostRefresh), schedule_updates)
+        if finished_ids:
+            await session.execute(delete(PostRefresh).where(PostRefresh.post_id.in_(finished_ids)))
+        await session.commit()
+    
+    result["refreshed"] = len(snapshot_rows)
+    return result
 
-async def save_post_and_snapshot(chat_id, msg):
-    async with SessionLocal() as session:
-        post_id = f"{chat_id}_{msg.id}"
-        
-        # Получаем текст поста
-        post_text = msg.text or msg.caption or ""
-        
-        # Разделяем на заголовок и основной текст
-        title, body = extract_title_and_body(post_text)
-        
-        # Определяем формат поста
-        format_type = detect_post_format(post_text)
-        
-        # Извлекаем CTA
-        cta = extract_cta(post_text)
-        
-        # Определяем, является ли рекламным
-        is_ad = detect_ad_post(post_text, title)
-        
-        # Сохраняем пост
-        post = await session.get(Post, post_id)
-        if not post:
-            post = Post(
-                post_id=post_id,
-                channel_id=str(chat_id),
-                posted_at=msg.date,
-                title=title,
-                body=body,
-                is_ad=is_ad,
-                media_type='photo' if msg.photo else 'video' if msg.video else 'document' if msg.document else None,
-                has_poll=bool(getattr(msg, 'poll', None)),
-                format=format_type,
-                cta=cta,
-                topic=None,  # Можно реализовать автоопределение темы
-                tags=None
-            )
-            session.add(post)
-            await session.commit()
-        
-        # Сохраняем snapshot
+async def metrics_refresher_loop():
+    """Фоновое обновление метрик постов"""
+    while True:
         try:
-            # Вычисляем ER (engagement rate)
-            views = getattr(msg, 'views', 0)
-            reactions = msg.reactions.reactions if msg.reactions else []
-            total_reactions = sum(r.count for r in reactions)
-            er = (total_reactions / views * 100) if views > 0 else 0
-            
-            snapshot = PostSnapshot(
-                id=str(uuid.uuid4()),
-                post_id=post_id,
-                views_count=views,
-                views_info=None,
-                reactions=json.dumps({r.emoji: r.count for r in reactions}),
-                comments=None,
-                forwards=getattr(msg, 'forwards', None),
-                forwards_private=None,
-                er=er,
-                snapshot_date=datetime.datetime.utcnow(),
-                is_final=False
-            )
-            session.add(snapshot)
-            await session.commit()
+            result = await refresh_post_metrics()
+            if result["refreshed"] or result["missing"]:
+                print(f"[refresher] Обновлено: {result['refreshed']}, финальных: {result['finalized']}, "
+                      f"удалено: {result['missing']}")
         except Exception as e:
-            print(f"[userbot] Не удалось сохранить snapshot поста: {e}")
+            print(f"[refresher] Ошибка обновления метрик: {e}")
+        await asyncio.sleep(REFRESH_INTERVAL)
 
 # --- Управление аккаунтами ---
 async def check_account_status(account_id: str) -> bool:
@@ -368,24 +241,7 @@ def safe_truncate(text, max_length):
 
 def classify_theme(text):
     """Классифицирует тему поста"""
-    text_lower = text.lower()
-    for theme, keywords in THEMES.items():
-        if any(keyword in text_lower for keyword in keywords):
-            return theme
-    return "Другое"
-
-def load_tasks():
-    """Загружает задачи из файла"""
-    try:
-        with open(TASKS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
-
-def save_tasks(tasks):
-    """Сохраняет задачи в файл"""
-    with open(TASKS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(tasks, f, ensure_ascii=False, indent=2)
+    return topic_tagger.tag(text)["topic"] or "Другое"
 
 def save_result(user_id, channel, stat_text, all_posts):
     """Сохраняет результат анализа"""
@@ -401,33 +257,61 @@ def save_result(user_id, channel, stat_text, all_posts):
     with open(filename, 'w', encoding='utf-8') as f:
         json.dump(result, f, ensure_ascii=False, indent=2)
 
+# --- Инкрементальный обход истории ---
+async def iter_new_messages(chat_id, last_message_id: int):
+    """Отдает сообщения новее отметки, не запрашивая уже обойденные страницы"""
+    async for message in rate_limiter.iter_history(app.name, app, chat_id):
+        if message.id <= last_message_id:
+            break
+        yield message
+
 async def process_task(task):
-    """Обрабатывает задачу парсинга"""
+    """Обрабатывает задачу парсинга
+    
+    Обычная задача забирает только сообщения новее отметки last_message_id
+    (при первом обходе или с "full": true — последние INITIAL_CRAWL_LIMIT сообщений).
+    Задача с "type": "backfill" продолжает догрузку истории от oldest_message_id.
+    """
     user_id = task.get('user_id')
     channel = task.get('channel')
+    is_backfill = task.get('type') == 'backfill'
     
     print(f"[parser] Начинаю парсинг канала: {channel}")
     
     try:
         # Получаем информацию о канале
-        chat = await app.get_chat(channel)
+        chat = await rate_limiter.call(app.name, "get_chat", app.get_chat, channel)
         await save_channel_and_snapshot(chat)
         
-        # Парсим посты
-        posts = []
-        async for message in app.get_chat_history(channel, limit=100):
-            if message.text or message.caption:
-                await save_post_and_snapshot(chat.id, message)
-                
-                post_data = {
-                    "id": message.id,
-                    "text": message.text or message.caption or "",
-                    "date": message.date.isoformat(),
-                    "views": getattr(message, 'views', 0),
-                    "reactions": {r.emoji: r.count for r in message.reactions.reactions} if message.reactions else {},
-                    "forwards": getattr(message, 'forwards', 0)
-                }
-                posts.append(post_data)
+        channel_id = str(chat.id)
+        state = await load_crawl_state(channel_id)
+        
+        # Парсим посты, сохраняя их в БД постранично
+        if is_backfill:
+            if state and state.backfill_done:
+                print(f"[parser] История канала {channel} уже догружена")
+                return {"success": True, "stats": "", "posts": []}
+            offset_id = state.oldest_message_id if state and state.oldest_message_id else 0
+            history = rate_limiter.iter_history(app.name, app, chat.id, limit=BACKFILL_PAGE_LIMIT, offset_id=offset_id)
+        elif state is None or state.last_message_id is None or task.get('full'):
+            history = rate_limiter.iter_history(app.name, app, chat.id, limit=INITIAL_CRAWL_LIMIT)
+        else:
+            history = iter_new_messages(chat.id, state.last_message_id)
+        
+        batch = await ingest_history(chat, history, media_pipeline)
+        posts = batch["posts"]
+        
+        # При ошибке отметки покрывают только записанные страницы, а задача
+        # уходит на повтор через очередь
+        await update_crawl_state(
+            channel_id,
+            newest_id=batch["newest_id"],
+            oldest_id=batch["oldest_id"],
+            backfill_done=(batch["fetched"] < BACKFILL_PAGE_LIMIT) if is_backfill and not batch["error"] else None
+        )
+        if batch["error"]:
+            print(f"[parser] Парсинг {channel} прерван: {batch['error']}")
+            return {"success": False, "error": batch["error"]}
         
         # Анализируем статистику
         total_views = sum(p['views'] for p in posts)
@@ -464,32 +348,93 @@ async def process_task(task):
         print(f"[parser] Ошибка парсинга {channel}: {e}")
         return {"success": False, "error": str(e)}
 
+async def run_job(job: Dict, owner: str):
+    """Выполняет задачу из очереди, продлевая аренду, и подтверждает результат"""
+    async def keep_lease():
+        while True:
+            await asyncio.sleep(JOB_VISIBILITY_TIMEOUT / 3)
+            await job_queue.extend_lease(job["job_id"], owner, JOB_VISIBILITY_TIMEOUT)
+    
+    heartbeat = asyncio.create_task(keep_lease())
+    try:
+        result = await process_task(job["payload"])
+    finally:
+        heartbeat.cancel()
+    
+    if result.get("success"):
+        await job_queue.ack(job["job_id"], owner)
+    else:
+        await job_queue.fail(job["job_id"], owner, result.get("error", ""))
+    return result
+
 async def main_loop():
-    """Основной цикл парсинга"""
+    """Основной цикл парсинга: раздает задачи из очереди в БД воркерам планировщика"""
     print("[parser] Запуск парсера...")
     
-    # Запускаем мониторинг аккаунтов
+    global media_pipeline
+    media_pipeline = MediaPipeline(app, media_dir="images", record_to_db=True)
+    
+    # Запускаем мониторинг аккаунтов и обновление метрик постов
     asyncio.create_task(monitor_accounts())
+    asyncio.create_task(metrics_refresher_loop())
     
-    while True:
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    scheduler = CrawlScheduler(
+        lambda job: run_job(job, owner),
+        workers=CRAWL_WORKERS,
+        per_account_limit=CRAWL_ACCOUNT_CONCURRENCY,
+        accounts=1,
+        account_key=lambda job: app.name,  # Все задачи идут через один клиент
+        task_key=lambda job: job["payload"].get("channel")
+    )
+    await scheduler.start()
+    
+    # Корректная остановка: дорабатываем очередь и выходим
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
         try:
-            tasks = load_tasks()
-            if tasks:
-                task = tasks.pop(0)
-                save_tasks(tasks)
-                
-                result = await process_task(task)
-                print(f"[parser] Результат: {result}")
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows
+    
+    last_stats_at = time.monotonic()
+    while not stop_event.is_set():
+        try:
+            free_slots = scheduler.free_slots()
+            if free_slots:
+                jobs = await job_queue.lease(owner, limit=free_slots, visibility_timeout=JOB_VISIBILITY_TIMEOUT)
+                for job in jobs:
+                    if not await scheduler.submit(job):
+                        # Этот канал уже парсится — вернем задачу в очередь чуть позже
+                        await job_queue.release(job["job_id"], owner, delay=TASKS_POLL_INTERVAL * 12)
             
-            await asyncio.sleep(60)  # Проверяем каждую минуту
+            if time.monotonic() - last_stats_at >= STATS_LOG_INTERVAL:
+                stats = scheduler.get_stats()
+                print(f"[parser] Очередь: {stats['queue_depth']}, в работе: {stats['in_flight']}, "
+                      f"готово: {stats['processed']}, ошибок: {stats['failed']}")
+                last_stats_at = time.monotonic()
             
+            interval = TASKS_POLL_INTERVAL
         except Exception as e:
             print(f"[parser] Ошибка в главном цикле: {e}")
-            await asyncio.sleep(300)  # Ждем 5 минут при ошибке
+            interval = 300  # Ждем 5 минут при ошибке
+        
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+    
+    print("[parser] Остановка: дожидаюсь завершения задач в очереди...")
+    await scheduler.stop(drain=True)
+    await media_pipeline.drain()
+    media_pipeline.close()
+    # Несохраненный хвост индекса похожих постов
+    similarity_index.save()
 
 if __name__ == "__main__":
     async def runner():
         async with app:
             await main_loop()
     
-    asyncio.run(runner()) 
\ No newline at end of file
+    asyncio.run(runner())